@@ -3,3 +3,4 @@ backend provides the dashboard with raw data to process.
 """
 
 from .serialhandler import SerialHandler #, parse_line
+from .ringbuffer import FrameRing
@@ -0,0 +1,427 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Acquisition from several devices on one asyncio event loop.
+
+An AcquisitionLoop runs one event loop in one thread. Every Device on it
+combines a transport, a parser and a frame sink:
+
+- SerialTransport reads the non-blocking file descriptor of the serial
+  port when the loop reports it readable, so serial devices need no
+  thread of their own.
+- BleTransport runs the blocking calls of the Bluefruit LE provider in an
+  executor of one thread.
+- LineParser (ASCII protocol) and BinaryParser (framing.py) turn the
+  received chunks into frames, splitting and decoding whole chunks at
+  once instead of handling the bytes one by one.
+- the sink is a callable or an object with a put method (FrameRing,
+  queue.Queue). It is called on the loop thread and must not block.
+
+    loop = get_loop()
+    device = loop.add_device('/dev/ttyUSB0', SerialTransport('/dev/ttyUSB0'),
+                             LineParser('d'), ring)
+    device.write(b'd')
+    ...
+    device.close()
+
+SerialHandler.connect(port, backend='asyncio') connects through the
+shared loop of get_loop().
+"""
+from __future__ import absolute_import
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+
+import serial
+
+from .framing import FrameDecoder
+from .serialhandler import parse_frame
+from .. import metrics
+
+logger = logging.getLogger(__name__)
+
+# largest chunk read at once from a file descriptor
+READ_SIZE = 65536
+
+_LINES_PARSED = metrics.LINES.labels('parsed')
+_LINES_REJECTED = metrics.LINES.labels('rejected')
+_FRAMES_OK = metrics.BINARY_FRAMES.labels('ok')
+_FRAMES_CRC_ERROR = metrics.BINARY_FRAMES.labels('crc_error')
+
+
+class LineParser:
+    """
+    Frames of the ASCII line protocol.
+
+    Parameters
+    ----------
+    mode : str
+        mode of the line protocol (see parse_frame), may be changed
+        while the device streams
+    terminator : bytes
+        end of a line, b'\\r' for the BLE UART
+    max_line : int
+        longest incomplete line kept, longer garbage is dropped
+    """
+
+    framing = 'ascii'
+
+    def __init__(self, mode='d', terminator=b'\n', max_line=1 << 20):
+        self.mode = mode
+        self.terminator = terminator
+        self.max_line = max_line
+        self.last_line = ''
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """ add received bytes, return the frames of the complete lines """
+        buf = self._buffer
+        buf.extend(data)
+        end = buf.rfind(self.terminator)
+        if end < 0:
+            if len(buf) > self.max_line:
+                del buf[:]
+                _LINES_REJECTED.inc()
+            return []
+        lines = bytes(buf[:end]).split(self.terminator)
+        del buf[:end + len(self.terminator)]
+
+        frames = []
+        mode = self.mode
+        for line in lines:
+            values = parse_frame(line.decode('utf-8', 'replace'), mode)
+            if values is not None:
+                frames.append(values)
+        self.last_line = lines[-1].decode('utf-8', 'replace')
+        _LINES_PARSED.inc(len(frames))
+        _LINES_REJECTED.inc(len(lines) - len(frames))
+        return frames
+
+
+class BinaryParser:
+    """ frames of the binary protocol, see framing.FrameDecoder """
+
+    framing = 'binary'
+
+    def __init__(self):
+        self.decoder = FrameDecoder()
+
+    def feed(self, data):
+        n_errors = self.decoder.n_crc_errors
+        frames = [values for _, values in self.decoder.feed(data)]
+        _FRAMES_OK.inc(len(frames))
+        if self.decoder.n_crc_errors != n_errors:
+            _FRAMES_CRC_ERROR.inc(self.decoder.n_crc_errors - n_errors)
+        return frames
+
+
+class SerialTransport:
+    """
+    Serial port read through its non-blocking file descriptor.
+
+    On event loops without add_reader (the Windows proactor loop) the
+    port is polled in the default executor instead.
+    """
+
+    label = None
+
+    def __init__(self, port, baudrate=115200):
+        self.port = port
+        self.baudrate = baudrate
+        self._serial = None
+        self._lost = None
+
+    def open(self):
+        self._serial = serial.Serial(
+            self.port, self.baudrate, bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE,
+            timeout=0, write_timeout=2)
+
+    async def run(self, protocol):
+        """ feed the received chunks to `protocol` until the port closes """
+        loop = asyncio.get_running_loop()
+        try:
+            fd = self._serial.fileno()
+            os.set_blocking(fd, False)
+        except (AttributeError, OSError):
+            fd = None
+        self._lost = loop.create_future()
+        try:
+            if fd is None:
+                raise NotImplementedError
+            loop.add_reader(fd, self._on_readable, fd, protocol)
+        except NotImplementedError:
+            await self._poll(loop, protocol)
+            return
+        try:
+            await self._lost
+        finally:
+            loop.remove_reader(fd)
+
+    def _on_readable(self, fd, protocol):
+        if self._lost.done():
+            return
+        try:
+            data = os.read(fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            self._lost.set_exception(err)
+            return
+        if not data:
+            self._lost.set_result(None)
+            return
+        try:
+            protocol.data_received(data)
+        except Exception as err:
+            self._lost.set_exception(err)
+
+    async def _poll(self, loop, protocol):
+        ser = self._serial
+        ser.timeout = 0.1
+        while ser.is_open:
+            data = await loop.run_in_executor(
+                None, lambda: ser.read(max(ser.in_waiting, 1)))
+            if data:
+                protocol.data_received(data)
+
+    async def write(self, data):
+        # short commands, pyserial waits for the non-blocking fd itself
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._serial.write, data)
+
+    def close(self):
+        if self._serial is not None:
+            self._serial.close()
+
+
+class BleTransport:
+    """
+    UART service of a Bluefruit LE device, through the blocking provider
+    of OpenEIT.backend.bluetooth run in an executor of one thread.
+    """
+
+    label = 'ble'
+
+    def __init__(self, read_timeout=1.0, connect_timeout=60):
+        self.read_timeout = read_timeout
+        self.connect_timeout = connect_timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix='ble')
+        self._device = None
+        self._uart = None
+        self._closed = False
+
+    def open(self):
+        # the provider is set up on the executor thread, see run
+        pass
+
+    def _connect(self):
+        from .bluetooth import Adafruit_BluefruitLE
+        from .bluetooth.Adafruit_BluefruitLE.services import UART
+
+        ble = Adafruit_BluefruitLE.get_provider()
+        ble.initialize()
+        ble.clear_cached_data()
+        adapter = ble.get_default_adapter()
+        adapter.power_on()
+        UART.disconnect_devices()
+        try:
+            adapter.start_scan()
+            device = UART.find_device(timeout_sec=self.connect_timeout)
+            if device is None:
+                raise RuntimeError('Failed to find UART device!')
+        finally:
+            adapter.stop_scan()
+        device.connect(timeout_sec=self.connect_timeout)
+        UART.discover(device, timeout_sec=self.connect_timeout)
+        self._device = device
+        self._uart = UART(device)
+        logger.info('connected to %s', device.name)
+
+    async def run(self, protocol):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._connect)
+        while not self._closed and self._device.is_connected:
+            data = await loop.run_in_executor(
+                self._executor, self._uart.read, self.read_timeout)
+            if data:
+                protocol.data_received(data)
+
+    async def write(self, data):
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._uart.write, data)
+
+    def close(self):
+        self._closed = True
+        device = self._device
+        if device is not None:
+            try:
+                device.disconnect()
+            except Exception as err:
+                logger.info('problem disconnecting the bluetooth: %s', err)
+        self._executor.shutdown(wait=False)
+
+
+class Device:
+    """
+    A streaming device on an AcquisitionLoop, created by add_device.
+    write and close may be called from any thread.
+    """
+
+    def __init__(self, name, transport, parser, sink, loop, loop_thread,
+                 on_close=None):
+        self.name = name
+        self.transport = transport
+        self.parser = parser
+        self.n_bytes = 0
+        self.n_frames = 0
+        self._put = sink.put if hasattr(sink, 'put') else sink
+        self._loop = loop
+        self._loop_thread = loop_thread
+        self._on_close = on_close
+        self._task = None
+        self._bytes = metrics.SERIAL_BYTES.labels(
+            transport.label or parser.framing)
+
+    def data_received(self, data):
+        """ loop thread: parse a chunk and hand its frames to the sink """
+        self.n_bytes += len(data)
+        self._bytes.inc(len(data))
+        frames = self.parser.feed(data)
+        for values in frames:
+            self._put(values)
+        self.n_frames += len(frames)
+
+    async def _run(self):
+        """ stream until the connection is lost (on_close) or closed """
+        exc = None
+        try:
+            await self.transport.run(self)
+        except asyncio.CancelledError:
+            self.transport.close()
+            raise
+        except Exception as err:
+            exc = err
+            logger.error('%s: connection lost %s', self.name, err)
+        else:
+            logger.info('%s: connection lost', self.name)
+        finally:
+            self.transport.close()
+        if self._on_close is not None:
+            self._on_close(self, exc)
+
+    @property
+    def connected(self):
+        return self._task is not None and not self._task.done()
+
+    def write(self, data, timeout=5.):
+        asyncio.run_coroutine_threadsafe(
+            self.transport.write(data), self._loop).result(timeout)
+
+    def close(self, timeout=5.):
+        """ stop streaming and close the transport """
+        task = self._task
+        if task is None or task.done():
+            return
+
+        async def cancel():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        if threading.current_thread() is self._loop_thread:
+            task.cancel()
+        else:
+            asyncio.run_coroutine_threadsafe(cancel(), self._loop).result(
+                timeout)
+
+    def stats(self):
+        return {'connected': self.connected, 'bytes': self.n_bytes,
+                'frames': self.n_frames}
+
+
+class AcquisitionLoop:
+    """ one event loop thread streaming any number of devices """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._devices = {}
+
+    def start(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._loop.run_forever, daemon=True, name='acquisition')
+            self._thread.start()
+
+    def add_device(self, name, transport, parser, sink, on_close=None,
+                   timeout=None):
+        """
+        Open `transport` and start streaming it. Raises the error of the
+        transport if it can not be opened (serial.SerialException).
+        """
+        self.start()
+        with self._lock:
+            old = self._devices.get(name)
+            if old is not None and old.connected:
+                raise RuntimeError('%s is already streaming' % name)
+        device = Device(name, transport, parser, sink, self._loop,
+                        self._thread, on_close)
+
+        async def start():
+            transport.open()
+            device._task = asyncio.get_running_loop().create_task(
+                device._run())
+
+        asyncio.run_coroutine_threadsafe(start(), self._loop).result(timeout)
+        with self._lock:
+            self._devices[name] = device
+        return device
+
+    def remove_device(self, name):
+        with self._lock:
+            device = self._devices.pop(name, None)
+        if device is not None:
+            device.close()
+
+    def devices(self):
+        with self._lock:
+            return dict(self._devices)
+
+    def stats(self):
+        """ bytes and frames received by every device """
+        return {name: device.stats() for name, device in self.devices().items()}
+
+    def close(self):
+        """ close all devices and stop the loop """
+        for name in list(self.devices()):
+            self.remove_device(name)
+        with self._lock:
+            loop, self._loop = self._loop, None
+            thread, self._thread = self._thread, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+
+_default_loop = None
+_default_lock = threading.Lock()
+
+
+def get_loop():
+    """ the AcquisitionLoop shared by the handlers of this process """
+    global _default_loop
+    with _default_lock:
+        if _default_loop is None:
+            _default_loop = AcquisitionLoop()
+        return _default_loop
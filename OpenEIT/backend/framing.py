@@ -0,0 +1,189 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Binary framing of the measurement stream.
+
+The ASCII line protocol sends every value as decimal text, about 20 bytes
+per value. The binary frames carry the same measurements as float32 (4
+bytes per value) or as scaled int16 (2 bytes per value):
+
+    offset  size  field
+    0       2     sync word 0xA5 0x5A
+    2       2     payload length in bytes (uint16, little endian)
+    4       1     mode, the ASCII character of the line protocol ('d', ...)
+    5       1     payload type, DTYPE_FLOAT32 or DTYPE_INT16
+    6       n     payload: float32 values, or a float32 scale followed
+                  by int16 values (value = scale * int16)
+    6+n     4     CRC-32 (zlib) of the bytes 2 .. 6+n
+
+All fields are little endian. The decoder resynchronizes on the sync word
+after garbage or a corrupted frame.
+"""
+from __future__ import absolute_import
+import struct
+import zlib
+
+import numpy as np
+import serial.threaded
+
+SYNC = b'\xa5\x5a'
+DTYPE_FLOAT32 = 1
+DTYPE_INT16 = 2
+MAX_PAYLOAD = 16384
+
+_HEADER = struct.Struct('<2sHBB')
+_CRC = struct.Struct('<I')
+_SCALE = struct.Struct('<f')
+
+_LINE_FORMATS = {'a': ('', ','), 'b': ('magnitudes : ', ';')}
+
+
+def encode_frame(values, mode='d', dtype=DTYPE_FLOAT32, scale=None):
+    """
+    Encode one frame of measurements.
+
+    Parameters
+    ----------
+    values : array_like
+        the measurements of the frame
+    mode : str
+        mode character of the line protocol, stored in the header
+    dtype : int
+        DTYPE_FLOAT32 or DTYPE_INT16
+    scale : float, optional
+        quantization step of DTYPE_INT16, the default maps the largest
+        absolute value to 32767
+
+    Returns
+    -------
+    bytes
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if dtype == DTYPE_FLOAT32:
+        payload = values.astype('<f4').tobytes()
+    elif dtype == DTYPE_INT16:
+        if scale is None:
+            peak = np.max(np.abs(values)) if values.size else 0.
+            scale = peak / 32767. if peak > 0 else 1.
+        counts = np.clip(np.round(values / scale), -32768, 32767)
+        payload = _SCALE.pack(scale) + counts.astype('<i2').tobytes()
+    else:
+        raise ValueError('unknown payload type %r' % (dtype,))
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError('frame of %d values is too long' % values.size)
+
+    body = _HEADER.pack(SYNC, len(payload), ord(mode[0]), dtype)[2:] + payload
+    return SYNC + body + _CRC.pack(zlib.crc32(body) & 0xffffffff)
+
+
+def encode_line(values, mode='d'):
+    """ the same frame in the ASCII line protocol (see parse_any_line) """
+    prefix, sep = _LINE_FORMATS.get(mode[0], ('magnitudes : ', ','))
+    return prefix + sep.join([repr(float(v)) for v in values]) + '\n'
+
+
+def _decode_payload(payload, dtype):
+    if dtype == DTYPE_FLOAT32:
+        if len(payload) % 4:
+            return None
+        return np.frombuffer(payload, dtype='<f4').astype(np.float64)
+    if len(payload) < _SCALE.size or (len(payload) - _SCALE.size) % 2:
+        return None
+    scale, = _SCALE.unpack_from(payload)
+    counts = np.frombuffer(payload, dtype='<i2', offset=_SCALE.size)
+    return counts * float(scale)
+
+
+class FrameDecoder:
+    """
+    Incremental decoder of a binary frame stream.
+
+    Bytes are fed as they arrive, complete frames are returned as
+    (mode, values) pairs, values being float64 arrays. Bytes that do not
+    belong to a valid frame are skipped and counted.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.n_frames = 0
+        self.n_crc_errors = 0
+        self.n_skipped_bytes = 0
+
+    def feed(self, data):
+        """ add received bytes, return the list of complete frames """
+        buf = self._buffer
+        buf.extend(data)
+        frames = []
+        pos = 0
+        end = len(buf)
+        while True:
+            start = buf.find(SYNC, pos)
+            if start < 0:
+                # keep a trailing first sync byte, it may be completed
+                keep = end - 1 if end > pos and buf[end - 1] == SYNC[0] else end
+                self.n_skipped_bytes += keep - pos
+                pos = keep
+                break
+            self.n_skipped_bytes += start - pos
+            pos = start
+            if end - pos < _HEADER.size:
+                break
+            _, length, mode, dtype = _HEADER.unpack_from(buf, pos)
+            if (length > MAX_PAYLOAD or
+                    dtype not in (DTYPE_FLOAT32, DTYPE_INT16)):
+                # not a header, look for the next sync word
+                self.n_skipped_bytes += 1
+                pos += 1
+                continue
+            frame_end = pos + _HEADER.size + length + _CRC.size
+            if frame_end > end:
+                break
+            body = bytes(buf[pos + 2:frame_end - _CRC.size])
+            crc, = _CRC.unpack_from(buf, frame_end - _CRC.size)
+            values = None
+            if zlib.crc32(body) & 0xffffffff == crc:
+                values = _decode_payload(body[_HEADER.size - 2:], dtype)
+            if values is None:
+                self.n_crc_errors += 1
+                self.n_skipped_bytes += 1
+                pos += 1
+                continue
+            frames.append((chr(mode), values))
+            self.n_frames += 1
+            pos = frame_end
+        del buf[:pos]
+        return frames
+
+    def reset(self):
+        """ drop the bytes of an incomplete frame """
+        del self._buffer[:]
+
+
+class FrameReader(serial.threaded.Protocol):
+    """
+    serial.threaded protocol reading binary frames, the counterpart of
+    serial.threaded.LineReader for the ASCII protocol. Subclasses
+    implement handle_frame.
+    """
+
+    def __init__(self):
+        self.decoder = FrameDecoder()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        for mode, values in self.decoder.feed(data):
+            self.handle_frame(mode, values)
+
+    def handle_frame(self, mode, values):
+        """ process one decoded frame, values is a float64 array """
+        raise NotImplementedError('please implement functionality in handle_frame')
+
+    def connection_lost(self, exc):
+        self.transport = None
+        super(FrameReader, self).connection_lost(exc)
@@ -0,0 +1,229 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Playback of recorded sessions into the data queue.
+
+A PlaybackEngine thread puts the frames of a Recording into the frame
+ring the serial handler feeds, so the reconstruction and the dashboard
+run on a capture exactly as on the device. The pace is set by `speed`:
+
+- 1.0 plays the frames at their recorded timestamps (real time),
+- N plays them N times faster,
+- None plays them as fast as one consumer (`pace_reader`, normally the
+  reconstruction) takes them, which measures the throughput of the
+  pipeline on real captures. While that consumer is paused (another mode
+  is shown, see RingReader.pause) nothing sets the pace and the frames
+  are put as fast as the ring takes them.
+
+The engine can be paused, sought and looped while it runs, stats()
+reports the achieved frame rate and how far playback is behind.
+"""
+from __future__ import absolute_import
+import collections
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# frame rate assumed for recordings without timestamps nor sample rate
+# (text captures converted without --sample-rate)
+DEFAULT_RATE = 5.0
+
+# frames over which the achieved frame rate is measured
+RATE_WINDOW = 64
+
+
+class PlaybackEngine(threading.Thread):
+    """
+    Thread feeding the frames of `recording` into `ring`.
+
+    Parameters
+    ----------
+    recording : Recording
+        frames to play, see recording.py
+    ring : FrameRing
+        queue of the consumers
+    speed : float or None
+        multiple of real time, None for as fast as `pace_reader` reads
+    loop : bool
+        start over at the end instead of pausing
+    pace_reader : RingReader, optional
+        consumer that sets the pace when speed is None, unless it is
+        paused
+    max_lag : int
+        frames `pace_reader` may be behind when speed is None
+    """
+
+    def __init__(self, recording, ring, speed=1.0, loop=False,
+                 pace_reader=None, max_lag=1):
+        super(PlaybackEngine, self).__init__(daemon=True, name='playback')
+        self._check_speed(speed)
+        self.recording = recording
+        self.ring = ring
+        self.speed = speed
+        self.loop = loop
+        self.pace_reader = pace_reader
+        self.max_lag = max_lag
+        self.frames_played = 0
+        self.lag = 0.
+        self.ended = False
+        self._cond = threading.Condition()
+        self._playing = False
+        self._closed = False
+        self._position = 0
+        # (wall clock, recording time) the schedule is counted from, and
+        # the time the last frame was due
+        self._anchor = None
+        self._last_due = None
+        self._played = collections.deque(maxlen=RATE_WINDOW)
+
+    @staticmethod
+    def _check_speed(speed):
+        if speed is not None and not speed > 0:
+            raise ValueError('speed must be positive or None, got %r' % speed)
+
+    @property
+    def position(self):
+        """ index of the next frame """
+        return self._position
+
+    @property
+    def playing(self):
+        return self._playing
+
+    def play(self):
+        with self._cond:
+            self._playing = True
+            self.ended = False
+            self._anchor = None
+            self._played.clear()
+            self._cond.notify_all()
+
+    def pause(self):
+        with self._cond:
+            self._playing = False
+            self._cond.notify_all()
+
+    def seek(self, index):
+        """ play frame `index` next """
+        with self._cond:
+            self._position = min(max(int(index), 0), len(self.recording))
+            self.ended = False
+            self._anchor = None
+            self._cond.notify_all()
+
+    def set_speed(self, speed):
+        self._check_speed(speed)
+        with self._cond:
+            self.speed = speed
+            self._anchor = None
+            self._played.clear()
+            self._cond.notify_all()
+
+    def close(self):
+        """ stop the thread """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self.is_alive():
+            self.join()
+
+    def _frame_time(self, index):
+        t = float(self.recording.times[index])
+        if math.isfinite(t):
+            return t
+        return index / (self.recording.sample_rate or DEFAULT_RATE)
+
+    def _next_frame(self):
+        """
+        Wait until the next frame is due, lock held. Returns its index
+        and the time it was due (None at full speed), or None to check
+        the state again.
+        """
+        while not self._closed and not self._playing:
+            self._cond.wait()
+        if self._closed:
+            return None
+        if self._position >= len(self.recording):
+            if self.loop and len(self.recording) > 0:
+                self._position = 0
+                self._anchor = None
+                if self._last_due is not None and self.speed is not None:
+                    # one frame period between the last and the first frame
+                    period = 1. / (self.recording.sample_rate or DEFAULT_RATE)
+                    self._anchor = (self._last_due + period / self.speed,
+                                    self._frame_time(0))
+            else:
+                self._playing = False
+                self.ended = True
+                return None
+        index = self._position
+        if self.speed is None:
+            return index, None
+        t = self._frame_time(index)
+        if self._anchor is None:
+            self._anchor = (time.perf_counter(), t)
+        due = self._anchor[0] + (t - self._anchor[1]) / self.speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            # pause, seek and close wake the wait up
+            self._cond.wait(delay)
+            return None
+        return index, due
+
+    def run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    break
+                frame = self._next_frame()
+            if frame is None:
+                continue
+            index, due = frame
+            pace = self.pace_reader
+            if due is None and pace is not None and not pace.paused:
+                if not self.ring.wait_lag(pace, self.max_lag, timeout=0.1):
+                    continue
+            self.ring.put(self.recording.frame(index))
+            now = time.perf_counter()
+            with self._cond:
+                if self._position == index:
+                    # not sought meanwhile
+                    self._position = index + 1
+                self.frames_played += 1
+                self._played.append(now)
+                self.lag = now - due if due is not None else 0.
+                self._last_due = due
+
+    def frame_rate(self):
+        """ frames per second over the last RATE_WINDOW frames """
+        with self._cond:
+            if not self._playing or len(self._played) < 2:
+                return 0.
+            span = self._played[-1] - self._played[0]
+            return (len(self._played) - 1) / span if span > 0 else 0.
+
+    def stats(self):
+        """ position, achieved and target frame rate, lag """
+        rate = self.frame_rate()
+        recorded = self.recording.sample_rate or DEFAULT_RATE
+        return {
+            'position': self._position,
+            'n_frames': len(self.recording),
+            'playing': self._playing,
+            'ended': self.ended,
+            'speed': self.speed,
+            'frames_played': self.frames_played,
+            'frame_rate': rate,
+            'target_rate': None if self.speed is None else recorded * self.speed,
+            # seconds behind the schedule, and frames the pacing
+            # consumer did not read yet
+            'lag_seconds': self.lag,
+            'queue_lag': (self.pace_reader.qsize()
+                          if self.pace_reader is not None else None),
+        }
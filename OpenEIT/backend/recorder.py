@@ -0,0 +1,255 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Streaming recorder of parsed frames.
+
+The frames are written by a background thread to a chunked binary file,
+the reader thread only hands them over through a bounded queue, so a
+recording costs neither memory nor time on the acquisition path
+whatever its length.
+
+File layout (little endian)::
+
+    file header   magic 'OEITREC1', version (uint16), mode (8 bytes),
+                  start time (float64), padded to HEADER_SIZE bytes
+    chunk         magic 'CHNK', n_frames (uint32), n_values (uint32),
+                  timestamps float64[n_frames],
+                  values float64[n_frames, n_values]
+    ...
+    index         one INDEX_ENTRY per chunk: file offset of the chunk,
+                  first frame number, n_frames, n_values, first and
+                  last timestamp
+    trailer       magic 'OEITIDX1', number of chunks (uint64),
+                  file offset of the index (uint64)
+
+Chunks are written every `chunk_frames` frames, when the frame length
+changes and at least every `flush_interval` seconds. The index is
+written on close, a file that was not closed (crash, recording in
+progress) is indexed by scanning its chunks.
+"""
+from __future__ import absolute_import
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from .framing import encode_line
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'OEITREC1'
+VERSION = 1
+HEADER_SIZE = 64
+CHUNK_MAGIC = b'CHNK'
+INDEX_MAGIC = b'OEITIDX1'
+
+_HEADER = struct.Struct('<8sH8sd')
+_CHUNK = struct.Struct('<4sII')
+_TRAILER = struct.Struct('<8sQQ')
+INDEX_ENTRY = np.dtype([('offset', '<u8'), ('first_frame', '<u8'),
+                        ('n_frames', '<u4'), ('n_values', '<u4'),
+                        ('t_first', '<f8'), ('t_last', '<f8')])
+
+_STOP = object()
+
+
+class Recorder:
+    """
+    Append timestamped frames to a recording file from a writer thread.
+
+    Parameters
+    ----------
+    path : str
+        file to create
+    mode : str
+        mode of the line protocol, stored in the header
+    max_buffered : int
+        frames waiting for the writer, further frames are dropped and
+        counted in `dropped` rather than blocking the caller
+    chunk_frames : int
+        frames per chunk
+    flush_interval : float
+        longest time in seconds a frame stays in memory
+    """
+
+    def __init__(self, path, mode='d', max_buffered=1024, chunk_frames=256,
+                 flush_interval=1.0):
+        self.path = path
+        self.mode = mode
+        self.chunk_frames = chunk_frames
+        self.flush_interval = flush_interval
+        self.n_frames = 0
+        self.dropped = 0
+        self.start_time = time.time()
+        self._queue = queue.Queue(maxsize=max_buffered)
+        self._index = []
+        self._closed = False
+        # a frame is either queued before _STOP or refused, see close
+        self._lock = threading.Lock()
+
+        self._file = open(path, 'wb')
+        header = _HEADER.pack(MAGIC, VERSION, mode.encode()[:8], self.start_time)
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='recorder')
+        self._thread.start()
+
+    def write(self, values, timestamp=None):
+        """ queue one frame, returns False if it was dropped """
+        if timestamp is None:
+            timestamp = time.time()
+        frame = np.array(values, dtype=np.float64).ravel()
+        with self._lock:
+            if self._closed:
+                return False
+            try:
+                self._queue.put_nowait((timestamp, frame))
+            except queue.Full:
+                self.dropped += 1
+                return False
+        return True
+
+    def _run(self):
+        times = np.empty(self.chunk_frames)
+        values = None
+        n = 0
+        last_flush = time.time()
+        while True:
+            timeout = max(self.flush_interval - (time.time() - last_flush), 0.)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                if n > 0:
+                    self._write_chunk(times[:n], values[:n])
+                break
+            if item is not None:
+                timestamp, frame = item
+                if values is None or frame.size != values.shape[1]:
+                    # a chunk holds frames of one length
+                    if n > 0:
+                        self._write_chunk(times[:n], values[:n])
+                        n = 0
+                    values = np.empty((self.chunk_frames, frame.size))
+                times[n] = timestamp
+                values[n] = frame
+                n += 1
+                if n == self.chunk_frames:
+                    self._write_chunk(times, values)
+                    n = 0
+            if time.time() - last_flush >= self.flush_interval:
+                if n > 0:
+                    self._write_chunk(times[:n], values[:n])
+                    n = 0
+                self._file.flush()
+                last_flush = time.time()
+
+    def _write_chunk(self, times, values):
+        offset = self._file.tell()
+        self._file.write(_CHUNK.pack(CHUNK_MAGIC, values.shape[0],
+                                     values.shape[1]))
+        self._file.write(np.ascontiguousarray(times, dtype='<f8').tobytes())
+        self._file.write(np.ascontiguousarray(values, dtype='<f8').tobytes())
+        self._index.append((offset, self.n_frames, values.shape[0],
+                            values.shape[1], times[0], times[-1]))
+        self.n_frames += values.shape[0]
+
+    def close(self):
+        """ write the pending frames and the index, close the file """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        # every accepted frame is already queued, ahead of _STOP
+        self._queue.put(_STOP)
+        self._thread.join()
+        index = np.array(self._index, dtype=INDEX_ENTRY)
+        offset = self._file.tell()
+        self._file.write(index.tobytes())
+        self._file.write(_TRAILER.pack(INDEX_MAGIC, len(index), offset))
+        self._file.close()
+        if self.dropped:
+            logger.warning('recording %s: %d frames dropped', self.path,
+                           self.dropped)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_header(f):
+    """ (mode, start time) from the header of an open recording """
+    f.seek(0)
+    magic, version, mode, start_time = _HEADER.unpack(
+        f.read(HEADER_SIZE)[:_HEADER.size])
+    if magic != MAGIC:
+        raise ValueError('not an OpenEIT recording')
+    if version > VERSION:
+        raise ValueError('recording version %d is not supported' % version)
+    return mode.rstrip(b'\0').decode(), start_time
+
+
+def _scan_index(f):
+    """ index of a file without trailer, stops at a truncated chunk """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    entries = []
+    offset = HEADER_SIZE
+    first = 0
+    while offset + _CHUNK.size <= size:
+        f.seek(offset)
+        magic, n_frames, n_values = _CHUNK.unpack(f.read(_CHUNK.size))
+        end = offset + _CHUNK.size + 8 * n_frames * (1 + n_values)
+        if magic != CHUNK_MAGIC or n_frames == 0 or end > size:
+            break
+        times = np.frombuffer(f.read(8 * n_frames), dtype='<f8')
+        entries.append((offset, first, n_frames, n_values, times[0], times[-1]))
+        first += n_frames
+        offset = end
+    return np.array(entries, dtype=INDEX_ENTRY)
+
+
+def read_index(f):
+    """ chunk index of an open recording (see INDEX_ENTRY) """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if size >= HEADER_SIZE + _TRAILER.size:
+        f.seek(size - _TRAILER.size)
+        magic, n_chunks, offset = _TRAILER.unpack(f.read(_TRAILER.size))
+        if magic == INDEX_MAGIC:
+            f.seek(offset)
+            return np.frombuffer(f.read(n_chunks * INDEX_ENTRY.itemsize),
+                                 dtype=INDEX_ENTRY)
+    return _scan_index(f)
+
+
+def read_chunk(f, entry):
+    """ (timestamps, values) of the chunk of an index entry """
+    n, m = int(entry['n_frames']), int(entry['n_values'])
+    f.seek(int(entry['offset']) + _CHUNK.size)
+    times = np.frombuffer(f.read(8 * n), dtype='<f8')
+    values = np.frombuffer(f.read(8 * n * m), dtype='<f8').reshape(n, m)
+    return times, values
+
+
+def iter_lines(path):
+    """
+    The frames of a recording as lines of the ASCII protocol, read chunk
+    by chunk (for downloads and the tools that read text captures).
+    """
+    with open(path, 'rb') as f:
+        mode, _ = read_header(f)
+        for entry in read_index(f):
+            _, values = read_chunk(f, entry)
+            yield ''.join([encode_line(v, mode) for v in values])
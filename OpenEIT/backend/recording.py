@@ -0,0 +1,380 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Memory-mapped recordings for playback.
+
+A frame file holds the frames of a session as fixed-stride records after
+a small header, so it is opened with ``np.memmap`` without reading it:
+opening a multi-gigabyte session is instant, frame i is found at
+``data_offset + i * stride`` and a range of frames is a zero-copy view.
+
+File layout (little endian)::
+
+    header   magic 'OEITFRM1', version (uint16), mode (8 bytes),
+             n_el (uint16), n_values (uint32), sample rate (float64,
+             0 if unknown), start time (float64), data offset (uint64),
+             padded to HEADER_SIZE bytes
+    records  timestamp (float64), values float64[n_values], one per frame
+
+The number of frames follows from the file size, so a file that is still
+being written can be opened as well. All frames of a file have the same
+length, frames of another length are skipped on conversion.
+
+Text captures (simdata.txt, the dashboard downloads) and the streaming
+recordings of recorder.py are converted once with::
+
+    python -m OpenEIT.backend.recording simdata.txt -o simdata.oeitf
+        [--mode d] [--n-el 16] [--sample-rate 10]
+"""
+from __future__ import absolute_import
+import argparse
+import logging
+import os
+import struct
+import sys
+
+import numpy as np
+
+from . import recorder
+from .serialhandler import infer_n_el, iter_chunks, parse_frames
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'OEITFRM1'
+VERSION = 1
+HEADER_SIZE = 64
+
+_HEADER = struct.Struct('<8sH8sHIddQ')
+
+
+def record_dtype(n_values):
+    """ dtype of one frame record """
+    return np.dtype([('time', '<f8'), ('values', '<f8', (n_values,))])
+
+
+def _n_el_or_unknown(n_values):
+    """ electrodes of frames of `n_values` values, 0 if they do not say """
+    try:
+        return infer_n_el(n_values)
+    except ValueError:
+        return 0
+
+
+def _unpack_header(data):
+    if len(data) < HEADER_SIZE:
+        raise ValueError('not an OpenEIT frame file')
+    magic, version, mode, n_el, n_values, sample_rate, start_time, \
+        data_offset = _HEADER.unpack(bytes(data[:_HEADER.size]))
+    if magic != MAGIC:
+        raise ValueError('not an OpenEIT frame file')
+    if version > VERSION:
+        raise ValueError('frame file version %d is not supported' % version)
+    return dict(mode=mode.rstrip(b'\0').decode(), n_el=n_el,
+                n_values=n_values, sample_rate=sample_rate,
+                start_time=start_time, data_offset=data_offset)
+
+
+class Recording:
+    """
+    Frames of a session with random access.
+
+    Use Recording.open for frame files (memory-mapped) and
+    Recording.load for any supported capture.
+
+    Parameters
+    ----------
+    records : NDArray
+        structured array of record_dtype(n_values)
+    mode : str
+        mode of the line protocol the frames were received in
+    n_el : int
+        number of electrodes, 0 if unknown
+    sample_rate : float
+        frames per second, 0 if unknown
+    start_time : float
+        time of the first frame (seconds since the epoch), 0 if unknown
+    """
+
+    def __init__(self, records, mode='d', n_el=0, sample_rate=0.,
+                 start_time=0., data_offset=HEADER_SIZE):
+        self.records = records
+        self.mode = mode
+        self.n_el = n_el
+        self.sample_rate = sample_rate
+        self.start_time = start_time
+        self.data_offset = data_offset
+
+    @classmethod
+    def open(cls, path):
+        """ map the frame file at `path`, nothing is read but the header """
+        with open(path, 'rb') as f:
+            header = _unpack_header(f.read(HEADER_SIZE))
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+        dtype = record_dtype(header['n_values'])
+        n_frames = (size - header['data_offset']) // dtype.itemsize
+        if n_frames > 0:
+            records = np.memmap(path, dtype=dtype, mode='r',
+                                offset=header['data_offset'],
+                                shape=(n_frames,))
+        else:
+            # an empty file can not be mapped
+            records = np.empty(0, dtype=dtype)
+        return cls._from_header(records, header)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ a frame file already in memory (an upload), without copy """
+        header = _unpack_header(data)
+        dtype = record_dtype(header['n_values'])
+        n_frames = (len(data) - header['data_offset']) // dtype.itemsize
+        records = np.frombuffer(data, dtype=dtype, count=max(n_frames, 0),
+                                offset=header['data_offset'])
+        return cls._from_header(records, header)
+
+    @classmethod
+    def _from_header(cls, records, header):
+        return cls(records, mode=header['mode'], n_el=header['n_el'],
+                   sample_rate=header['sample_rate'],
+                   start_time=header['start_time'],
+                   data_offset=header['data_offset'])
+
+    @classmethod
+    def from_text(cls, lines, mode='d', sample_rate=0.):
+        """ parse the lines of a text capture into memory """
+        frames = parse_frames(list(lines), mode)
+        records = np.empty(frames.shape[0], dtype=record_dtype(frames.shape[1]))
+        records['time'] = _frame_times(0, frames.shape[0], sample_rate)
+        records['values'] = frames
+        return cls(records, mode=mode, n_el=_n_el_or_unknown(frames.shape[1]),
+                   sample_rate=sample_rate)
+
+    @classmethod
+    def load(cls, source, mode='d'):
+        """
+        The recording of a frame file (mapped), of a streaming recording
+        or of a text capture (both read into memory, convert them to
+        open them instantly). `source` is a path or the file contents,
+        `mode` is the line protocol of text captures.
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            if bytes(source[:len(MAGIC)]) == MAGIC:
+                return cls.from_bytes(source)
+            return cls.from_text(bytes(source).decode('utf-8').splitlines(),
+                                 mode=mode)
+        with open(source, 'rb') as f:
+            magic = f.read(len(MAGIC))
+        if magic == MAGIC:
+            return cls.open(source)
+        if magic == recorder.MAGIC:
+            mode, start_time, _, chunks = _recorder_chunks(source)
+            parts = []
+            for times, values in chunks:
+                if parts and values.shape[1] != parts[0]['values'].shape[1]:
+                    continue
+                records = np.empty(len(times),
+                                   dtype=record_dtype(values.shape[1]))
+                records['time'] = times
+                records['values'] = values
+                parts.append(records)
+            if not parts:
+                raise ValueError('no frames in %s' % source)
+            records = np.concatenate(parts)
+            return cls(records, mode=mode,
+                       n_el=_n_el_or_unknown(records['values'].shape[1]),
+                       sample_rate=_sample_rate(records['time']),
+                       start_time=start_time)
+        logger.info('%s is a text capture, convert it with '
+                    'OpenEIT.backend.recording to open it instantly', source)
+        with open(source, 'r') as f:
+            return cls.from_text(f, mode=mode)
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    @property
+    def n_values(self):
+        return self.records.dtype['values'].shape[0]
+
+    @property
+    def stride(self):
+        """ bytes per frame record """
+        return self.records.dtype.itemsize
+
+    def offset(self, index):
+        """ position of the record of frame `index` in the file """
+        return self.data_offset + index * self.stride
+
+    @property
+    def times(self):
+        return self.records['time']
+
+    def frame(self, index):
+        """ the values of one frame, a view on the file """
+        return self.records['values'][index]
+
+    __getitem__ = frame
+
+    def frames(self, start=0, stop=None):
+        """ (n, n_values) view on the frames [start, stop) """
+        return self.records['values'][start:stop]
+
+    def close(self):
+        """ unmap the file, the views taken from it become invalid """
+        records, self.records = self.records, self.records[:0].copy()
+        mm = getattr(records, '_mmap', None)
+        del records
+        if mm is not None:
+            mm.close()
+
+
+def _frame_times(first, n, sample_rate):
+    """ timestamps of frames without one: seconds at `sample_rate`, else NaN """
+    if sample_rate:
+        return (first + np.arange(n)) / float(sample_rate)
+    return np.full(n, np.nan)
+
+
+def _sample_rate(times):
+    """ mean frame rate of recorded timestamps, 0 if it is not defined """
+    times = times[np.isfinite(times)]
+    if times.size < 2 or times[-1] <= times[0]:
+        return 0.
+    return (times.size - 1) / (times[-1] - times[0])
+
+
+def _recorder_chunks(path):
+    """ mode, start time, index and the (times, values) chunks """
+    with open(path, 'rb') as f:
+        mode, start_time = recorder.read_header(f)
+        index = recorder.read_index(f)
+
+    def chunks():
+        with open(path, 'rb') as f:
+            for entry in index:
+                yield recorder.read_chunk(f, entry)
+    return mode, start_time, index, chunks()
+
+
+class RecordingWriter:
+    """
+    Append frames to a frame file.
+
+    Parameters
+    ----------
+    path : str
+    n_values : int
+        values per frame
+    mode, n_el, sample_rate, start_time :
+        stored in the header, see Recording
+    """
+
+    def __init__(self, path, n_values, mode='d', n_el=0, sample_rate=0.,
+                 start_time=0.):
+        self.path = path
+        self.n_values = n_values
+        self.n_frames = 0
+        self._dtype = record_dtype(n_values)
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(
+            MAGIC, VERSION, mode.encode()[:8], n_el, n_values,
+            sample_rate, start_time, HEADER_SIZE).ljust(HEADER_SIZE, b'\0'))
+
+    def write(self, values, times):
+        """ append (n, n_values) frames with their n timestamps """
+        records = np.empty(len(values), dtype=self._dtype)
+        records['time'] = times
+        records['values'] = values
+        self._file.write(records.tobytes())
+        self.n_frames += len(records)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert(path, out_path, mode='d', n_el=None, sample_rate=None,
+            chunk_size=1024):
+    """
+    Convert a text capture or a streaming recording (recorder.py) into
+    the frame file `out_path`, reading `chunk_size` frames at a time.
+    Frames whose length differs from the first frame are skipped.
+
+    Text captures have no timestamps, the frames are timed at
+    `sample_rate` if it is given. Returns the number of frames written.
+    """
+    with open(path, 'rb') as f:
+        is_recording = f.read(len(recorder.MAGIC)) == recorder.MAGIC
+    start_time = 0.
+    if is_recording:
+        mode, start_time, index, chunks = _recorder_chunks(path)
+        # the frames that are kept, of the length of the first chunk
+        index = index[index['n_values'] == index['n_values'][:1]]
+        if sample_rate is None and len(index):
+            span = index['t_last'][-1] - index['t_first'][0]
+            n = index['n_frames'].sum()
+            sample_rate = (n - 1) / span if n > 1 and span > 0 else 0.
+    else:
+        chunks = ((None, frames) for frames in
+                  iter_chunks(path, mode, chunk_size))
+
+    writer = None
+    n_skipped = 0
+    try:
+        for times, values in chunks:
+            if writer is None:
+                writer = RecordingWriter(
+                    out_path, values.shape[1], mode=mode,
+                    n_el=(_n_el_or_unknown(values.shape[1]) if n_el is None
+                          else n_el),
+                    sample_rate=sample_rate or 0., start_time=start_time)
+            elif values.shape[1] != writer.n_values:
+                n_skipped += values.shape[0]
+                continue
+            if times is None:
+                times = _frame_times(writer.n_frames, values.shape[0],
+                                     sample_rate)
+            writer.write(values, times)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError('no frames in %s' % path)
+    if n_skipped:
+        logger.warning('%d frames of another length were skipped', n_skipped)
+    return writer.n_frames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert a capture to a memory-mapped frame file.')
+    parser.add_argument('path', help='text capture or streaming recording')
+    parser.add_argument('-o', '--output', help='frame file (.oeitf)')
+    parser.add_argument('--mode', default='d',
+                        help='line protocol of text captures')
+    parser.add_argument('--n-el', type=int, default=None,
+                        help='number of electrodes, inferred by default')
+    parser.add_argument('--sample-rate', type=float, default=None,
+                        help='frames per second of text captures')
+    parser.add_argument('--chunk', type=int, default=1024)
+    args = parser.parse_args(argv)
+
+    out_path = args.output or os.path.splitext(args.path)[0] + '.oeitf'
+    n_frames = convert(args.path, out_path, mode=args.mode, n_el=args.n_el,
+                       sample_rate=args.sample_rate, chunk_size=args.chunk)
+    print('%d frames written to %s' % (n_frames, out_path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Bounded frame store between the serial reader and its consumers.
+
+A FrameRing is a preallocated (capacity, frame_size) float64 array used
+as a ring. The producer copies every frame into the next row, each
+consumer reads through its own RingReader cursor, so the reconstruction
+worker and the dashboard see the same frames without a queue per
+consumer and memory stays bounded whatever the consumers do.
+
+When a consumer falls a full ring behind, the ``policy`` decides:
+
+- 'drop_oldest': the producer overwrites the oldest frames, the consumer
+  skips them on its next read and counts them in ``overruns``.
+- 'block': the producer waits for the consumer (at most
+  ``block_timeout`` seconds), then drops the new frame and counts it in
+  ``dropped``.
+
+A paused RingReader (see RingReader.pause) follows the producer without
+reading: it never blocks it and counts no overruns, for the consumers of
+the modes that are not shown.
+
+RingReader implements the parts of the queue.Queue API that the
+consumers use (get, get_nowait, empty, qsize), and FrameRing.put the
+producer side, so either can stand in for a queue.Queue. RingReader also
+has latest (the newest frame only) and get_all (every unread sample).
+"""
+from __future__ import absolute_import
+import queue
+import threading
+import time
+
+import numpy as np
+
+POLICIES = ('drop_oldest', 'block')
+
+
+class FrameRing:
+    """
+    Fixed-capacity ring of frames with per-consumer read cursors.
+
+    Parameters
+    ----------
+    capacity : int
+        number of frames kept
+    frame_size : int, optional
+        values per row, the rows grow if a longer frame is put.
+        By default, the first frame sets the row length.
+    policy : str
+        'drop_oldest' or 'block', see the module docstring
+    block_timeout : float
+        longest wait of put with the 'block' policy
+    """
+
+    def __init__(self, capacity=256, frame_size=None, policy='drop_oldest',
+                 block_timeout=1.0):
+        if policy not in POLICIES:
+            raise ValueError('unknown policy %r, expected one of %s' % (
+                policy, ', '.join(POLICIES)))
+        self.capacity = int(capacity)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._buf = None
+        if frame_size is not None:
+            self._buf = np.empty((self.capacity, frame_size))
+        self._lengths = np.zeros(self.capacity, dtype=int)
+        # number of frames written so far, the next frame goes to
+        # row _head % capacity
+        self._head = 0
+        self._readers = []
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self.dropped = 0
+
+    def _ensure_width(self, size):
+        if self._buf is None:
+            self._buf = np.empty((self.capacity, size))
+        elif self._buf.shape[1] < size:
+            buf = np.empty((self.capacity, size))
+            buf[:, :self._buf.shape[1]] = self._buf
+            self._buf = buf
+
+    def _min_cursor(self):
+        return min([r._cursor for r in self._readers] or [self._head])
+
+    def put(self, frame, block=True, timeout=None):
+        """
+        Copy `frame` into the next row. Returns False if the frame was
+        dropped (the 'block' policy timed out).
+        """
+        frame = np.asarray(frame, dtype=np.float64).ravel()
+        with self._lock:
+            if self.policy == 'block':
+                if timeout is None:
+                    timeout = self.block_timeout
+                deadline = time.time() + timeout
+                while self._head - self._min_cursor() >= self.capacity:
+                    remaining = deadline - time.time()
+                    if not block or remaining <= 0:
+                        self.dropped += 1
+                        return False
+                    self._not_full.wait(remaining)
+            self._ensure_width(frame.size)
+            row = self._head % self.capacity
+            self._buf[row, :frame.size] = frame
+            self._lengths[row] = frame.size
+            self._head += 1
+            for reader in self._readers:
+                if reader.paused:
+                    reader._cursor = self._head
+            self._not_empty.notify_all()
+        return True
+
+    def reader(self, name=None):
+        """ a new consumer, it sees the frames put from now on """
+        with self._lock:
+            reader = RingReader(self, name, self._head)
+            self._readers.append(reader)
+        return reader
+
+    def remove_reader(self, reader):
+        with self._lock:
+            if reader in self._readers:
+                self._readers.remove(reader)
+            self._not_full.notify_all()
+
+    def wait_lag(self, reader, lag, timeout=None):
+        """
+        Wait until `reader` is less than `lag` frames behind, so that a
+        producer can run at the pace of one consumer. Returns False if
+        `timeout` expired first.
+        """
+        with self._lock:
+            return self._not_full.wait_for(
+                lambda: (reader.paused or
+                         self._head - reader._cursor < lag), timeout)
+
+    def clear(self):
+        """ drop all unread frames of all consumers """
+        with self._lock:
+            for reader in self._readers:
+                reader._cursor = self._head
+            self._not_full.notify_all()
+
+    @property
+    def written(self):
+        return self._head
+
+    def stats(self):
+        """ counters of the ring and of every consumer """
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'policy': self.policy,
+                'written': self._head,
+                'dropped': self.dropped,
+                'readers': {r.name: {'lag': min(self._head - r._cursor,
+                                                self.capacity),
+                                     'read': r.read,
+                                     'overruns': r.overruns,
+                                     'paused': r.paused}
+                            for r in self._readers},
+            }
+
+
+class RingReader:
+    """
+    Read cursor of one consumer of a FrameRing.
+
+    The frames are returned as copies made under the ring lock: with
+    'drop_oldest' the producer may write the row of a returned frame
+    again at any time (right away after an overrun).
+    """
+
+    def __init__(self, ring, name, cursor):
+        self._ring = ring
+        self.name = name if name is not None else 'reader-%d' % id(self)
+        self._cursor = cursor
+        self.read = 0
+        self.overruns = 0
+        self.paused = False
+
+    def _catch_up(self):
+        """ skip the overwritten frames, lock held """
+        ring = self._ring
+        lost = ring._head - ring.capacity - self._cursor
+        if lost > 0:
+            self.overruns += lost
+            self._cursor += lost
+
+    def _pop(self):
+        ring = self._ring
+        self._catch_up()
+        row = self._cursor % ring.capacity
+        frame = ring._buf[row, :ring._lengths[row]].copy()
+        self._cursor += 1
+        self.read += 1
+        ring._not_full.notify_all()
+        return frame
+
+    def get(self, block=True, timeout=None):
+        """ the next frame, raises queue.Empty as queue.Queue.get """
+        ring = self._ring
+        with ring._lock:
+            if block:
+                if not ring._not_empty.wait_for(
+                        lambda: self._cursor < ring._head, timeout):
+                    raise queue.Empty
+            elif self._cursor >= ring._head:
+                raise queue.Empty
+            return self._pop()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_all(self):
+        """
+        All unread frames end to end in one new array (empty if none is
+        unread), for the consumers of streams of samples.
+        """
+        ring = self._ring
+        with ring._lock:
+            self._catch_up()
+            rows = [ring._buf[c % ring.capacity, :ring._lengths[c % ring.capacity]]
+                    for c in range(self._cursor, ring._head)]
+            self.read += len(rows)
+            self._cursor = ring._head
+            ring._not_full.notify_all()
+            return np.concatenate(rows) if rows else np.empty(0)
+
+    def latest(self):
+        """ the newest frame (None if none is unread), skipping the rest """
+        ring = self._ring
+        with ring._lock:
+            if self._cursor >= ring._head:
+                return None
+            self._cursor = ring._head - 1
+            return self._pop()
+
+    def qsize(self):
+        ring = self._ring
+        with ring._lock:
+            return min(ring._head - self._cursor, ring.capacity)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def clear(self):
+        """ skip all unread frames """
+        ring = self._ring
+        with ring._lock:
+            self._cursor = ring._head
+            ring._not_full.notify_all()
+
+    def pause(self):
+        """ skip the frames until resume, as if no one read them """
+        ring = self._ring
+        with ring._lock:
+            self.paused = True
+            self._cursor = ring._head
+            ring._not_full.notify_all()
+
+    def resume(self):
+        """ read again, from the next frame put """
+        ring = self._ring
+        with ring._lock:
+            self.paused = False
+            self._cursor = ring._head
+
+    def close(self):
+        self._ring.remove_reader(self)
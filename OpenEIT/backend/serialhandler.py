@@ -14,7 +14,15 @@ import serial
 import serial.threaded
 import uuid
 
+import itertools
 import os 
+import re
+import warnings
+import numpy as np
+
+from OpenEIT.backend.framing import FrameReader
+from OpenEIT.backend.recorder import Recorder
+from OpenEIT import metrics
 
 if platform == "linux" or platform == "linux2":
     # linux
@@ -36,6 +44,23 @@ RX_CHAR_UUID      = uuid.UUID('6E400003-B5A3-F393-E0A9-E50E24DCCA9E')
 
 logger = logging.getLogger(__name__)
 
+# directory of the recordings, see recorder.py
+RECORD_DIR = os.environ.get('OPENEIT_RECORD_DIR', 'recordings')
+
+# wire encodings of the serial connection, see framing.py for 'binary'
+FRAMINGS = ('ascii', 'binary')
+
+# a reader thread per connection, or the shared event loop of
+# acquisition.py
+BACKENDS = ('thread', 'asyncio')
+
+_ASCII_BYTES = metrics.SERIAL_BYTES.labels('ascii')
+_BINARY_BYTES = metrics.SERIAL_BYTES.labels('binary')
+_BLE_BYTES = metrics.SERIAL_BYTES.labels('ble')
+_LINES_PARSED = metrics.LINES.labels('parsed')
+_LINES_REJECTED = metrics.LINES.labels('rejected')
+_FRAMES_OK = metrics.BINARY_FRAMES.labels('ok')
+_FRAMES_CRC_ERROR = metrics.BINARY_FRAMES.labels('crc_error')
 
 def parse_any_line(line, mode):  
 
@@ -81,6 +106,202 @@ def parse_any_line(line, mode):
     return items
 
 
+def _data_part(line, mode):
+    """ the text holding the values of a line and its separator """
+    if 'a' in mode:
+        return line, ','
+    data = line.partition(':')[2]
+    if data == '' and ':' not in line:
+        return None, None
+    return data, (';' if 'b' in mode else ',')
+
+
+# an empty item between two separators
+_EMPTY_ITEM = {sep: re.compile(r'%s\s*%s' % (sep, sep)) for sep in ',;'}
+
+
+def _strip_data(data, sep):
+    """ strip whitespace and one trailing separator (an empty item) """
+    data = data.strip()
+    if data.endswith(sep):
+        data = data[:-1].rstrip()
+    return data
+
+
+def _fast_convertible(data, sep):
+    """ whether np.fromstring may be used on the stripped `data` """
+    # np.fromstring reads an empty item as -1 and strtod-style
+    # 'nan(...)' as nan, float() rejects both
+    return (data != '' and '(' not in data and
+            not data.startswith(sep) and not data.endswith(sep) and
+            _EMPTY_ITEM[sep].search(data) is None)
+
+
+def _fromstring(data, sep):
+    """ np.fromstring, None unless it converted all items of `data` """
+    data = _strip_data(data, sep)
+    if not _fast_convertible(data, sep):
+        return None
+    with warnings.catch_warnings():
+        # a malformed item ends the conversion early, see the size check.
+        # the sentinel item catches a partially converted last item
+        warnings.simplefilter('ignore', DeprecationWarning)
+        values = np.fromstring(data + sep + '0', sep=sep)
+    if values.size != data.count(sep) + 2:
+        return None
+    return values[:-1]
+
+
+def _float_items(data, sep):
+    """ exact rules of parse_any_line: skip empty items, reject on error """
+    items = data.split(sep)
+    try:
+        return list(map(float, items))
+    except ValueError:
+        pass
+    try:
+        return [float(item) for item in items if item.strip()]
+    except ValueError:
+        return None
+
+
+def parse_frame(line, mode, out=None):
+    """
+    Fast version of parse_any_line, it accepts and rejects the same
+    lines, but returns a float64 NumPy array instead of a list.
+
+    Parameters
+    ----------
+    line : str
+        one line of the line protocol
+    mode : str
+        'a', 'b' or 'd' (as parse_any_line)
+    out : NDArray, optional
+        preallocated float64 buffer, the values are written to the
+        beginning of it and a view on them is returned
+
+    Returns
+    -------
+    NDArray or None
+        the values of the line, None if the line is rejected
+    """
+    data, sep = _data_part(line, mode)
+    if data is None:
+        return None
+    values = _fromstring(data, sep)
+    if values is None:
+        # empty items or an invalid one, decide item by item
+        values = _float_items(data, sep)
+        if values is None:
+            return None
+        values = np.array(values, dtype=np.float64)
+    if out is None:
+        return values
+    out[:values.size] = values
+    return out[:values.size]
+
+
+def parse_frames(lines, mode, out=None):
+    """
+    Decode a batch of buffered lines into the rows of a 2D float64
+    buffer. Rejected lines (see parse_any_line) and lines whose number
+    of values differs from the row length are skipped.
+
+    The values of all lines are converted with a single call to NumPy,
+    lines that need the exact item-by-item rules are parsed one by one.
+
+    Parameters
+    ----------
+    lines : list of str
+    mode : str
+        'a', 'b' or 'd' (as parse_any_line)
+    out : NDArray, optional
+        (n_lines, n_values) float64 buffer. Without it, the row length
+        is the most frequent number of values in `lines`.
+
+    Returns
+    -------
+    NDArray
+        (n_accepted, n_values), a view on `out` if it is given
+    """
+    parts = [_data_part(line, mode) for line in lines]
+    parts = [p for p in parts if p[0] is not None]
+    sep = ';' if 'b' in mode and 'a' not in mode else ','
+    data = [_strip_data(p[0], sep) for p in parts]
+    counts = np.array([d.count(sep) + 1 for d in data], dtype=int)
+    if out is not None:
+        n_values = out.shape[1]
+    elif counts.size > 0:
+        n_values = np.bincount(counts).argmax()
+    else:
+        return np.empty((0, 0))
+    if out is None:
+        out = np.empty((len(data), n_values))
+
+    regular = counts == n_values
+    joined = sep.join([d for d, ok in zip(data, regular) if ok])
+    values = None
+    if regular.any() and _fast_convertible(joined, sep):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = np.fromstring(joined + sep + '0', sep=sep)
+        if values.size != regular.sum() * n_values + 1:
+            values = None
+        else:
+            values = values[:-1]
+
+    if values is not None and regular.all():
+        n = regular.size
+        out[:n] = values.reshape(n, n_values)
+        return out[:n]
+
+    n = 0
+    j = 0
+    for d, ok in zip(data, regular):
+        if ok and values is not None:
+            out[n] = values[j*n_values:(j+1)*n_values]
+            j += 1
+            n += 1
+            continue
+        row = parse_frame(':' + d if 'a' not in mode else d, mode)
+        if row is not None and row.size == n_values:
+            out[n] = row
+            n += 1
+    return out[:n]
+
+
+def iter_chunks(path, mode='d', chunk_size=1024):
+    """
+    Yield the frames of the text capture at `path` as (n, n_values)
+    arrays of at most `chunk_size` frames. Frames whose length differs
+    from the first frame are skipped.
+
+    The lines are decoded with parse_frames into one buffer, a yielded
+    array is only valid until the next one is read.
+    """
+    buf = None
+    with open(path, 'r') as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                break
+            # the first chunk sets the frame length
+            frames = parse_frames(lines, mode, out=buf)
+            if buf is None and frames.shape[0] > 0:
+                buf = np.empty((chunk_size, frames.shape[1]))
+            if frames.shape[0] > 0:
+                yield frames
+
+
+def infer_n_el(n_values):
+    """ number of electrodes of the opposition protocol, n_el*(n_el-4) values """
+    n_el = int(round(2 + np.sqrt(4 + max(n_values, 0))))
+    if n_values <= 0 or n_el * (n_el - 4) != n_values:
+        raise ValueError('can not infer the number of electrodes from '
+                         '%d values per frame' % n_values)
+    return n_el
+
+
 class SerialHandler:
 
     def __init__(self, queue):
@@ -90,10 +311,11 @@ class SerialHandler:
         #self._mpqueue = Queue()
         self._recording_lock = threading.Lock()
         self._recording = False
-        self._record_file = None
-        self._bytestream = ''
+        self._recorder = None
+        self._record_path = None
         # self._data_type = data_type
         self._mode = 'd' # mode
+        self._framing = 'ascii'
 
         self.raw_text = 'streamed data'
         if platform == "darwin_xx":
@@ -111,36 +333,104 @@ class SerialHandler:
 
     def return_last_line(self):
         with self._connection_lock:
-            return self.raw_text
+            parser = getattr(self._reader_thread, 'parser', None)
+            return getattr(parser, 'last_line', self.raw_text)
 
     # this needs updating to have a bluetooth method separate from the reader_thread serial method. 
     def disconnect(self):
         with self._connection_lock:
-            if self._reader_thread is None:
-                return
-
-            self._reader_thread.close()
-            self._reader_thread = None
+            reader, self._reader_thread = self._reader_thread, None
+        if reader is None:
+            return
+        # closed without the lock: the connection_lost callbacks (on the
+        # reader thread or the event loop) take it while close waits
+        reader.close()
 
     def write(self, text):
         self._reader_thread.write(text.encode())
 
     def setmode(self, mode):
         self._mode = mode
+        parser = getattr(self._reader_thread, 'parser', None)
+        if hasattr(parser, 'mode'):
+            parser.mode = mode
 
     def getmode(self):
         return self._mode
 
-    def getbytes(self):
-        return self._bytestream
+    def recording_path(self):
+        """ file of the current or last recording, None if there is none """
+        return self._record_path
+
+    def _record(self, values):
+        recorder = self._recorder
+        if recorder is not None:
+            recorder.write(values)
+
+    def getframing(self):
+        return self._framing
 
-    def connect(self, port_selection):
+    def _deliver(self, values):
+        """ frame sink of the asyncio backend """
+        self._record(values)
+        self._queue.put(values)
+
+    def _connection_lost(self, device, exc):
+        with self._connection_lock:
+            if self._reader_thread is device:
+                self._reader_thread = None
+
+    def _connect_asyncio(self, port_selection, framing):
+        """ stream the port on the shared event loop of acquisition.py """
+        from OpenEIT.backend import acquisition
+
+        ble = 'Bluetooth' in port_selection
+        if framing == 'binary':
+            parser = acquisition.BinaryParser()
+        else:
+            # the BLE UART ends the lines with a carriage return
+            parser = acquisition.LineParser(
+                self._mode, terminator=b'\r' if ble else b'\n')
+        if ble:
+            transport = acquisition.BleTransport()
+        else:
+            transport = acquisition.SerialTransport(port_selection)
+        try:
+            device = acquisition.get_loop().add_device(
+                port_selection, transport, parser, self._deliver,
+                on_close=self._connection_lost)
+        except serial.SerialException:
+            print ('could not connect')
+            logger.error('Cannot connect to %s', port_selection)
+            raise
+        self._connected = True
+        logger.info('connection made now (asyncio)')
+        return device
+
+    def connect(self, port_selection, framing='ascii', backend='thread'):
+        if framing not in FRAMINGS:
+            raise ValueError('unknown framing %r, expected one of %s' % (
+                framing, ', '.join(FRAMINGS)))
+        if backend not in BACKENDS:
+            raise ValueError('unknown backend %r, expected one of %s' % (
+                backend, ', '.join(BACKENDS)))
+        if (framing == 'binary' and backend == 'thread'
+                and 'Bluetooth' in port_selection):
+            # the BLE reader thread only reads lines
+            raise ValueError("binary framing over Bluetooth needs "
+                             "backend='asyncio'")
         with self._connection_lock:
             if self._reader_thread is not None:
                 raise RuntimeError("serial already connected")
+            self._framing = framing
 
             print('connecting to: ', port_selection)
 
+            if backend == 'asyncio':
+                self._reader_thread = self._connect_asyncio(port_selection,
+                                                            framing)
+                return
+
             if 'Bluetooth' in port_selection:
                 #print ('Bluetooth Callback')
                 # Initialize the BLE system.  MUST be called before other BLE calls!
@@ -182,21 +472,23 @@ class SerialHandler:
                     super().connection_made(transport)
                     logger.info('connection made now')
 
+                def data_received(self, data):
+                    _ASCII_BYTES.inc(len(data))
+                    super().data_received(data)
+
                 def handle_line(self, line):
                     # XXX: we should not record the raw stream but the
                     # parsed data
                     # print (line)
                     serialhandler.raw_text = line
 
-                    with serialhandler._recording_lock:
-                        if serialhandler._recording:
-                            logger.info("serialhandler._recording")
-                            # serialhandler._record_file.write(line + "\n")
-                            serialhandler._bytestream = serialhandler._bytestream + line
-                    
-                    res = parse_any_line(line,serialhandler._mode)
+                    res = parse_frame(line,serialhandler._mode)
                     if res is not None:
+                        _LINES_PARSED.inc()
+                        serialhandler._record(res)
                         serialhandler._queue.put(res)
+                    else:
+                        _LINES_REJECTED.inc()
 
                 def connection_lost(self, exc):
                     if exc is not None:
@@ -208,6 +500,38 @@ class SerialHandler:
                         if serialhandler._reader_thread is self:
                             serialhandler._reader_thread = None
 
+            class FrameReaderThread(FrameReader):
+
+                def connection_made(self, transport):
+                    serialhandler._connected = True
+                    super().connection_made(transport)
+                    logger.info('connection made now (binary frames)')
+
+                def data_received(self, data):
+                    _BINARY_BYTES.inc(len(data))
+                    n_errors = self.decoder.n_crc_errors
+                    super().data_received(data)
+                    if self.decoder.n_crc_errors != n_errors:
+                        _FRAMES_CRC_ERROR.inc(self.decoder.n_crc_errors - n_errors)
+
+                def handle_frame(self, mode, values):
+                    _FRAMES_OK.inc()
+                    serialhandler._record(values)
+                    serialhandler._queue.put(values)
+
+                def connection_lost(self, exc):
+                    if exc is not None:
+                        logger.error('connection lost %s', str(exc))
+                    else:
+                        logger.info('connection lost')
+                    logger.info('binary frames: %d ok, %d crc errors, %d bytes skipped',
+                                self.decoder.n_frames, self.decoder.n_crc_errors,
+                                self.decoder.n_skipped_bytes)
+
+                    with serialhandler._connection_lock:
+                        if serialhandler._reader_thread is self:
+                            serialhandler._reader_thread = None
+
             class bleThread(threading.Thread):
 
                 def __init__(self, blehandle, queue):
@@ -274,16 +598,14 @@ class SerialHandler:
                                 # print ('handling the line')
                                 # print (data)
                                 serialhandler.raw_text = data
-                                with serialhandler._recording_lock:
-                                    if serialhandler._recording:
-                                        # logger.info("serialhandler._recording")
-                                        # serialhandler._record_file.write(data + "\n")
-                                        serialhandler._bytestream = serialhandler._bytestream + data
-
-                                res = parse_any_line(data,serialhandler._mode)
+                                res = parse_frame(data,serialhandler._mode)
 
                                 if res is not None:
+                                    _LINES_PARSED.inc()
+                                    serialhandler._record(res)
                                     self._queue.put(res)
+                                else:
+                                    _LINES_REJECTED.inc()
 
                             while self.device.is_connected: 
                                 if self.uart is not None: 
@@ -291,6 +613,7 @@ class SerialHandler:
                                     if newdata is None:
                                         print('Received None: {0}'.format(newdata))
                                     else: 
+                                        _BLE_BYTES.inc(len(newdata))
                                         characters = newdata.decode()
                                         if "\r" in characters: 
                                             charline = charline+characters
@@ -325,8 +648,11 @@ class SerialHandler:
 
                 def write(self,text):
                     if self.uart is not None: 
-                        with self._queue.mutex:
-                            self._queue.queue.clear()
+                        if hasattr(self._queue, 'clear'):
+                            self._queue.clear()
+                        else:
+                            with self._queue.mutex:
+                                self._queue.queue.clear()
                         self.uart.write(text)
                     else: 
                         print ('there is no uart connected')
@@ -340,7 +666,7 @@ class SerialHandler:
             else: 
                 self._reader_thread = serial.threaded.ReaderThread(
                     ser,
-                    LineReader
+                    FrameReaderThread if framing == 'binary' else LineReader
                 )
                 # start the reader thread
                 self._reader_thread.start()
@@ -351,16 +677,23 @@ class SerialHandler:
         with self._recording_lock:
             return self._recording
 
-    def start_recording(self):
+    def start_recording(self, path=None):
         with self._recording_lock:
+            if self._recording:
+                return
+            if path is None:
+                os.makedirs(RECORD_DIR, exist_ok=True)
+                timestr = time.strftime("%Y%m%d-%H%M%S")
+                path = os.path.join(RECORD_DIR, 'data_' + timestr + '.oeit')
             print('recording started!!')
-            timestr = time.strftime("%Y%m%d-%H%M%S")
+            self._recorder = Recorder(path, mode=self._mode)
+            self._record_path = path
             self._recording = True
-            # self._record_file = open('data_' + timestr + '.txt', 'a')
-            self._bytestream = '' 
 
     def stop_recording(self):
         with self._recording_lock:
             print('recording stopped')
             self._recording = False
-            # self._record_file.close()
+            recorder, self._recorder = self._recorder, None
+        if recorder is not None:
+            recorder.close()
@@ -10,6 +10,11 @@ import queue
 import os
 import OpenEIT.reconstruction
 import OpenEIT.backend
+import OpenEIT.backend.recording
+import OpenEIT.backend.playback
+from OpenEIT import metrics
+from OpenEIT.dashboard.push import ImageHub
+from OpenEIT.dashboard.tiles import TileRenderer
 logger = logging.getLogger(__name__)
 
 # PORT = 8050
@@ -18,6 +23,11 @@ _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.DEBUG) # or DEBUG
 _LOGGER.addHandler(logging.StreamHandler())
 
+# frames kept between the serial reader and its consumers, 896 values
+# per frame in 32 electrode mode
+DATA_RING_CAPACITY = 256
+DATA_RING_FRAME_SIZE = 1024
+
 
 class PlaybackStrategy:
 
@@ -38,27 +48,40 @@ class FilePlayback(PlaybackStrategy):
     """
     This playback strategy allows to directly feed data from files to
     the reconstruction process.
+
+    The frames are read from a Recording, frame files are memory-mapped
+    so any frame can be reached at once (see seek).
     """
 
-    def __init__(self, file_handle, controller):
-        res = []
-        for line in file_handle:
-            data = OpenEIT.backend.parse_line(line)
-            if data is not None:
-                res.append(data)
-        self._file_data = res
+    def __init__(self, path, controller, mode='d'):
+        self._recording = OpenEIT.backend.recording.Recording.load(path, mode=mode)
         self._file_marker = 0
         self._queue = controller._data_queue
 
+    def __len__(self):
+        return len(self._recording)
+
+    @property
+    def recording(self):
+        return self._recording
+
+    @property
+    def position(self):
+        return self._file_marker
+
     def close(self):
-        pass
+        self._recording.close()
 
     def rewind(self):
         self._file_marker = 0
 
+    def seek(self, index):
+        """ play frame `index` next """
+        self._file_marker = min(max(int(index), 0), len(self._recording))
+
     def step(self):
-        if self._file_marker < len(self._file_data):
-            self._queue.put(self._file_data[self._file_marker])
+        if self._file_marker < len(self._recording):
+            self._queue.put(self._recording.frame(self._file_marker))
             self._file_marker += 1
             return True
         return False
@@ -66,51 +89,19 @@ class FilePlayback(PlaybackStrategy):
     def step_back(self):
         if self._file_marker > 0:
             self._file_marker -= 1
-            self._queue.put(self._file_data[self._file_marker])
+            self._queue.put(self._recording.frame(self._file_marker))
             return True
         return False
 
-class FilePlaybackDash(PlaybackStrategy):
+class FilePlaybackDash(FilePlayback):
     """
-    This playback strategy allows to directly feed data from files to
-    the reconstruction process.
+    Playback of a file uploaded through the dashboard, a frame file is
+    used in place, a text capture is parsed once.
     """
     # FilePlaybackDash(filename,contents, self)
-    def __init__(self, filename,contents, controller):
-
-        content_string = str(contents, 'utf-8')
-        string = ''.join(content_string)
-
-        res = []
-        for line in string.splitlines():
-            data = OpenEIT.backend.serialhandler.parse_any_line(line,'b')
-            #data = OpenEIT.backend.parse_line(line)
-            if data is not None:
-                res.append(data)
-        self._file_data = res
-        self._file_marker = 0
-        self._queue = controller._data_queue
-
-    def close(self):
-        pass
-
-    def rewind(self):
-        self._file_marker = 0
-
-    def step(self):
-        if self._file_marker < len(self._file_data):
-            self._queue.put(self._file_data[self._file_marker])
-            self._file_marker += 1
-            print (self._file_marker)
-            return True
-        return False
-
-    def step_back(self):
-        if self._file_marker > 0:
-            self._file_marker -= 1
-            self._queue.put(self._file_data[self._file_marker])
-            return True
-        return False
+    def __init__(self, filename, contents, controller):
+        self.filename = filename
+        super(FilePlaybackDash, self).__init__(contents, controller, mode='b')
 
 class VirtualSerialPortPlayback(PlaybackStrategy):
     """
@@ -155,18 +146,40 @@ class Controller:
         self._signal_connections = {}
         self.recording = False
         # setup the queues for the workers
-        self._data_queue  = queue.Queue()
+        self._data_queue  = OpenEIT.backend.FrameRing(
+            capacity=DATA_RING_CAPACITY, frame_size=DATA_RING_FRAME_SIZE)
+        # every consumer reads the frames through its own cursor, the
+        # one of the modes not shown is paused (see _select_reader)
+        self._data_reader = self._data_queue.reader('dashboard')
+        self._reconstruction_reader = self._data_queue.reader('reconstruction')
         self._image_queue = queue.Queue()
+        # the dashboard and the push streams read the latest image here,
+        # and its histogram and range in frame_stats
+        self.frame_stats = OpenEIT.reconstruction.FrameStats()
+        self.image_hub = ImageHub()
+        self.image_hub.pump(self._image_queue, self.frame_stats)
+        # renders the images to PNG tiles, see enable_tiles
+        self.tile_renderer = None
+        self._register_metrics()
         self._algorithm   = 'jac'
         self._n_el        = 16
         self.playback = None
+        # plays the loaded file continuously, see run_file
+        self.playback_engine = None
+        self._engine_active = False
+        self._acquisition = 'thread'
 
         # instantiate the serial handler. It should be instantiated knowing what sort of data it is expecting. 
         self.serial_handler = OpenEIT.backend.SerialHandler(self._data_queue)
 
 
     def configure(self, *, initial_port=None, virtual_tty=False,
-                 read_file=False):
+                 read_file=False, worker='thread', n_workers=2,
+                 acquisition='thread'):
+
+        # 'asyncio' streams the devices on one event loop, see
+        # backend/acquisition.py
+        self._acquisition = acquisition
 
         if initial_port is not None:
             if virtual_tty:
@@ -175,9 +188,8 @@ class Controller:
                                                               self)
                     self.emit("connection_state_changed", True)
             elif read_file:
-                with open(initial_port, "r") as file_handle:
-                    self.playback = FilePlaybackDash(file_handle, self)
-                    self.emit("connection_state_changed", True)
+                self.playback = FilePlayback(initial_port, self)
+                self.emit("connection_state_changed", True)
             else:
                 self.menuselect.set(initial_port)
                 self.connect()
@@ -186,9 +198,20 @@ class Controller:
         # self.serial_setmode(mode)
         self.serial_port_name = '' 
 
-        self.image_reconstruct = OpenEIT.reconstruction.ReconstructionWorker()
+        # 'process' reconstructs in a child process, off the GIL of the GUI,
+        # 'pool' reconstructs consecutive frames concurrently
+        if worker == 'process':
+            self.image_reconstruct = OpenEIT.reconstruction.ProcessReconstructionWorker()
+        elif worker == 'pool':
+            self.image_reconstruct = OpenEIT.reconstruction.ReconstructionPool(
+                n_workers=n_workers, latest_only=True)
+            metrics.DROPPED_FRAMES.labels('pool_latest_only').set_function(
+                lambda: self.image_reconstruct.skipped)
+        else:
+            self.image_reconstruct = OpenEIT.reconstruction.ReconstructionWorker()
 
         self._mode = self.serial_handler.getmode()
+        self._select_reader()
         if 'a' in self._mode or 'b' in self._mode:
             self._n_el = 16 # just to set it to something. 
         elif 'd' in self._mode:
@@ -198,13 +221,62 @@ class Controller:
         self.image_reconstruct.start()
 
 
+    def _select_reader(self):
+        """
+        Only the consumer of the current mode reads the frames: the
+        dashboard in time series and BIS ('a', 'b'), the reconstruction
+        in the imaging modes. The other reader is paused, so it does not
+        count the frames it never reads as lost nor hold the producer.
+        """
+        dashboard = 'a' in self._mode or 'b' in self._mode
+        active, idle = (self._data_reader, self._reconstruction_reader)
+        if not dashboard:
+            active, idle = idle, active
+        if active.paused:
+            active.resume()
+        if not idle.paused:
+            idle.pause()
+
+    def _register_metrics(self):
+        """ queue depths and lost frames, read when the metrics are served """
+        ring = self._data_queue
+        for reader in (self._data_reader, self._reconstruction_reader):
+            metrics.QUEUE_DEPTH.labels('data_' + reader.name).set_function(
+                reader.qsize)
+            metrics.DROPPED_FRAMES.labels(reader.name).set_function(
+                lambda reader=reader: reader.overruns)
+        metrics.DROPPED_FRAMES.labels('producer').set_function(
+            lambda: ring.dropped)
+        metrics.QUEUE_DEPTH.labels('images').set_function(
+            self._image_queue.qsize)
+
+    def enable_tiles(self, fmt='png', size=256):
+        """ render every image to a cached tile, see tiles.py """
+        if self.tile_renderer is None:
+            self.tile_renderer = TileRenderer(fmt, size)
+            self._update_tile_geometry()
+            self.image_hub.add_listener(self.tile_renderer.on_image)
+        return self.tile_renderer
+
+    def _update_tile_geometry(self):
+        if self.tile_renderer is None:
+            return
+        if self._algorithm in ('jac', 'bp') and hasattr(self, 'tri'):
+            self.tile_renderer.set_mesh(self.x, self.y, self.tri)
+        else:
+            self.tile_renderer.set_mesh(None, None, None)
+
     @property
     def image_queue(self):
         return self._image_queue
 
     @property
     def data_queue(self):
-        return self._data_queue
+        return self._data_reader
+
+    def data_stats(self):
+        """ frames written, dropped and overrun per consumer """
+        return self._data_queue.stats()
 
     @property
     def n_el(self):
@@ -219,11 +291,13 @@ class Controller:
 
         self._algorithm = algo 
         self._n_el      = n_el
-        self._data_queue.queue.clear()
+        self._data_queue.clear()
         self._image_queue.queue.clear()    
+        self.image_hub.clear()
+        self.frame_stats.reset()
 
         self.image_reconstruct.reset(
-            self._data_queue,
+            self._reconstruction_reader,
             self._image_queue,
             self._algorithm,
             self._n_el
@@ -235,6 +309,7 @@ class Controller:
             self.x,self.y,self.tri,self.el_pos = self.image_reconstruct.get_plot_params()
         if self._algorithm == 'greit':
             self.gx,self.gy,self.ds = self.image_reconstruct.get_greit_params() 
+        self._update_tile_geometry()
 
     def plot_params(self):
         return self.x,self.y,self.tri,self.el_pos
@@ -257,8 +332,9 @@ class Controller:
         for handler in self._signal_connections.get(signal, ()):
             handler(*args, **kwargs)
 
-    def connect(self, port):
-        self.serial_handler.connect(port)
+    def connect(self, port, framing='ascii', backend=None):
+        self.serial_handler.connect(port, framing=framing,
+                                    backend=backend or self._acquisition)
         self.serial_port_name = port
         self.emit("connection_state_changed", True)
 
@@ -279,12 +355,15 @@ class Controller:
         self.serial_setmode(text)
 
         self._mode = text # just the first text not the \n
+        self._select_reader()
         if 'a' in self._mode or 'b' in self._mode:
             print ('time series or BIS \n')
             self.image_reconstruct.stop_reconstructing() 
             # clear the queue as well. 
-            self._data_queue.queue.clear()
+            self._data_queue.clear()
             self._image_queue.queue.clear()
+            self.image_hub.clear()
+            self.frame_stats.reset()
             print (self._mode)
         else: 
             if 'c' in self._mode:
@@ -303,10 +382,14 @@ class Controller:
     def serial_getmode(self):
         return self.serial_handler.getmode()
 
-    def serial_getbytestream(self):
-        return self.serial_handler.getbytes()
+    def recording_path(self):
+        return self.serial_handler.recording_path()
 
     def disconnect(self):
+        if self.playback_engine is not None:
+            self.playback_engine.close()
+            self.playback_engine = None
+            self._engine_active = False
         if self.playback is not None:
             self.playback.close()
             self.playback = None
@@ -321,22 +404,61 @@ class Controller:
 
     def step_file(self):
         if self.playback is not None:
+            self.pause_file()
             print ('stepping file.')
             return self.playback.step()
         return False
 
     def step_file_back(self):
         if self.playback is not None:
+            self.pause_file()
             return self.playback.step_back()
         return False
 
-    def run_file(self):
-        if self.playback is not None:
-            if self.playback.step():
-                self.root.after(10, self.run_file)
+    def seek_file(self, index):
+        if self._engine_active:
+            self.playback_engine.seek(index)
+        elif hasattr(self.playback, 'seek'):
+            self.playback.seek(index)
+
+    def run_file(self, speed=1.0, loop=False):
+        """
+        Play the loaded file from its current frame in a PlaybackEngine,
+        `speed` times real time, or as fast as the reconstruction takes
+        the frames with speed=None.
+        """
+        if not hasattr(self.playback, 'recording'):
+            return False
+        if self.playback_engine is None:
+            self.playback_engine = OpenEIT.backend.playback.PlaybackEngine(
+                self.playback.recording, self._data_queue,
+                pace_reader=self._reconstruction_reader)
+            self.playback_engine.start()
+        engine = self.playback_engine
+        if not self._engine_active:
+            engine.seek(self.playback.position)
+        engine.set_speed(speed)
+        engine.loop = loop
+        engine.play()
+        self._engine_active = True
+        return True
+
+    def pause_file(self):
+        """ stop the engine, stepping continues from where it stopped """
+        if self._engine_active:
+            self.playback_engine.pause()
+            self.playback.seek(self.playback_engine.position)
+            self._engine_active = False
+
+    def playback_stats(self):
+        """ frame rate and lag of the engine, None if it never ran """
+        if self.playback_engine is None:
+            return None
+        return self.playback_engine.stats()
 
     def reset_file(self):
         if self.playback is not None:
+            self.pause_file()
             self.playback.rewind()
 
     def start_recording(self):
@@ -358,3 +480,8 @@ class Controller:
     def shutdown(self):
         # stop recording to flush the buffers
         self.stop_recording()
+        if self.playback_engine is not None:
+            self.playback_engine.close()
+        worker = getattr(self, 'image_reconstruct', None)
+        if hasattr(worker, 'close'):
+            worker.close()
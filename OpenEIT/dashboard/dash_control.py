@@ -17,18 +17,28 @@ from .modes import time_series
 from .modes import imaging
 from .modes import fw
 import os 
-import urllib
+from flask import (Response, jsonify, request, send_file,
+                   send_from_directory, stream_with_context)
+from OpenEIT import metrics
+from OpenEIT.backend import recorder
+from . import push as image_push
 
 logger = logging.getLogger(__name__)
 
 class runGui(object):
 
-    def __init__(self, controller, debug=False):
+    def __init__(self, controller, debug=False, push=False, tiles=None):
 
         # Both controller and app have to be passed to the dynamically loaded page to enable callbacks and functionality with the rest of the package. 
         self.debug = debug
+        # push the reconstructed images to the browser, see push.py
+        self.push = push
+        # show server-rendered 'png' or 'webp' tiles, see tiles.py
+        self.tiles = tiles
         self.controller = controller
         self.app = None
+        if tiles is not None:
+            self.controller.enable_tiles(tiles)
 
         self.controller.register(
             "recording_state_changed",
@@ -43,7 +53,8 @@ class runGui(object):
         self.connected = False
         self.recording = False 
 
-        self.app = dash.Dash()
+        self.app = dash.Dash(
+            external_scripts=['/static/image_stream.js'] if push else [])
         self.app.css.config.serve_locally = True
         self.app.scripts.config.serve_locally = True
         # server = app.server
@@ -56,7 +67,8 @@ class runGui(object):
         self.time_series_display = time_series.Timeseriesgui(self.controller,self.app)
         self.time_serieslayout = self.time_series_display.return_layout()        
 
-        self.imaging_display = imaging.Tomogui(self.controller,self.app)
+        self.imaging_display = imaging.Tomogui(self.controller,self.app,push=push,
+                                               tiles=tiles is not None)
         self.imaginglayout = self.imaging_display.return_layout()   
 
         self.fw_display = fw.FWgui(self.controller,self.app)
@@ -130,6 +142,61 @@ class runGui(object):
             static_folder = os.path.join(os.getcwd(), 'static')
             return send_from_directory(static_folder, path)
 
+        # pipeline instrumentation, see OpenEIT/metrics.py
+        @self.app.server.route('/metrics')
+        def metrics_prometheus():
+            return Response(metrics.REGISTRY.to_prometheus(),
+                            mimetype='text/plain; version=0.0.4')
+
+        @self.app.server.route('/metrics.json')
+        def metrics_json():
+            return jsonify(metrics.REGISTRY.to_dict())
+
+        # the recording is streamed from disk, as text lines by default
+        # or as the recorded file with ?format=oeit
+        @self.app.server.route('/recording/download')
+        def download_recording():
+            path = self.controller.recording_path()
+            if path is None or not os.path.exists(path):
+                return Response('no recording', status=404)
+            if request.args.get('format') == 'oeit':
+                return send_file(os.path.abspath(path), as_attachment=True)
+            return Response(
+                stream_with_context(recorder.iter_lines(path)),
+                mimetype='text/plain',
+                headers={'Content-Disposition':
+                         'attachment; filename=rawdata.txt'})
+
+        # new reconstructed images as Server-Sent Events, ?dtype=uint8 for
+        # quantized images
+        @self.app.server.route('/stream/images')
+        def stream_images():
+            dtype = request.args.get('dtype', 'float32')
+            if dtype not in image_push.DTYPES:
+                return Response('unknown dtype', status=400)
+            return Response(
+                stream_with_context(image_push.sse_events(
+                    self.controller.image_hub, dtype)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache',
+                         'X-Accel-Buffering': 'no'})
+
+        # the rendered images, cached by frame number: /tiles/<frame>.png,
+        # or /tiles/latest.png for the latest image
+        @self.app.server.route('/tiles/<frame>.<ext>')
+        def tile(frame, ext):
+            renderer = self.controller.tile_renderer
+            if renderer is None or ext != renderer.fmt:
+                return Response('no such tile', status=404)
+            latest = frame == 'latest'
+            if not latest and not frame.isdigit():
+                return Response('no such tile', status=404)
+            data = renderer.get(renderer.latest_seq if latest else int(frame))
+            if data is None:
+                return Response('no such tile', status=404)
+            return Response(data, mimetype=renderer.mimetype, headers={
+                'Cache-Control': 'no-cache' if latest else 'max-age=3600'})
+
         @self.app.callback( 
             dash.dependencies.Output('recordbutton', 'children'),
             [dash.dependencies.Input('recordbutton', 'n_clicks')])
@@ -194,21 +261,11 @@ class runGui(object):
             dash.dependencies.Output('download-link', 'href'),
             [dash.dependencies.Input('recordbutton', 'n_clicks')])
         def update_download_link(n_clicks):
-            if n_clicks is not None:
-                if self.recording == False:
-                    return 'hi there'
-                    # if self.connected == True: 
-                    #     self.controller.start_recording()
-                    #     return ''
-                    # else: 
-                    #     print ('comms not connected')
-                    #     return ''
-                else:
-                    datastream = self.controller.serial_getbytestream()
-                    # print (datastream)
-                    #csv_string = datastream.to_csv(index=False, encoding='utf-8')
-                    csv_string = "data:text/txt;charset=utf-8," + urllib.parse.quote(datastream)
-                    return csv_string  
+            # the recording streams from disk, see download_recording
+            if n_clicks is not None and self.controller.recording_path() is not None:
+                return '/recording/download'
+            return ''
+
   
         # Switch to False    
         self.app.run(debug=self.debug)
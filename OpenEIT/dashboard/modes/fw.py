@@ -16,6 +16,7 @@ import plotly.graph_objs as go
 from flask import send_from_directory
 import serial.tools.list_ports
 import OpenEIT.dashboard
+from OpenEIT import metrics
 import queue
 
 # TODO: It would be nice to livestream the data from the serial port here. 
@@ -72,8 +73,9 @@ class FWgui(object):
 
     # Get's new data off the serial port. 
     def process_data(self):
-        while not self.controller.data_queue.empty():
-            self.data = self.controller.data_queue.get()
+        latest = self.controller.data_queue.latest()
+        if latest is not None:
+            self.data = latest
             #self.data_dict[f] = amp
 
     def return_layout(self):
@@ -158,6 +160,7 @@ class FWgui(object):
         @self.app.callback(
             Output('textarea', 'value'),
             [Input('interval-component', 'n_intervals')])
+        @metrics.timed(metrics.CALLBACK_SECONDS.labels('fw'))
         def update_textbox(n):
             return self.controller.return_line()
 
@@ -19,7 +19,7 @@ import matplotlib.cm as cm
 from flask import send_from_directory
 import serial.tools.list_ports
 import OpenEIT.dashboard
-import queue
+from OpenEIT import metrics
 import numpy as np
 import base64
 #import io
@@ -32,6 +32,26 @@ PORT    = 8050
 S_TO_MS = 1000
 PLOT_REFRESH_INTERVAL = 0.5 * S_TO_MS
 
+# partial figure updates (dash >= 2.9), the full figure is sent without
+Patch = getattr(dash, 'Patch', None)
+
+# colour levels of the mesh, the entries of the matplotlib colormap
+LUT_SIZE = 256
+MESH_COLORSCALE = [[i / float(LUT_SIZE - 1),
+                    'rgb(%d,%d,%d)' % tuple(int(c * 255 + 0.5) for c in cm.plasma(i)[:3])]
+                   for i in range(LUT_SIZE)]
+
+
+def face_levels(img, tri, vmin, vmax):
+    """
+    Colour level (index into MESH_COLORSCALE) of every triangle, the mean
+    of its vertex values scaled from [vmin, vmax] as the colormap does.
+    """
+    zmean = np.asarray(img, dtype=float)[tri].mean(axis=1)
+    t = (zmean - vmin) / float(vmax - vmin)
+    levels = np.floor(np.nan_to_num(t) * LUT_SIZE)
+    return np.clip(levels, 0, LUT_SIZE - 1).astype(np.uint8)
+
 # _LOGGER = logging.getLogger(__name__)
 # _LOGGER.setLevel(logging.DEBUG)
 # _LOGGER.addHandler(logging.StreamHandler())
@@ -46,10 +66,15 @@ flask_logger.setLevel(logging.INFO)
 
 class Tomogui(object):
 
-    def __init__(self, controller, app):
+    def __init__(self, controller, app, push=False, tiles=False):
 
         self.controller = controller
         self.app= app 
+        # the images are pushed to the browser (see push.py), the
+        # interval only sends the geometry and the colour range
+        self.push = push
+        # the images are rendered to tiles by controller.tile_renderer
+        self.tiles = tiles
 
         self.n_el = self.controller.n_el
         self.algorithm = self.controller.algorithm
@@ -75,45 +100,28 @@ class Tomogui(object):
         self.mode = self.controller.serial_getmode()
         # self.rsvaluemin = self.vmin
         # self.rsvaluemax = self.vmax
-        self.run_file = False 
+        # file playback speeds, multiples of real time
+        self.playback_speeds = ['1', '2', '5', '10', 'max']
 
         self.n_electrodes = ['8','16','32']
         self.algorithms   = ['jac','bp','greit']
         self.img = None
+        self._image_seq = 0
 
     # Get's new data off the serial port. 
     def process_data(self):
-        try:
-            self.img = self.controller.image_queue.get_nowait()
-        except queue.Empty:
-            pass
-        else:
+        latest = self.controller.image_hub.latest(self._image_seq)
+        if latest is not None:
+            self._image_seq, self.img = latest
             logger.info("rendering new image ...")
 
     def set_baseline(self):
         print ('setting the baseline')
         self.controller.baseline()
 
-    def run_file(self):
-        self.run_file = True
-        # this should be a bool so that self. controller.step_file is called every update interval. 
-        # self.controller.step_file()
-
-    def map_z2color(self,zval, colormap, vmin, vmax):
-        #map the normalized value zval to a corresponding color in the colormap
-
-        if vmin>vmax:
-            raise ValueError('incorrect relation between vmin and vmax')
-        t=(zval-vmin)/float((vmax-vmin))#normalize val
-        R, G, B, alpha=colormap(t)
-        return 'rgb('+'{:d}'.format(int(R*255+0.5))+','+'{:d}'.format(int(G*255+0.5))+\
-               ','+'{:d}'.format(int(B*255+0.5))+')'
-
-    def tri_indices(self,simplices):
-        #simplices is a numpy array defining the simplices of the triangularization
-        #returns the lists of indices i, j, k
-
-        return ([triplet[c] for triplet in simplices] for c in range(3))
+    def run_file(self, speed='1'):
+        # the playback engine feeds the frames, see Controller.run_file
+        self.controller.run_file(speed=None if speed == 'max' else float(speed))
 
     def return_layout(self):
 
@@ -181,6 +189,17 @@ class Tomogui(object):
                 
                             ], className='btn-group', style={'width': '100%', 'display': 'inline-block'} ),
 
+                            html.Div( [
+                            dcc.Dropdown(
+                                id='playback-speed',
+                                options=[{'label': name if name == 'max' else name + 'x', 'value': name} for name in self.playback_speeds],
+                                value = '1',
+                                clearable = False,
+                                ),
+                            ], className='btn-group',style={'width': '30%', 'display': 'inline-block','text-align': 'center'} ),
+
+                            html.Div(id='playback-stats', style={'width': '70%', 'display': 'inline-block'}),
+
                         ], style={'width': '100%', 'display': 'inline-block'} ),
 
                         html.Div( [
@@ -255,14 +274,24 @@ class Tomogui(object):
 
 
                     html.Div( [
-                        # The big image graph. 
-                        dcc.Graph(
+                        # The big image graph, or the tile rendered by the
+                        # server (see tiles.py)
+                        html.Img(
+                            id='live-update-tile',
+                            style={'width': 500, 'height': 500,
+                                   'image-rendering': 'pixelated'}
+                        ) if self.tiles else dcc.Graph(
                             id='live-update-image',
                             animate=False,
                             config={
                                 'displayModeBar': False
                             }
                         ),
+                        # what the browser holds in live-update-image,
+                        # the geometry is only sent when it changes
+                        None if self.tiles else dcc.Store(id='live-update-image-key'),
+                        html.Div(id='image-stream', hidden=True,
+                                 **{'data-url': '/stream/images'}) if self.push and not self.tiles else None,
                         dcc.Interval(
                         id='interval-component',
                         interval=PLOT_REFRESH_INTERVAL,
@@ -293,7 +322,6 @@ class Tomogui(object):
                 content_type, content_string = contents.split(',')
                 decoded = base64.b64decode(content_string)
                 self.controller.load_file(filename,decoded)
-                self.run_file = False
                 return 'file loaded'
             else: 
                 return 'no file'
@@ -305,7 +333,6 @@ class Tomogui(object):
             if n_clicks is not None:
                 print ('step forward')
                 self.controller.step_file()
-                self.run_file = False
                 return 'step'
             else: 
                 return 'not step'
@@ -317,7 +344,6 @@ class Tomogui(object):
             if n_clicks is not None:
                 print ('step back')
                 self.controller.step_file_back()
-                self.run_file = False
                 return 'step back'
             else: 
                 return 'not step back'
@@ -374,10 +400,11 @@ class Tomogui(object):
 
         @self.app.callback(
                     Output("arunfile", "children"),
-                    [Input("runfile", "n_clicks")], )
-        def runfile(n_clicks):
+                    [Input("runfile", "n_clicks")],
+                    [State("playback-speed", "value")])
+        def runfile(n_clicks, speed):
             if n_clicks is not None:
-                self.run_file = True
+                self.run_file(speed)
                 return 'runfile'
             else: 
                 return 'not runfile'
@@ -388,11 +415,21 @@ class Tomogui(object):
         def resetfilemarker(n_clicks):
             if n_clicks is not None:
                 self.controller.reset_file()  
-                self.run_file = False
                 return 'reset filem'
             else: 
                 return 'reset not'   
 
+        @self.app.callback(
+                    Output("playback-stats", "children"),
+                    [Input('interval-component', 'n_intervals')])
+        def playback_stats(n):
+            stats = self.controller.playback_stats()
+            if stats is None:
+                return ''
+            return 'frame {} / {}, {:.1f} fps, {:.2f} s behind'.format(
+                stats['position'], stats['n_frames'], stats['frame_rate'],
+                stats['lag_seconds'])
+
         @self.app.callback(
                     Output("abaseline", "children"),
                     [Input("baseline", "n_clicks")], )
@@ -462,159 +499,177 @@ class Tomogui(object):
                 return html.Div(
             DYNAMIC_CONTROLS
             )
-        @self.app.callback(
-            Output('live-update-image', 'figure'),
-            [Input('interval-component', 'n_intervals')])
-        def update_graph_scatter(n):
-            # update the data queue. 
-            if self.run_file is True: 
-               if self.controller.step_file():
-                  print ('stepped the file')
-                  # self.process_data()
-               else: 
-                    self.run_file = False
-
-            self.mode = self.controller.serial_getmode()
-            if 'c' in self.mode or 'd' in self.mode or 'e' in self.mode: # and self.run_file is False:
-                self.process_data()
-
-            if self.algorithm  == 'greit':
-                self.gx,self.gy,self.ds = self.controller.greit_params()
-
-                # If algorithm is GREIT 
-                layout = go.Layout(
-                    width = 500,
-                    height = 500,
-                    # title = "EIT reconstruction",
-                    xaxis = dict(
-                      #nticks = 10,
-                      domain = [0.0, 0.0],
-                      showgrid=False,
-                      zeroline=False,
-                      showline=False,
-                      ticks='',
-                      showticklabels=False,
-                      # autorange = 'reversed',
-                      # title='EIT',
-                    ),
-                    yaxis = dict(
-                      scaleanchor = "x",
-                      domain = [0, 0.0],
-                      showgrid=False,
-                      zeroline=False,
-                      showline=False,
-                      ticks='',
-                      showticklabels=False,
-                      # autorange = 'reversed',
-                    ),
-                    showlegend= False
-                )
+        # only the callbacks of the image view in the layout, the other
+        # one would fail on every tick
+        if not self.tiles:
+            @self.app.callback(
+                [Output('live-update-image', 'figure'),
+                 Output('live-update-image-key', 'data')],
+                [Input('interval-component', 'n_intervals')],
+                [State('live-update-image-key', 'data')])
+            @metrics.timed(metrics.CALLBACK_SECONDS.labels('imaging'))
+            def update_graph_scatter(n, figure_key):
+                self.mode = self.controller.serial_getmode()
+                if 'c' in self.mode or 'd' in self.mode or 'e' in self.mode: # and self.run_file is False:
+                    self.process_data()
 
-                data = [
-                    go.Heatmap(
-                        z=self.img,
-                        colorscale='Jet',
-                        zmin=self.vmin, zmax=self.vmax,
-                        colorbar=dict(
-                                #title='Colorbar',
-                                lenmode = 'fraction',
-                                len = 1.0,
-                                x=1.2,
-                                y = 0.5
-                            ),
+                if self.algorithm  == 'greit':
+                    self.gx,self.gy,self.ds = self.controller.greit_params()
+                    if self.img is None:
+                        self.img = np.zeros((32,32),dtype=float)
+
+                    geometry = ['greit', list(np.shape(self.img))]
+                    if Patch is not None and self._same_geometry(figure_key, geometry):
+                        if self.push and self._same_range(figure_key):
+                            return dash.no_update, dash.no_update
+                        # same grid, only the image changes
+                        patched = Patch()
+                        patched['data'][0]['z'] = self.img
+                        patched['data'][0]['zmin'] = self.vmin
+                        patched['data'][0]['zmax'] = self.vmax
+                        return self._range_patch(patched, geometry)
+
+                    # If algorithm is GREIT 
+                    layout = go.Layout(
+                        width = 500,
+                        height = 500,
+                        # title = "EIT reconstruction",
+                        xaxis = dict(
+                          #nticks = 10,
+                          domain = [0.0, 0.0],
+                          showgrid=False,
+                          zeroline=False,
+                          showline=False,
+                          ticks='',
+                          showticklabels=False,
+                          # autorange = 'reversed',
+                          # title='EIT',
+                        ),
+                        yaxis = dict(
+                          scaleanchor = "x",
+                          domain = [0, 0.0],
+                          showgrid=False,
+                          zeroline=False,
+                          showline=False,
+                          ticks='',
+                          showticklabels=False,
+                          # autorange = 'reversed',
+                        ),
+                        showlegend= False
                     )
-                ]
-            else: 
 
-                camera = dict(
-                    up=dict(x=0, y=0, z=1),
-                    center=dict(x=0, y=0, z=0),
-                    eye=dict(x=0.0, y=0.0, z=2.5)
-                )
-
-                noaxis=dict(showbackground=False,
-                            showline=False,
-                            zeroline=False,
-                            showgrid=False,
-                            showticklabels=False,
-                            title=''
-                          )
-
-                layout = go.Layout(
-                         width=800,
-                         height=800,
-                         scene=dict(
-                            xaxis=noaxis,
-                            yaxis=noaxis,
-                            zaxis=noaxis,
-                            aspectratio=dict(
-                                x=1.0,
-                                y=1.0,
-                                z=0.0),
-                            camera =camera,
-                            )
+                    data = [
+                        go.Heatmap(
+                            z=self.img,
+                            colorscale='Jet',
+                            zmin=self.vmin, zmax=self.vmax,
+                            colorbar=dict(
+                                    #title='Colorbar',
+                                    lenmode = 'fraction',
+                                    len = 1.0,
+                                    x=1.2,
+                                    y = 0.5
+                                ),
                         )
+                    ]
+                else: 
 
-                if self.img is None or (len(self.el_pos) != self.controller.n_el):
-                    self.x,self.y,self.tri,self.el_pos = self.controller.plot_params()
-                    self.img = np.zeros(self.x.shape[0]) 
-                    self.img[1] = 2.0
-
-                if self.vmin >= self.vmax: 
-                    self.vmin = 0 
-                    self.vmax = 1000
+                    camera = dict(
+                        up=dict(x=0, y=0, z=1),
+                        center=dict(x=0, y=0, z=0),
+                        eye=dict(x=0.0, y=0.0, z=2.5)
+                    )
 
-                simplices=self.tri
-                colormap = cm.plasma # specify the colormap
-                if len(self.img) == 0: 
-                    self.img = np.zeros(self.x.shape[0]) 
-                    self.img[1] = 2.0
-
-                points3D = np.vstack((self.x,self.y,self.img)).T
-                tri_vertices=map(lambda index: points3D[index], simplices)# vertices of the surface triangles     
-                zmean=[np.mean(tri[:,2]) for tri in tri_vertices ]# mean values of z-coordinates of 
-                                                                  #triangle vertices
-                min_zmean=self.vmin #np.min(zmean)
-                max_zmean=self.vmax #np.max(zmean)
-                facecolor=[self.map_z2color(zz,  colormap, min_zmean, max_zmean) for zz in zmean]
-                I,J,K=self.tri_indices(simplices)
-                self.zoro = np.zeros(len(self.img))
-
-                data = [
-                    go.Mesh3d(x=self.x,y=self.y,z=self.zoro,facecolor = facecolor,i=I,j=J,k=K,name='')
-                ]
+                    noaxis=dict(showbackground=False,
+                                showline=False,
+                                zeroline=False,
+                                showgrid=False,
+                                showticklabels=False,
+                                title=''
+                              )
+
+                    layout = go.Layout(
+                             width=800,
+                             height=800,
+                             scene=dict(
+                                xaxis=noaxis,
+                                yaxis=noaxis,
+                                zaxis=noaxis,
+                                aspectratio=dict(
+                                    x=1.0,
+                                    y=1.0,
+                                    z=0.0),
+                                camera =camera,
+                                )
+                            )
 
-            return {'data': data, 'layout': layout}
+                    if self.img is None or (len(self.el_pos) != self.controller.n_el):
+                        self.x,self.y,self.tri,self.el_pos = self.controller.plot_params()
+                        self.img = np.zeros(self.x.shape[0]) 
+                        self.img[1] = 2.0
+
+                    if self.vmin >= self.vmax: 
+                        self.vmin = 0 
+                        self.vmax = 1000
+
+                    if len(self.img) != self.x.shape[0]: 
+                        self.img = np.zeros(self.x.shape[0]) 
+                        self.img[1] = 2.0
+
+                    # one colour level per triangle, the mesh itself does not
+                    # change between frames
+                    intensity = face_levels(self.img, self.tri, self.vmin, self.vmax)
+                    geometry = [self.algorithm, int(self.controller.n_el), len(self.tri)]
+                    if Patch is not None and self._same_geometry(figure_key, geometry):
+                        if self.push and self._same_range(figure_key):
+                            return dash.no_update, dash.no_update
+                        patched = Patch()
+                        patched['data'][0]['intensity'] = intensity
+                        return self._range_patch(patched, geometry)
+
+                    tri = np.asarray(self.tri)
+                    data = [
+                        go.Mesh3d(x=self.x,y=self.y,z=np.zeros(len(self.x)),
+                                  i=tri[:,0],j=tri[:,1],k=tri[:,2],
+                                  intensity=intensity,intensitymode='cell',
+                                  colorscale=MESH_COLORSCALE,cmin=0,cmax=LUT_SIZE - 1,
+                                  showscale=False,name='')
+                    ]
+
+                layout.meta = self._range_meta()
+                return {'data': data, 'layout': layout}, self._figure_key(geometry)
+
+        if self.tiles:
+            @self.app.callback(
+                Output('live-update-tile', 'src'),
+                [Input('interval-component', 'n_intervals')],
+                [State('live-update-tile', 'src')])
+            def update_tile(n, src):
+                renderer = self.controller.tile_renderer
+                if renderer is None:
+                    return dash.no_update
+                if self.vmin < self.vmax:
+                    renderer.set_range(self.vmin, self.vmax)
+                url = renderer.url()
+                if url is None or url == src:
+                    return dash.no_update
+                return url
 
         @self.app.callback(
             Output('live-update-histogram', 'figure'),
             [Input('interval-component', 'n_intervals')])
+        @metrics.timed(metrics.CALLBACK_SECONDS.labels('imaging_histogram'))
         def update_graph_scatter(n):
-
-            flatimg = [0,1,0]
-            #data = [go.Histogram(x=flatimg)]
-            if self.algorithm == 'greit':
-                # print ('algorithm is greit')
-                # self.gx,self.gy,self.ds = self.controller.greit_params()
-                # self.img = self.ds 
-                if self.img is None:
-                    self.img = np.zeros((32,32),dtype=float)
-                    nanless = self.img[~np.isnan(self.img)]
-                    flatimg = (nanless).flatten()
-                else: 
-                    nanless = self.img[~np.isnan(self.img)]
-                    flatimg = (nanless).flatten()
-            else: 
-                self.x,self.y,self.tri,self.el_pos = self.controller.plot_params()
-                if self.img is not None:
-                    flatness = np.array(self.img).ravel()
-                    nanless = flatness[~np.isnan(flatness)]
-                    flatimg = (nanless).flatten()
-
-                else: 
-                    print ('nothing to histogram yet')
-                    flatimg = [0,1,0]
-            data = [go.Histogram(x=flatimg)]
+            # binned next to the reconstruction, see reconstruction/stats.py
+            summary = self.controller.frame_stats.summary()
+            # (a plain trace, the validation of go.Bar costs more than the
+            # rest of the tick)
+            if summary and summary['counts']:
+                edges = summary['edges']
+                data = [{'type': 'bar', 'x': edges[:-1], 'y': summary['counts'],
+                         'offset': 0, 'width': edges[1] - edges[0]}]
+            else:
+                data = [{'type': 'bar', 'x': [], 'y': []}]
 
             layout = go.Layout(
                 title='Histogram',
@@ -635,9 +690,12 @@ class Tomogui(object):
 
         def autoscale(): 
             print ('we are in the autoscale function')
-            nanless = self.img[~np.isnan(self.img)]
-            self.vmax= float(int(np.max(nanless)*100))/100.0
-            self.vmin =float(int(np.min(nanless)*100))/100.0
+            # the decayed range of the last frames, stable from frame to frame
+            scale = self.controller.frame_stats.autoscale_range()
+            if scale is None:
+                scale = (0, 0)
+            self.vmax= float(int(scale[1]*100))/100.0
+            self.vmin =float(int(scale[0]*100))/100.0
 
             if self.vmax <= self.vmin: # safety value. 
                 self.vmin = 0
@@ -647,6 +705,33 @@ class Tomogui(object):
 
         return self.layout
 
+    def _range_meta(self):
+        """ colour range of the figure, for the client of the pushed images """
+        return {'vmin': self.vmin, 'vmax': self.vmax}
+
+    def _figure_key(self, geometry):
+        """
+        live-update-image-key of a figure: its geometry and colour range.
+        The Store lives in each browser, so every viewer is compared
+        against what it holds, not against the last viewer served.
+        """
+        return {'geometry': geometry, 'range': [self.vmin, self.vmax]}
+
+    @staticmethod
+    def _same_geometry(figure_key, geometry):
+        return bool(figure_key) and figure_key.get('geometry') == geometry
+
+    def _same_range(self, figure_key):
+        return figure_key.get('range') == [self.vmin, self.vmax]
+
+    def _range_patch(self, patched, geometry):
+        """ outputs of a patched figure, with its new key when pushing """
+        if not self.push:
+            # the patches carry the range themselves
+            return patched, dash.no_update
+        patched['layout']['meta'] = self._range_meta()
+        return patched, self._figure_key(geometry)
+
     def on_connection_state_changed(self, connected):
         if connected:
             self.connected = True
@@ -16,6 +16,7 @@ import plotly.graph_objs as go
 from flask import send_from_directory
 import serial.tools.list_ports
 import OpenEIT.dashboard
+from OpenEIT import metrics
 import queue
 
 PORT = 8050
@@ -99,6 +100,7 @@ class BISgui(object):
         @self.app.callback(
             Output('live-update-spectrogram', 'figure'),
             [Input('interval-component', 'n_intervals')])
+        @metrics.timed(metrics.CALLBACK_SECONDS.labels('spectroscopy'))
         def update_graph_scatter(n):
             self.mode = self.controller.serial_getmode()
             if 'b'in self.mode:
@@ -16,7 +16,9 @@ import plotly.graph_objs as go
 from flask import send_from_directory
 import serial.tools.list_ports
 import OpenEIT.dashboard
-import queue
+from OpenEIT import metrics
+from OpenEIT.dashboard.streaming import (SampleRing, StreamingFilter,
+                                         WelchAccumulator)
 import time
 from datetime import datetime, timedelta
 import numpy as np
@@ -36,11 +38,12 @@ PLOT_REFRESH_INTERVAL = 0.2 * S_TO_MS
 DATA_OUTPUT_DIR = 'data'
 BUFFER_SIZE = 500
 NSPERG = 256
+# Welch segments averaged, the segments of one buffer (50% overlap)
+WELCH_SEGMENTS = (BUFFER_SIZE - NSPERG) // (NSPERG // 2) + 1
 DT_FORMAT = '%y-%m-%d %H:%M:%S.%f'
 # Filter params
 FILTER_ORDER = 1
 SAMPLING_FREQUENCY = 25.0
-FILTER_WINDOW_SIZE = 20
 F_NYQUIST = 0.5 * SAMPLING_FREQUENCY
 FILTER_TYPE = 'low'
 CUTOFF_FREQUENCY = 3.0
@@ -54,23 +57,21 @@ flask_logger.setLevel(logging.INFO)
 
 
 
-def _clean_value(value, value_history):
-
-    if len(value_history) > 0:
-        last_valid_value = value_history[-1]
-    else:
-        last_valid_value = 0 #None
-
-    if value:
-        try:
-            value = value
-        except ValueError:
-            value = last_valid_value
-            _LOGGER.debug('Skipping value: %s' % value)
-    else:
-        value = last_valid_value
-        _LOGGER.debug('No serial data')
-    return value
+def _clean_values(values, last_valid=None):
+    """
+    Missing samples (0) repeat the last valid value, those before any
+    valid value are dropped.
+    """
+    valid = values != 0
+    if valid.all():
+        return values
+    _LOGGER.debug('No serial data for %d samples' % (values.size - valid.sum()))
+    # index of the last valid sample at or before each sample
+    idx = np.where(valid, np.arange(values.size), -1)
+    np.maximum.accumulate(idx, out=idx)
+    filled = np.where(idx >= 0, values[np.maximum(idx, 0)],
+                      last_valid if last_valid is not None else 0)
+    return filled[filled != 0]
 
 
 def _format_timestamp_to_string(timestamp):
@@ -123,20 +124,24 @@ class Timeseriesgui(object):
         self.portnames      = [item[0] for item in full_ports]
         self.mode = self.controller.serial_getmode()
         self.canned_data_interval = 1/SAMPLING_FREQUENCY
-        self.tdelta = timedelta(seconds=self.canned_data_interval)
+        self.tdelta = np.timedelta64(
+            timedelta(seconds=self.canned_data_interval), 'us')
         # Filtered data True or False. 
         self.filter_data = True #filter_data
         self.a, self.b = signal.butter(FILTER_ORDER, CUTOFF, btype=FILTER_TYPE)
-        self.y_filtered = []
-        self.sliding_window = np.zeros(FILTER_WINDOW_SIZE)  # Window to filter
+        # the filter state is carried from batch to batch
+        self.lowpass = StreamingFilter(self.a, self.b)
         # Stats
         self.nb_points = 0
         self.start_time = time.time()
-        # Time series
+        # Time series, the last buffer_size samples
         self.buffer_size = BUFFER_SIZE
-        self.x = []
-        self.y = []
+        self.x = SampleRing(self.buffer_size, dtype='datetime64[us]')
+        self.y = SampleRing(self.buffer_size)
+        self.y_filtered = SampleRing(self.buffer_size)
         # PSD
+        self.welch = WelchAccumulator(NSPERG, fs=SAMPLING_FREQUENCY,
+                                      n_segments=WELCH_SEGMENTS)
         self.freqs = []
         self.psd = []
 
@@ -152,48 +157,29 @@ class Timeseriesgui(object):
 
     # Get's new data off the serial port. 
     def process_data(self):
-        y_batch = []
-        # get data off the stack. 
-        while not self.controller.data_queue.empty():
-            y_batch = self.controller.data_queue.get()
-
-        t       = datetime.now()
-        value   = y_batch
-    
-        for i in range(len(y_batch)):
-            value   = y_batch[i]
-            t       = t + self.tdelta
-
-            value = _clean_value(value,self.y)
-
-            if value:
-                #print ('v',len(self.y) )
-                self.y.append(value)
-                self.x.append(t)
-                if len(self.y) > self.buffer_size:
-                    self.y.pop(0)
-                    self.x.pop(0)
-                # Update sliding window
-                new_window = np.append(self.sliding_window[1:], value)
-                self.sliding_window = new_window
-
-                 # Update y_filtered
-                if self.filter_data:
-                    results = signal.lfilter(self.a, self.b, self.sliding_window)
-                    result = results[-1]
-                    self.y_filtered.append(result)
-                    if len(self.y_filtered) > self.buffer_size:
-                        self.y_filtered.pop(0)
-
-            # Update PSD
-            nsperg = NSPERG
-            if len(self.y) < NSPERG:
-                nsperg = len(self.y)
-            self.freqs, self.psd = signal.welch(self.y,
-                                                nperseg=nsperg,
-                                                fs=SAMPLING_FREQUENCY)
+        # every sample read since the last tick, handled as one batch
+        batch = self.controller.data_queue.get_all()
+        batch = _clean_values(batch, self.y.last())
+        n = batch.size
+        if n == 0:
+            return
+
+        t = np.datetime64(datetime.now(), 'us')
+        self.x.extend(t + np.arange(1, n + 1) * self.tdelta)
+        self.y.extend(batch)
+        if self.filter_data:
+            self.y_filtered.extend(self.lowpass.process(batch))
+        self.nb_points += n
+
+        # Update PSD, with the new complete segments only
+        self.welch.update(batch)
+        psd = self.welch.psd()
+        if psd is None:
+            # less than a segment so far, one shorter segment
+            y = self.y.view()
+            psd = signal.welch(y, nperseg=len(y), fs=SAMPLING_FREQUENCY)
+        self.freqs, self.psd = psd
 
-        
         # Log some stats about the data
         #self._log_stats()     
 
@@ -229,6 +215,7 @@ class Timeseriesgui(object):
          
         @self.app.callback(Output('live-update-time-series', 'figure'),
                       [Input('interval-component', 'n_intervals')])
+        @metrics.timed(metrics.CALLBACK_SECONDS.labels('time_series'))
         def update_graph_scatter(n):
             self.mode = self.controller.serial_getmode()
 
@@ -237,9 +224,11 @@ class Timeseriesgui(object):
                 self.process_data()
 
             if len(self.x) > 0:
+                x = self.x.view()
+                y = self.y.view()
                 trace1 = go.Scatter(
-                    x=self.x,
-                    y=self.y,
+                    x=x,
+                    y=y,
                     mode='lines',
                     name='Data',
                     # line={'shape': 'spline'}
@@ -249,18 +238,18 @@ class Timeseriesgui(object):
 
                 if len(self.y_filtered) > 0:
                     trace2 = go.Scatter(
-                        x=self.x,
-                        y=self.y_filtered,
+                        x=x,
+                        y=self.y_filtered.view(),
                         mode='lines',
                         name='Filtered Data',
                         # line={'shape': 'spline'}
                     )
                     data.append(trace2)
 
-                x_min = min(self.x)
-                x_max = max(self.x)
-                y_min = min(self.y)
-                y_max = max(self.y)
+                x_min = x.min()
+                x_max = x.max()
+                y_min = y.min()
+                y_max = y.max()
 
                 layout = go.Layout(
                     title='Time Series Data',
@@ -279,6 +268,7 @@ class Timeseriesgui(object):
 
         @self.app.callback(Output('live-update-psd', 'figure'),
                       [Input('interval-component', 'n_intervals')])
+        @metrics.timed(metrics.CALLBACK_SECONDS.labels('time_series_psd'))
         def update_graph_scatter(n):
             if len(self.x) > 0:
                 trace1 = go.Scatter(
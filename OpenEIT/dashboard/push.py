@@ -0,0 +1,188 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Push of the reconstructed images to the browser.
+
+The ImageHub holds the latest image: a pump thread moves the images from
+the output queue of the reconstruction into it, the Dash callbacks read
+it and every browser connected to the Server-Sent Events stream
+(/stream/images, see dash_control.py) is sent each new image once, when
+it is published. An image is one SSE event whose data is JSON::
+
+    {"seq": 12, "shape": [373], "dtype": "float32", "data": "<base64>"}
+
+'float32' sends the little-endian values. 'uint8' sends levels 0..254,
+value = offset + level * step with the offset and step of the message,
+and 255 for NaN (the outside of the GREIT grid).
+
+static/image_stream.js renders the events into the imaging graph.
+"""
+
+import base64
+import contextlib
+import json
+import logging
+import threading
+
+import numpy as np
+
+from .. import metrics
+
+logger = logging.getLogger(__name__)
+
+DTYPES = ('float32', 'uint8')
+
+# seconds between keep-alive comments of an idle stream
+HEARTBEAT = 15.
+
+_NAN_LEVEL = 255
+
+_SUBSCRIBERS = metrics.REGISTRY.gauge(
+    'openeit_push_subscribers',
+    'browsers connected to the image stream').labels()
+_PUSHED_BYTES = metrics.REGISTRY.counter(
+    'openeit_pushed_bytes_total',
+    'bytes of images pushed to the browsers').labels()
+
+
+class ImageHub:
+    """ the latest image, numbered, for any number of readers """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._image = None
+        self._pump = None
+        self._listeners = []
+        self.subscribers = 0
+
+    def add_listener(self, func):
+        """ call func(seq, image) on every published image """
+        self._listeners.append(func)
+
+    def publish(self, image):
+        with self._cond:
+            self._seq += 1
+            seq = self._seq
+            self._image = image
+            self._cond.notify_all()
+        for func in self._listeners:
+            try:
+                func(seq, image)
+            except Exception:
+                logger.exception('image listener %r failed', func)
+
+    def clear(self):
+        """ forget the image (reconstruction reconfigured) """
+        with self._cond:
+            self._image = None
+
+    def latest(self, after=0):
+        """ (seq, image) if an image newer than `after` exists, else None """
+        with self._cond:
+            if self._seq > after and self._image is not None:
+                return self._seq, self._image
+            return None
+
+    def wait_for(self, after=0, timeout=None):
+        """ as latest, waiting up to `timeout` seconds for a new image """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._seq > after and self._image is not None,
+                timeout)
+        return self.latest(after)
+
+    @contextlib.contextmanager
+    def subscribe(self):
+        """ count a reader of the stream while the block runs """
+        with self._cond:
+            self.subscribers += 1
+        _SUBSCRIBERS.inc()
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+            _SUBSCRIBERS.inc(-1)
+
+    def pump(self, source, stats=None):
+        """
+        Publish the images put in the queue `source`, from a thread. The
+        FrameStats `stats` is updated with every image before it is
+        published.
+        """
+        def run():
+            while True:
+                # one bad image must not stop the images that follow
+                try:
+                    image = source.get()
+                    if stats is not None:
+                        stats.update(image)
+                    self.publish(image)
+                except Exception:
+                    logger.exception('image pump failed on an image')
+
+        self._pump = threading.Thread(target=run, daemon=True,
+                                      name='image-pump')
+        self._pump.start()
+
+
+def encode_image(image, dtype='float32'):
+    """ the JSON-serializable message of one image, see the module """
+    if dtype not in DTYPES:
+        raise ValueError('unknown dtype %r, expected one of %s' % (
+            dtype, ', '.join(DTYPES)))
+    img = np.asarray(image, dtype=float)
+    msg = {'shape': list(img.shape), 'dtype': dtype}
+    if dtype == 'uint8':
+        finite = np.isfinite(img)
+        lo = float(img[finite].min()) if finite.any() else 0.
+        hi = float(img[finite].max()) if finite.any() else 0.
+        step = (hi - lo) / (_NAN_LEVEL - 1) or 1.
+        levels = np.full(img.shape, _NAN_LEVEL, dtype=np.uint8)
+        levels[finite] = np.round((img[finite] - lo) / step)
+        msg.update(offset=lo, step=step)
+        raw = levels.tobytes()
+    else:
+        raw = img.astype('<f4').tobytes()
+    msg['data'] = base64.b64encode(raw).decode('ascii')
+    return msg
+
+
+def decode_image(msg):
+    """ the image of a message of encode_image (float64, for tests) """
+    raw = base64.b64decode(msg['data'])
+    if msg['dtype'] == 'uint8':
+        levels = np.frombuffer(raw, dtype=np.uint8)
+        img = msg['offset'] + levels * msg['step']
+        img[levels == _NAN_LEVEL] = np.nan
+    else:
+        img = np.frombuffer(raw, dtype='<f4').astype(float)
+    return img.reshape(msg['shape'])
+
+
+def sse_events(hub, dtype='float32', heartbeat=HEARTBEAT):
+    """
+    Generator of the text/event-stream of `hub`, one event per new image.
+    Images published while the previous one is sent are skipped, a slow
+    browser gets the latest image instead of a backlog.
+    """
+    seq = 0
+    with hub.subscribe():
+        # reconnect quickly after a restart of the server
+        yield 'retry: 1000\n\n'
+        while True:
+            latest = hub.wait_for(seq, heartbeat)
+            if latest is None:
+                yield ': keep-alive\n\n'
+                continue
+            seq, image = latest
+            msg = encode_image(image, dtype)
+            msg['seq'] = seq
+            event = 'event: image\nid: %d\ndata: %s\n\n' % (
+                seq, json.dumps(msg))
+            _PUSHED_BYTES.inc(len(event))
+            yield event
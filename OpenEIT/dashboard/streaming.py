@@ -0,0 +1,149 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Streaming building blocks of the time series mode.
+
+The samples arrive in batches (all the frames read since the last tick),
+every block handles a whole batch with NumPy, so the cost per sample does
+not depend on the buffer length:
+
+- SampleRing keeps the last `capacity` samples in a preallocated array,
+- StreamingFilter runs scipy.signal.lfilter on each batch, carrying the
+  filter state (zi) from batch to batch,
+- WelchAccumulator computes the periodogram of each new complete segment
+  once and averages the last `n_segments` of them, which is the Welch PSD
+  of the latest samples.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+
+class SampleRing:
+    """
+    The last `capacity` values of a stream.
+
+    The values are written twice, `capacity` apart, so the window is
+    always one contiguous view and never copied.
+    """
+
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = int(capacity)
+        self._buf = np.zeros(2 * self.capacity, dtype=dtype)
+        self._end = 0
+        self._size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._buf.dtype)
+        n = values.size
+        cap = self.capacity
+        if n >= cap:
+            values = values[-cap:]
+            n = cap
+        if n == 0:
+            return
+        # write positions in [0, cap), then mirror them in [cap, 2 cap)
+        pos = (self._end + np.arange(n)) % cap
+        self._buf[pos] = values
+        self._buf[pos + cap] = values
+        self._end = (self._end + n) % cap
+        self._size = min(self._size + n, cap)
+
+    def view(self):
+        """ read-only view of the values, oldest first """
+        stop = self._end + self.capacity
+        view = self._buf[stop - self._size:stop]
+        view.flags.writeable = False
+        return view
+
+    def last(self, default=None):
+        return self._buf[self._end + self.capacity - 1] if self._size else default
+
+    def clear(self):
+        self._end = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+
+class StreamingFilter:
+    """ lfilter(b, a) over a stream of batches, starting from rest """
+
+    def __init__(self, b, a):
+        self.b = np.asarray(b, dtype=float)
+        self.a = np.asarray(a, dtype=float)
+        self.reset()
+
+    def reset(self):
+        self._zi = np.zeros(max(len(self.a), len(self.b)) - 1)
+
+    def process(self, batch):
+        y, self._zi = signal.lfilter(self.b, self.a, batch, zi=self._zi)
+        return y
+
+
+class WelchAccumulator:
+    """
+    Welch PSD (Hann window, constant detrend, density scaling, as
+    scipy.signal.welch) of the last `n_segments` complete segments.
+
+    Parameters
+    ----------
+    nperseg : int
+        samples per segment
+    fs : float
+        sampling frequency
+    noverlap : int, optional
+        samples shared by consecutive segments, nperseg // 2 by default
+    n_segments : int
+        segments averaged
+    """
+
+    def __init__(self, nperseg=256, fs=1.0, noverlap=None, n_segments=8,
+                 window='hann'):
+        self.nperseg = int(nperseg)
+        self.step = self.nperseg - (self.nperseg // 2 if noverlap is None
+                                    else int(noverlap))
+        self.n_segments = int(n_segments)
+        self.window = signal.get_window(window, self.nperseg)
+        self.scale = 1.0 / (fs * (self.window ** 2).sum())
+        self.freqs = np.fft.rfftfreq(self.nperseg, 1.0 / fs)
+        self._periodograms = np.zeros((self.n_segments, self.freqs.size))
+        self.reset()
+
+    def reset(self):
+        # samples after the start of the next segment
+        self._tail = np.empty(0)
+        self._count = 0
+
+    def update(self, batch):
+        """ add samples, returns the number of new segments """
+        buf = np.concatenate((self._tail, np.asarray(batch, dtype=float)))
+        if buf.size < self.nperseg:
+            self._tail = buf
+            return 0
+        segments = sliding_window_view(buf, self.nperseg)[::self.step]
+        self._tail = buf[segments.shape[0] * self.step:]
+        # only the last n_segments are averaged
+        segments = segments[-self.n_segments:]
+        segments = segments - segments.mean(axis=1, keepdims=True)
+        spec = np.abs(np.fft.rfft(segments * self.window, axis=1)) ** 2
+        spec *= self.scale
+        # one-sided, DC and Nyquist are not doubled
+        spec[:, 1:None if self.nperseg % 2 else -1] *= 2
+        rows = (self._count + np.arange(spec.shape[0])) % self.n_segments
+        self._periodograms[rows] = spec
+        self._count += spec.shape[0]
+        return spec.shape[0]
+
+    def psd(self):
+        """ (freqs, psd), None before the first complete segment """
+        if self._count == 0:
+            return None
+        n = min(self._count, self.n_segments)
+        return self.freqs, self._periodograms[:n].mean(axis=0)
@@ -0,0 +1,229 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Server-side rendering of the reconstructed images to PNG (or WebP) tiles.
+
+Every image is rasterized once, on the image pump thread, to an 8-bit
+colormapped image and kept in an LRU cache keyed by the frame number of
+the ImageHub and the version of the colour range. The dashboard serves
+the cached bytes (/tiles/<frame>.png, see dash_control.py), so any number
+of viewers get the same bytes and exporting a frame is one GET.
+
+- mesh images (JAC, BP): MeshRaster maps every pixel to its triangle once
+  per mesh, a frame is then one lookup of the per-triangle colour levels;
+- grid images (GREIT): one colour level per grid cell, scaled up.
+
+Levels 0..254 index the colormap, 255 is transparent (outside the mesh,
+NaN of the GREIT grid).
+"""
+
+import collections
+import io
+import threading
+
+import matplotlib
+import numpy as np
+from matplotlib.tri import Triangulation
+from PIL import Image, features
+
+FORMATS = ('png', 'webp')
+MIME_TYPES = {'png': 'image/png', 'webp': 'image/webp'}
+
+N_LEVELS = 255
+TRANSPARENT = 255
+
+# as the plotly figures: plasma for the mesh, jet for the GREIT heatmap
+MESH_COLORMAP = 'plasma'
+GRID_COLORMAP = 'jet'
+
+
+def palette(name):
+    """ flat RGB palette of the N_LEVELS colours of a matplotlib colormap """
+    colours = matplotlib.colormaps[name].resampled(N_LEVELS)(
+        np.arange(N_LEVELS))[:, :3]
+    rgb = np.round(colours * 255).astype(np.uint8)
+    # the transparent entry
+    return rgb.ravel().tolist() + [0, 0, 0]
+
+
+def levels(values, vmin, vmax):
+    """ colour levels of `values` scaled from [vmin, vmax], NaN transparent """
+    values = np.asarray(values, dtype=float)
+    t = (values - vmin) / float(vmax - vmin)
+    out = np.clip(np.floor(t * N_LEVELS), 0, N_LEVELS - 1)
+    out[np.isnan(values)] = TRANSPARENT
+    return out.astype(np.uint8)
+
+
+class MeshRaster:
+    """
+    Pixel to triangle lookup table of a mesh.
+
+    Parameters
+    ----------
+    x, y : ndarray
+        node coordinates
+    tri : ndarray
+        (n_tri, 3) node indices of the triangles
+    size : int
+        width and height of the tiles, in pixels
+    """
+
+    def __init__(self, x, y, tri, size=256):
+        self.tri = np.asarray(tri)
+        self.n_nodes = len(x)
+        self.size = size
+        lo = min(np.min(x), np.min(y))
+        hi = max(np.max(x), np.max(y))
+        centres = lo + (np.arange(size) + 0.5) * (hi - lo) / size
+        # row 0 at the top, as the image is drawn
+        px, py = np.meshgrid(centres, centres[::-1])
+        finder = Triangulation(x, y, self.tri).get_trifinder()
+        # -1 outside the mesh, which selects the transparent level
+        # appended in render
+        self.lut = np.asarray(finder(px, py), dtype=np.intp)
+
+    def render(self, img, vmin, vmax):
+        """ (size, size) colour levels of the node values `img` """
+        face = np.asarray(img, dtype=float)[self.tri].mean(axis=1)
+        table = np.append(levels(np.nan_to_num(face), vmin, vmax),
+                          np.uint8(TRANSPARENT))
+        return table[self.lut]
+
+
+def encode(pixels, rgb_palette, fmt='png', compress_level=6):
+    """ PNG or WebP bytes of 2-D colour levels """
+    image = Image.fromarray(pixels)
+    image.putpalette(rgb_palette)
+    buf = io.BytesIO()
+    if fmt == 'png':
+        image.save(buf, 'PNG', transparency=TRANSPARENT,
+                   compress_level=compress_level)
+    else:
+        # no palette in WebP
+        image.convert('RGBA').save(buf, 'WEBP', lossless=True)
+    return buf.getvalue()
+
+
+class TileRenderer:
+    """
+    Renders the images published by an ImageHub (add it with
+    ImageHub.add_listener) and caches the bytes.
+
+    Parameters
+    ----------
+    fmt : str
+        'png' or 'webp'
+    size : int
+        width and height of the tiles, in pixels
+    capacity : int
+        tiles kept in the cache
+    compress_level : int
+        zlib level of the PNG tiles, 1 encodes about 3x faster than 6
+        for 25% more bytes
+    """
+
+    def __init__(self, fmt='png', size=256, capacity=64, compress_level=6):
+        if fmt not in FORMATS:
+            raise ValueError('unknown format %r, expected one of %s' % (
+                fmt, ', '.join(FORMATS)))
+        if fmt == 'webp' and not features.check('webp'):
+            raise RuntimeError('Pillow was built without WebP support')
+        self.fmt = fmt
+        self.mimetype = MIME_TYPES[fmt]
+        self.size = size
+        self.capacity = capacity
+        self.compress_level = compress_level
+        self.renders = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        self._raster = None
+        self._range = (0., 1000.)
+        self._version = 0
+        self._last = (0, None)
+        self._mesh_palette = palette(MESH_COLORMAP)
+        self._grid_palette = palette(GRID_COLORMAP)
+
+    def set_mesh(self, x, y, tri):
+        """ geometry of the mesh images, None for grid images only """
+        raster = None if x is None else MeshRaster(x, y, tri, self.size)
+        with self._lock:
+            self._raster = raster
+            self._cache.clear()
+
+    def set_range(self, vmin, vmax):
+        """ colour range of the tiles, a new range is a new version """
+        vmin, vmax = float(vmin), float(vmax)
+        with self._lock:
+            if (vmin, vmax) != self._range:
+                self._range = (vmin, vmax)
+                self._version += 1
+
+    @property
+    def latest_seq(self):
+        return self._last[0]
+
+    def url(self):
+        """ URL of the tile of the latest image, None before the first one """
+        with self._lock:
+            seq, version = self._last[0], self._version
+        if seq == 0:
+            return None
+        return '/tiles/%d.%s?v=%d' % (seq, self.fmt, version)
+
+    def _render(self, image, vmin, vmax):
+        image = np.asarray(image, dtype=float)
+        raster = self._raster
+        if image.ndim == 2:
+            # row 0 of the heatmap is drawn at the bottom
+            pixels = levels(np.flipud(image), vmin, vmax)
+            tile = Image.fromarray(pixels).resize((self.size, self.size),
+                                                  Image.NEAREST)
+            return encode(np.asarray(tile), self._grid_palette, self.fmt,
+                          self.compress_level)
+        if raster is None or raster.n_nodes != image.size:
+            return None
+        return encode(raster.render(image, vmin, vmax), self._mesh_palette,
+                      self.fmt, self.compress_level)
+
+    def on_image(self, seq, image):
+        """ ImageHub listener, render the new image into the cache """
+        with self._lock:
+            self._last = (seq, image)
+        self.get(seq)
+
+    def get(self, seq):
+        """
+        Bytes of the tile of frame `seq` in the current range. Only the
+        latest image can be rendered again, None if `seq` was evicted.
+        """
+        with self._lock:
+            key = (seq, self._version)
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return data
+            last_seq, image = self._last
+            vmin, vmax = self._range
+        if seq != last_seq or image is None or not vmax > vmin:
+            return None
+        data = self._render(image, vmin, vmax)
+        if data is None:
+            return None
+        with self._lock:
+            self.renders += 1
+            self._cache[key] = data
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return data
+
+    def stats(self):
+        with self._lock:
+            return {'format': self.fmt, 'cached': len(self._cache),
+                    'renders': self.renders, 'hits': self.hits,
+                    'latest': self._last[0], 'version': self._version}
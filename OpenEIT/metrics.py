@@ -0,0 +1,294 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Instrumentation of the acquisition-to-display pipeline.
+
+A minimal metrics registry (counters, gauges and histograms with labels)
+without external dependencies. Updating a metric costs a lock and an
+addition, so it can sit on the serial reader and reconstruction hot
+paths. The registry is rendered as JSON or in the Prometheus text format,
+the dashboard serves both (see dash_control.py):
+
+    /metrics       Prometheus text
+    /metrics.json  JSON
+
+The metrics of the pipeline are defined at the bottom of this module and
+updated where the work happens.
+"""
+
+import bisect
+import functools
+import math
+import threading
+import time
+
+# seconds, from a GEMV to a slow Dash callback
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class _Metric:
+    """ common part of all metrics: name, help and labelled children """
+
+    type_name = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """ the child metric of one combination of label values """
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError('%s expects labels %s' % (self.name,
+                                                       self.labelnames))
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self):
+        """ (labels dict, child) of every child """
+        with self._lock:
+            items = sorted(self._children.items(), key=lambda item: item[0])
+        return [(dict(zip(self.labelnames, values)), child)
+                for values, child in items]
+
+
+class _Value:
+    """ a number, or a function returning it (read on collection) """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.
+        self._func = None
+
+    def inc(self, amount=1.):
+        with self._lock:
+            self._value += amount
+
+    def set(self, value):
+        self._value = float(value)
+
+    def set_function(self, func):
+        self._func = func
+
+    def get(self):
+        if self._func is not None:
+            try:
+                return float(self._func())
+            except Exception:  # a gauge must never break the endpoint
+                return math.nan
+        return self._value
+
+
+class Counter(_Metric):
+    """ monotonically increasing count (inc, or set_function) """
+
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(_Metric):
+    """ current value (set, inc, or set_function) """
+
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+
+class _Buckets:
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        """ [(upper bound, cumulative count)], the last bound is +Inf """
+        with self._lock:
+            counts = list(self.counts)
+        res = []
+        total = 0
+        for bound, n in zip(self._bounds + (math.inf,), counts):
+            total += n
+            res.append((bound, total))
+        return res
+
+
+class Histogram(_Metric):
+    """ distribution of observed values in fixed buckets """
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                                          .replace('"', '\\"'))
+                             for k, v in items)
+
+
+def _format_bound(bound):
+    return '+Inf' if math.isinf(bound) else repr(float(bound))
+
+
+class Registry:
+    """ the set of metrics that are exported together """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError('%s is already a %s' % (name,
+                                                         metric.type_name))
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(),
+                  buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames,
+                              buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def to_dict(self):
+        """ JSON-serializable snapshot of all metrics """
+        res = {}
+        for metric in self.metrics():
+            values = []
+            for labels, child in metric.samples():
+                if isinstance(child, _Buckets):
+                    buckets = child.cumulative()
+                    values.append({
+                        'labels': labels,
+                        'count': child.count,
+                        'sum': child.sum,
+                        'buckets': {_format_bound(b): n for b, n in buckets},
+                    })
+                else:
+                    value = child.get()
+                    values.append({'labels': labels,
+                                   'value': None if math.isnan(value) else value})
+            res[metric.name] = {'type': metric.type_name, 'help': metric.help,
+                                'values': values}
+        return res
+
+    def to_prometheus(self):
+        """ all metrics in the Prometheus text exposition format """
+        lines = []
+        for metric in self.metrics():
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+            for labels, child in metric.samples():
+                if isinstance(child, _Buckets):
+                    for bound, n in child.cumulative():
+                        lines.append('%s_bucket%s %d' % (
+                            metric.name,
+                            _format_labels(labels, {'le': _format_bound(bound)}),
+                            n))
+                    lines.append('%s_sum%s %r' % (metric.name,
+                                                  _format_labels(labels),
+                                                  child.sum))
+                    lines.append('%s_count%s %d' % (metric.name,
+                                                    _format_labels(labels),
+                                                    child.count))
+                else:
+                    lines.append('%s%s %r' % (metric.name,
+                                              _format_labels(labels),
+                                              child.get()))
+        return '\n'.join(lines) + '\n'
+
+
+def timed(histogram):
+    """
+    Decorator observing the run time of the function in `histogram`,
+    a child returned by Histogram.labels().
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+REGISTRY = Registry()
+
+# acquisition
+SERIAL_BYTES = REGISTRY.counter(
+    'openeit_serial_bytes_total', 'bytes received from the device',
+    ('framing',))
+LINES = REGISTRY.counter(
+    'openeit_lines_total', 'lines of the ASCII protocol by parse result',
+    ('result',))
+BINARY_FRAMES = REGISTRY.counter(
+    'openeit_binary_frames_total', 'binary frames by decode result',
+    ('result',))
+
+# queues, set up by the Controller
+QUEUE_DEPTH = REGISTRY.gauge(
+    'openeit_queue_depth', 'frames or images waiting in a queue', ('queue',))
+DROPPED_FRAMES = REGISTRY.counter(
+    'openeit_dropped_frames_total',
+    'frames lost because a consumer or the producer fell behind',
+    ('consumer',))
+
+# reconstruction and display
+RECONSTRUCTION_SECONDS = REGISTRY.histogram(
+    'openeit_reconstruction_seconds', 'reconstruction time of one frame',
+    ('algorithm',))
+CALLBACK_SECONDS = REGISTRY.histogram(
+    'openeit_callback_seconds', 'run time of the periodic dashboard callbacks',
+    ('mode',))
@@ -15,6 +15,9 @@ Reconstruction of image data from raw data.
 # TODO: define an abstract interface for reconstruction algorithms.
 
 from .worker import ReconstructionWorker
+from .process_worker import ProcessReconstructionWorker
+from .pool import ReconstructionPool
+from .stats import FrameStats
 
 # for testing and debugging purposes below. 
 from .greit import GreitReconstruction
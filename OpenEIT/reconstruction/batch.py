@@ -0,0 +1,55 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Batch reconstruction shared by the reconstruction wrappers.
+
+Every algorithm (jac.py, greit.py, bp.py) only implements the two
+stateless stages of its batch API:
+
+- solve_batch(frames, reference): the (n_frames, ...) solution of a
+  batch of frames,
+- interpolate_batch(ds): the (n_frames, n_pixels) images of a solution.
+
+reconstruct_batch chains them over chunks of frames.
+"""
+
+import abc
+
+import numpy as np
+
+
+class BatchReconstruction(abc.ABC):
+    """ base class of the reconstruction wrappers """
+
+    @abc.abstractmethod
+    def solve_batch(self, frames, reference):
+        """ the solution of (n_frames, n_meas) frames (stage 1) """
+
+    @abc.abstractmethod
+    def interpolate_batch(self, ds):
+        """ the (n_frames, n_pixels) images of a solution (stage 2) """
+
+    def reconstruct_batch(self, frames, reference, chunk_size=4096):
+        """
+        Reconstruct all `frames`, a (n_frames, n_meas) array, against the
+        reference frame `reference` with matrix-matrix products, at most
+        `chunk_size` frames at a time. Returns a (n_frames, n_pixels)
+        array of images.
+
+        Unlike eit_reconstruction, the state of the reconstruction
+        (reference frame, last image) is left untouched.
+        """
+        frames = np.atleast_2d(np.asarray(frames, dtype=float))
+        reference = np.asarray(reference, dtype=float)
+        imgs = None
+        # (one empty chunk without frames, for the image width)
+        for start in range(0, max(frames.shape[0], 1), chunk_size):
+            chunk = self.interpolate_batch(
+                self.solve_batch(frames[start:start + chunk_size], reference))
+            if imgs is None:
+                imgs = np.empty((frames.shape[0], chunk.shape[1]))
+            imgs[start:start + chunk_size] = chunk
+        return imgs
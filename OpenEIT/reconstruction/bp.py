@@ -19,18 +19,23 @@ from .pyeit import mesh
 from .pyeit.eit.utils import eit_scan_lines
 from .pyeit.eit.bp import BP as bp
 from .pyeit.eit.fem import Forward
+from .batch import BatchReconstruction
+from .cache import resolve_cache, mesh_arrays, mesh_from_arrays
 
 logger = logging.getLogger(__name__)
 
 
-class BpReconstruction:
+class BpReconstruction(BatchReconstruction):
 
     """
     Reconstruction of image data from an EIT measurement.
     Using old fashioned Back Projection. 
 
     """
-    def __init__(self,n_el):
+    def __init__(self,n_el,cache=True,seed=None):
+        # meshes and matrices are reused from the on-disk cache if possible
+        # (seed: the distmesh seed, a fixed seed always builds the same mesh)
+        self.cache = resolve_cache(cache)
         # setup EIT scan conditions
         self.img = []
         self.baseline_flag = 0
@@ -40,13 +45,44 @@ class BpReconstruction:
 
         # we create this according to an opposition protocol to maximize contrast. 
         self.ex_mat = eit_scan_lines(ne = self.n_el, dist = self.el_dist)
-        """ 0. construct mesh """
         # h0 is initial mesh size. , h0=0.1
-        self.mesh_obj, self.el_pos = mesh.create(self.n_el)
-        """ 3. Set Up BP """
-        self.eit =  bp(self.mesh_obj,self.el_pos, ex_mat=self.ex_mat, step=self.step, parser='std')
-
-        self.eit.setup(weight='none')
+        h0 = 0.1
+        setup_params = dict(weight='none')
+
+        state = None
+        if self.cache is not None:
+            key = self.cache.key('bp', n_el=self.n_el, h0=h0, seed=seed, ex_mat=self.ex_mat,
+                                 step=self.step, parser='std', perm=None, **setup_params)
+            state = self.cache.load(key)
+
+        if state is not None:
+            """ restore mesh and BP from the cache """
+            self.mesh_obj, self.el_pos = mesh_from_arrays(state)
+            self.eit = bp(self.mesh_obj,self.el_pos, ex_mat=self.ex_mat, step=self.step, parser='std', state=state)
+        else:
+            """ 0. construct mesh """
+            self.mesh_obj, self.el_pos = mesh.create(self.n_el, h0=h0, seed=seed)
+            """ 3. Set Up BP """
+            self.eit =  bp(self.mesh_obj,self.el_pos, ex_mat=self.ex_mat, step=self.step, parser='std')
+
+            self.eit.setup(**setup_params)
+            if self.cache is not None:
+                self.cache.save(key, dict(mesh_arrays(self.mesh_obj, self.el_pos), **self.eit.state()))
+
+        # measurements are real and so is v0 (real perm), the batch back
+        # projection does not need complex or boolean products
+        self.H_real = np.asarray(self.eit.H, dtype=float)
+        self.sign_v0 = np.sign(np.real(self.eit.v0))
+
+    def solve_batch(self, frames, reference):
+        """ back projection of a batch of frames (stage 1) """
+        # same as self.eit.solve(frames, reference, normalize=True)
+        vn = -(frames - reference) / self.sign_v0
+        return np.dot(vn, self.H_real)
+
+    def interpolate_batch(self, ds):
+        """ the back projection is already on the nodes (stage 2) """
+        return np.real(ds)
 
     def update_reference(self,data):
         self.baseline_flag = 1
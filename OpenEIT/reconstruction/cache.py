@@ -0,0 +1,208 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Persistent on-disk cache of meshes and reconstruction matrices.
+
+Building a reconstruction (distmesh, the FEM sweep and the inversion of
+the H-matrix) dominates the start-up time and every switch of the
+algorithm or of the number of electrodes. The results only depend on a
+handful of parameters, so they are stored on disk under a key hashed
+from those parameters. Every array is saved as its own ``.npy`` file and
+memory-mapped when loaded, so a warm start only reads what is used.
+
+The total size of the cache is bounded, the least recently used entries
+are evicted first.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# bump when the content of the cached arrays changes for the same key
+CACHE_VERSION = 2
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+_ATIME_FILE = '.last_used'
+
+
+def _default_cache_dir():
+    cache_dir = os.environ.get('OPENEIT_CACHE_DIR')
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'openeit')
+    return cache_dir
+
+
+class MatrixCache:
+    """
+    Content-addressed store of named arrays.
+
+    An entry is a directory named by its key, holding one ``.npy`` file
+    per array. Entries are written to a temporary directory first and
+    renamed, so a crashed write never leaves a half entry behind.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        if cache_dir is None:
+            cache_dir = _default_cache_dir()
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(kind, **params):
+        """
+        Hash the parameters that fully determine a cache entry.
+
+        Arrays contribute their dtype, shape and raw bytes, everything
+        else its ``repr``, so the key is stable across runs.
+        """
+        h = hashlib.sha1()
+        h.update(('%s:%d' % (kind, CACHE_VERSION)).encode())
+        for name in sorted(params):
+            value = params[name]
+            h.update(name.encode())
+            if isinstance(value, np.ndarray):
+                value = np.ascontiguousarray(value)
+                h.update(str(value.dtype).encode())
+                h.update(str(value.shape).encode())
+                h.update(value.tobytes())
+            else:
+                h.update(repr(value).encode())
+        return '%s-%s' % (kind, h.hexdigest())
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """
+        Return the arrays stored under `key` (memory-mapped, read-only)
+        or None if there is no such entry.
+        """
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return None
+        try:
+            arrays = {}
+            for fname in os.listdir(entry_dir):
+                if fname.endswith('.npy'):
+                    arrays[fname[:-4]] = np.load(os.path.join(entry_dir, fname),
+                                                 mmap_mode='r')
+            # mark as recently used for the LRU eviction
+            with open(os.path.join(entry_dir, _ATIME_FILE), 'w') as f:
+                f.write(str(time.time()))
+        except (OSError, ValueError) as err:
+            logger.warning('dropping unreadable cache entry %s: %s', key, err)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        logger.info('cache hit: %s', key)
+        return arrays
+
+    def save(self, key, arrays):
+        """ store a dict of arrays under `key` and evict old entries """
+        entry_dir = self._entry_dir(key)
+        tmp_dir = '%s.tmp-%d-%d' % (entry_dir, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(tmp_dir)
+            for name, value in arrays.items():
+                np.save(os.path.join(tmp_dir, name + '.npy'), np.asarray(value))
+            with open(os.path.join(tmp_dir, _ATIME_FILE), 'w') as f:
+                f.write(str(time.time()))
+            with self._lock:
+                if os.path.isdir(entry_dir):
+                    # another writer was faster, entries are identical
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                else:
+                    os.rename(tmp_dir, entry_dir)
+        except OSError as err:
+            logger.warning('could not write cache entry %s: %s', key, err)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        logger.info('cache store: %s', key)
+        self.evict()
+
+    def entries(self):
+        """ list of (last_used, size_in_bytes, key), oldest first """
+        res = []
+        if not os.path.isdir(self.cache_dir):
+            return res
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            if '.tmp-' in key or not os.path.isdir(entry_dir):
+                continue
+            size = 0
+            for fname in os.listdir(entry_dir):
+                size += os.path.getsize(os.path.join(entry_dir, fname))
+            atime_file = os.path.join(entry_dir, _ATIME_FILE)
+            try:
+                last_used = os.path.getmtime(atime_file)
+            except OSError:
+                last_used = 0.
+            res.append((last_used, size, key))
+        return sorted(res)
+
+    def evict(self):
+        """ remove least recently used entries until under max_bytes """
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            while entries and total > self.max_bytes:
+                _, size, key = entries.pop(0)
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                total -= size
+                logger.info('cache evict: %s', key)
+
+    def clear(self):
+        """ remove all entries """
+        with self._lock:
+            for _, _, key in self.entries():
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+
+def mesh_arrays(mesh_obj, el_pos):
+    """ flatten a pyEIT mesh and its electrodes for storing """
+    return {'node': mesh_obj['node'],
+            'element': mesh_obj['element'],
+            'perm': mesh_obj['perm'],
+            'el_pos': el_pos}
+
+
+def mesh_from_arrays(arrays):
+    """ inverse of mesh_arrays """
+    mesh_obj = {'node': arrays['node'],
+                'element': arrays['element'],
+                'perm': arrays['perm']}
+    return mesh_obj, arrays['el_pos']
+
+
+_default_cache = None
+
+
+def default_cache():
+    """ the cache shared by all reconstructions of this process """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = MatrixCache()
+    return _default_cache
+
+
+def resolve_cache(cache):
+    """ map the `cache` argument of the reconstructions to a MatrixCache """
+    if cache is True:
+        if os.environ.get('OPENEIT_CACHE', '1') == '0':
+            return None
+        return default_cache()
+    if cache is False:
+        return None
+    return cache
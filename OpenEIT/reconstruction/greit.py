@@ -19,18 +19,23 @@ from .pyeit import mesh
 from .pyeit.eit.utils import eit_scan_lines
 from .pyeit.eit.greit import GREIT as greit
 from .pyeit.eit.fem import Forward
+from .batch import BatchReconstruction
+from .cache import resolve_cache, mesh_arrays, mesh_from_arrays
 
 logger = logging.getLogger(__name__)
 
 
-class GreitReconstruction:
+class GreitReconstruction(BatchReconstruction):
     """
 
     Reconstruction of image data from an EIT measurement.
     Configurable wrapper to pyEIT 
 
     """
-    def __init__(self,n_el):
+    def __init__(self,n_el,cache=True,seed=None):
+        # meshes and matrices are reused from the on-disk cache if possible
+        # (seed: the distmesh seed, a fixed seed always builds the same mesh)
+        self.cache = resolve_cache(cache)
         # setup EIT scan conditions
         self.img = []
         self.baseline_flag = 1
@@ -39,18 +44,47 @@ class GreitReconstruction:
         self.step = 1
         # we create this according to an opposition protocol to maximize contrast. 
         self.ex_mat = eit_scan_lines(ne = self.n_el, dist = self.el_dist)
-        """ 0. construct mesh """
         # h0 is initial mesh size. , h0=0.1
-        self.mesh_obj, self.el_pos = mesh.create(self.n_el)
-        """ 3. Set Up GREIT """
-        self.eit = greit(self.mesh_obj, self.el_pos, ex_mat=self.ex_mat, step=self.step, parser='std')
-        #self.eit.setup(p=0.50, lamb=0.5,n=self.n_el)
-        self.eit.setup(p=0.50, lamb=0.05,n=self.n_el)
+        h0 = 0.1
+        #setup_params = dict(p=0.50, lamb=0.5, n=self.n_el)
+        setup_params = dict(p=0.50, lamb=0.05, n=self.n_el)
+
+        state = None
+        if self.cache is not None:
+            key = self.cache.key('greit', n_el=self.n_el, h0=h0, seed=seed, ex_mat=self.ex_mat,
+                                 step=self.step, parser='std', perm=None, **setup_params)
+            state = self.cache.load(key)
+
+        if state is not None:
+            """ restore mesh and GREIT from the cache """
+            self.mesh_obj, self.el_pos = mesh_from_arrays(state)
+            self.eit = greit(self.mesh_obj, self.el_pos, ex_mat=self.ex_mat, step=self.step, parser='std', state=state)
+        else:
+            """ 0. construct mesh """
+            self.mesh_obj, self.el_pos = mesh.create(self.n_el, h0=h0, seed=seed)
+            """ 3. Set Up GREIT """
+            self.eit = greit(self.mesh_obj, self.el_pos, ex_mat=self.ex_mat, step=self.step, parser='std')
+            self.eit.setup(**setup_params)
+            if self.cache is not None:
+                self.cache.save(key, dict(mesh_arrays(self.mesh_obj, self.el_pos), **self.eit.state()))
         logger.info("GREIT mesh set up ")
+        # measurements are real, so real(H dv) = real(H) dv (see solve_batch)
+        self.H_real = np.ascontiguousarray(np.real(self.eit.H))
         self.gx = None
         self.gy = None
         self.ds = None
 
+    def solve_batch(self, frames, reference):
+        """ images on the GREIT grid of a batch of frames (stage 1) """
+        # same as the real part of self.eit.solve, without complex products
+        return -np.dot(frames - reference, self.H_real.T)
+
+    def interpolate_batch(self, ds):
+        """ real part, pixels outside the mesh are NaN (stage 2) """
+        ds = np.real(ds)
+        ds[:, self.eit.mask] = np.NAN
+        return ds
+
     def update_reference(self,data):
         # print (data)
         self.baseline_flag = 1
@@ -18,19 +18,28 @@ from .pyeit import mesh
 from .pyeit.eit.utils import eit_scan_lines
 from .pyeit.eit.jac import JAC as jacobian
 from .pyeit.eit.fem import Forward
-from .pyeit.eit.interp2d import sim2pts
+from .pyeit.eit.interp2d import sim2pts_operator
+from .batch import BatchReconstruction
+from .cache import resolve_cache, mesh_arrays, mesh_from_arrays
 
 logger = logging.getLogger(__name__)
 
 
-class JacReconstruction:
+class JacReconstruction(BatchReconstruction):
     """
 
     Reconstruction of image data from an EIT measurement.
     Configurable wrapper to pyEIT 
 
     """
-    def __init__(self,n_el):
+    def __init__(self,n_el,cache=True,fused=True,seed=None):
+        # meshes and matrices are reused from the on-disk cache if possible
+        # (seed: the distmesh seed, a fixed seed always builds the same mesh)
+        self.cache = resolve_cache(cache)
+        # fused: images on nodes directly with JAC.solve_pts (one GEMV),
+        # otherwise JAC.solve on elements followed by sim2pts
+        self.fused = fused
+        self.seed = seed
         # setup EIT scan conditions
         self.img = []
         self.baseline_flag = None
@@ -70,21 +79,51 @@ class JacReconstruction:
         # we create this according to an opposition protocol to maximize contrast. 
         self.ex_mat = eit_scan_lines(ne = self.n_el, dist = self.el_dist)
 
-        """ 0. construct mesh """
         # h0 is initial mesh size. , h0=0.1
-        self.mesh_obj, self.el_pos = mesh.create(n_el)
-
-        """ 3. Set Up JAC """
-        self.eit = jacobian(self.mesh_obj, self.el_pos, ex_mat=self.ex_mat, step=self.step,perm=1.)
-
+        h0 = 0.1
         # parameter tuning is needed for better EIT images
-        self.eit.setup(p=0.5, lamb=0.4, method='kotre')
+        setup_params = dict(p=0.5, lamb=0.4, method='kotre', fused=self.fused)
+
+        state = None
+        if self.cache is not None:
+            key = self.cache.key('jac', n_el=self.n_el, h0=h0, seed=self.seed, ex_mat=self.ex_mat,
+                                 step=self.step, parser='std', perm=1., **setup_params)
+            state = self.cache.load(key)
+
+        if state is not None:
+            """ restore mesh and JAC from the cache """
+            self.mesh_obj, self.el_pos = mesh_from_arrays(state)
+            self.eit = jacobian(self.mesh_obj, self.el_pos, ex_mat=self.ex_mat, step=self.step,perm=1., state=state)
+        else:
+            """ 0. construct mesh """
+            self.mesh_obj, self.el_pos = mesh.create(n_el, h0=h0, seed=self.seed)
+
+            """ 3. Set Up JAC """
+            self.eit = jacobian(self.mesh_obj, self.el_pos, ex_mat=self.ex_mat, step=self.step,perm=1.)
+            self.eit.setup(**setup_params)
+            if self.cache is not None:
+                self.cache.save(key, dict(mesh_arrays(self.mesh_obj, self.el_pos), **self.eit.state()))
         logger.info("JAC mesh set up ")
         self.ds  = None
         self.pts = self.mesh_obj['node']
         self.tri = self.mesh_obj['element']
+        # element to node interpolation, fixed for the mesh
+        self.sim2pts = sim2pts_operator(self.pts, self.tri)
         print ('completed jac reset')
 
+    def solve_batch(self, frames, reference):
+        """ changes of conductivities of a batch of frames (stage 1) """
+        if self.fused:
+            return self.eit.solve_pts(frames, reference, normalize=False)
+        return self.eit.solve(frames, reference, normalize=False)
+
+    def interpolate_batch(self, ds):
+        """ images on the nodes of the mesh (stage 2) """
+        if not self.fused:
+            # (S ds^T)^T for the (n_frames, n_tri) batch
+            ds = self.sim2pts.dot(ds.T).T
+        return np.real(ds)
+
     def update_reference(self,data):
         self.baseline_flag = 1
 
@@ -106,8 +145,11 @@ class JacReconstruction:
                     self.f0 = data
       
                 # if the jacobian is not normalized, data may not to be normalized also.
-                self.ds = self.eit.solve(f1, self.f0, normalize=False)
-                ds_jac  = sim2pts(self.pts, self.tri, self.ds)
+                if self.fused:
+                    ds_jac = self.eit.solve_pts(f1, self.f0, normalize=False)
+                else:
+                    self.ds = self.eit.solve(f1, self.f0, normalize=False)
+                    ds_jac  = self.sim2pts.dot(self.ds)
                 self.img = np.real(ds_jac)
 
         except RuntimeError as err:
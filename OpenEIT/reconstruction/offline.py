@@ -0,0 +1,185 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Streaming offline reconstruction of recorded sessions.
+
+The capture file (as recorded by the dashboard or written by simdata.py)
+is read in chunks of lines. Every chunk is decoded at once (parse_frames
+of the serial handler), reconstructed with the batch API of the
+reconstruction wrappers and appended to an ``.npy`` file of shape
+(n_frames, n_pixels). Memory use only depends on the chunk size, not on
+the length of the recording.
+
+usage: python -m OpenEIT.reconstruction.offline rawdata.txt -o images.npy
+           [--algorithm jac|greit|bp] [--n-el 32] [--mode d]
+           [--chunk 1024] [--reference 0]
+
+The output can be opened without loading it with
+``np.load('images.npy', mmap_mode='r')``.
+"""
+
+import argparse
+import logging
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from .bp import BpReconstruction
+from .jac import JacReconstruction
+from .greit import GreitReconstruction
+from ..backend.serialhandler import infer_n_el, iter_chunks
+
+logger = logging.getLogger(__name__)
+
+ALGORITHMS = {
+    'jac': JacReconstruction,
+    'greit': GreitReconstruction,
+    'bp': BpReconstruction,
+}
+
+# the .npy header is written with a fixed size, so that the final
+# number of frames can be patched in place once the stream is done
+NPY_HEADER_SIZE = 128
+
+
+def _npy_header(shape, dtype):
+    """ a .npy (version 1.0) header padded to NPY_HEADER_SIZE bytes """
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': %r, }" % (
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), tuple(shape))
+    n_pad = NPY_HEADER_SIZE - 10 - len(header) - 1
+    if n_pad < 0:
+        raise ValueError('shape %r does not fit the header' % (shape,))
+    return (np.lib.format.magic(1, 0) +
+            struct.pack('<H', NPY_HEADER_SIZE - 10) +
+            (header + ' ' * n_pad + '\n').encode('latin1'))
+
+
+class NpyStreamWriter:
+    """
+    Append rows to an .npy file, the header is rewritten on close with
+    the number of rows that were written.
+    """
+
+    def __init__(self, path, n_cols, dtype=np.float64):
+        self.path = path
+        self.n_cols = n_cols
+        self.dtype = np.dtype(dtype)
+        self.n_rows = 0
+        self._file = open(path, 'wb')
+        self._file.write(_npy_header((0, n_cols), self.dtype))
+
+    def write(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        self._file.write(rows.tobytes())
+        self.n_rows += rows.shape[0]
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.seek(0)
+        self._file.write(_npy_header((self.n_rows, self.n_cols), self.dtype))
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def reconstruct_file(path, out_path, algorithm='jac', n_el=None, mode='d',
+                     chunk_size=1024, reference=0, cache=True):
+    """
+    Reconstruct all frames of the capture file `path` into the .npy file
+    `out_path`, one row per frame. The reference frame is the frame at
+    index `reference`. Returns the number of frames and the elapsed time.
+    """
+    if reference < 0:
+        raise ValueError('the reference index must be >= 0, got %d'
+                         % reference)
+    start = time.time()
+    chunks = iter_chunks(path, mode=mode, chunk_size=chunk_size)
+    n_frames = 0
+    writer = None
+    ref = None
+    recon = None
+    pending = []
+    try:
+        for chunk in chunks:
+            # same preprocessing as the ReconstructionWorker
+            chunk = np.where(chunk == 0, 1.0, chunk)
+            if ref is None:
+                # frames before the reference are kept until it is known
+                pending.append(chunk)
+                seen = sum(c.shape[0] for c in pending)
+                if seen <= reference:
+                    continue
+                chunk = np.concatenate(pending)
+                pending = []
+                ref = chunk[reference].copy()
+                if n_el is None:
+                    n_el = infer_n_el(ref.size)
+                recon = ALGORITHMS[algorithm](n_el, cache=cache)
+
+            imgs = recon.reconstruct_batch(chunk, ref, chunk_size=chunk_size)
+            if writer is None:
+                writer = NpyStreamWriter(out_path, imgs.shape[1])
+            writer.write(imgs)
+            n_frames += imgs.shape[0]
+            logger.info('%d frames', n_frames)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        raise ValueError('no frame at index %d in %s' % (reference, path))
+    return n_frames, time.time() - start
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        description='reconstruct a recorded EIT session to an .npy file')
+    ap.add_argument('input', help='capture file (text, one frame per line)')
+    ap.add_argument('-o', '--output', default=None,
+                    help='output .npy file, default: <input>.npy')
+    ap.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='jac')
+    ap.add_argument('--n-el', type=int, default=None,
+                    help='number of electrodes, inferred if not given')
+    ap.add_argument('--mode', default='d',
+                    help="line format, as serialhandler ('a', 'b' or 'd')")
+    ap.add_argument('--chunk', type=int, default=1024,
+                    help='frames per batch')
+    ap.add_argument('--reference', type=int, default=0,
+                    help='index of the reference frame')
+    ap.add_argument('--no-cache', action='store_true',
+                    help='do not use the on-disk matrix cache')
+    args = ap.parse_args(argv)
+    if args.reference < 0:
+        ap.error('--reference must be >= 0')
+
+    out_path = args.output
+    if out_path is None:
+        out_path = os.path.splitext(args.input)[0] + '.npy'
+
+    try:
+        n_frames, elapsed = reconstruct_file(
+            args.input, out_path, algorithm=args.algorithm, n_el=args.n_el,
+            mode=args.mode, chunk_size=args.chunk, reference=args.reference,
+            cache=not args.no_cache)
+    except ValueError as err:
+        # a --reference past the last frame, frames of no --n-el
+        ap.error(str(err))
+    print('%d frames in %.2f s (%.1f frames/s) -> %s' % (
+        n_frames, elapsed, n_frames / max(elapsed, 1e-9), out_path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Pipelined reconstruction of consecutive frames with a pool of workers.
+
+ReconstructionPool has the interface of ReconstructionWorker. Its thread
+only dequeues and preprocesses the frames, the reconstructions run on N
+workers at the same time and the images are put back in frame order
+before they reach the output queue.
+
+The workers use the stateless batch API of the reconstructions
+(solve_batch, interpolate_batch), so they can share one reconstruction
+object. With backend='thread' they run in threads, which is enough when
+the GEMVs release the GIL (multi-threaded BLAS off, large matrices).
+With backend='process' every worker process builds its own
+reconstruction (from the on-disk cache).
+
+With latest_only=True stale frames are skipped: only the newest queued
+frame is reconstructed, and images that are older than one already
+delivered, or still waiting in the output queue, are dropped.
+"""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+
+from .. import metrics
+from .process_worker import _make_reconstruction
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('dequeue', 'preprocess', 'solve', 'interpolate', 'enqueue')
+BACKENDS = ('thread', 'process')
+
+
+def _reconstruct(recon, algorithm, frame, reference):
+    """ image of one frame and the solve/interpolate times """
+    start = time.perf_counter()
+    ds = recon.solve_batch(frame[np.newaxis], reference)
+    mid = time.perf_counter()
+    img = recon.interpolate_batch(ds)[0]
+    if algorithm == 'greit':
+        # same layout as GreitReconstruction.eit_reconstruction
+        img = img.reshape(recon.eit.xg.shape)
+    return img, mid - start, time.perf_counter() - mid
+
+
+# reconstruction of a worker process, see _init_process
+_process_state = {}
+
+
+def _init_process(algorithm, n_el):
+    _process_state['recon'] = _make_reconstruction(algorithm, n_el)
+    _process_state['algorithm'] = algorithm
+
+
+def _process_task(frame, reference):
+    return _reconstruct(_process_state['recon'], _process_state['algorithm'],
+                        frame, reference)
+
+
+class StageTimer:
+    """ count, total and maximum duration of every pipeline stage """
+
+    def __init__(self, stages=STAGES):
+        self._lock = threading.Lock()
+        self._stages = stages
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._count = dict.fromkeys(self._stages, 0)
+            self._total = dict.fromkeys(self._stages, 0.)
+            self._max = dict.fromkeys(self._stages, 0.)
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._count[stage] += 1
+            self._total[stage] += seconds
+            if seconds > self._max[stage]:
+                self._max[stage] = seconds
+
+    def summary(self):
+        """ {stage: {'count', 'mean_ms', 'max_ms'}} """
+        with self._lock:
+            return {s: {'count': self._count[s],
+                        'mean_ms': 1e3 * self._total[s] / max(self._count[s], 1),
+                        'max_ms': 1e3 * self._max[s]}
+                    for s in self._stages}
+
+
+class ReconstructionPool(threading.Thread):
+    """
+    Drop-in replacement of ReconstructionWorker reconstructing up to
+    `n_workers` frames at the same time.
+
+    Parameters
+    ----------
+    n_workers : int
+        number of concurrent reconstructions
+    backend : str
+        'thread' or 'process'
+    latest_only : bool
+        skip stale frames and images instead of delivering all of them
+    max_pending : int, optional
+        frames submitted but not delivered yet, 2 * n_workers by default
+    """
+
+    def __init__(self, n_workers=2, backend='thread', latest_only=False,
+                 max_pending=None):
+        super().__init__(daemon=True)
+        if backend not in BACKENDS:
+            raise ValueError('unknown backend %r, expected one of %s' % (
+                backend, ', '.join(BACKENDS)))
+        self.n_workers = n_workers
+        self.backend = backend
+        self.latest_only = latest_only
+        self.timings = StageTimer()
+        self.skipped = 0
+        self._input_queue = None
+        self._output_queue = None
+        self._reconstruction = None
+        self._algorithm = None
+        self._executor = None
+        self._running = True
+        self._baseline = 1
+        self._reference = None
+        self._pending = threading.Semaphore(max_pending or 2 * n_workers)
+        self._lock = threading.Lock()
+        # generation of the configuration, bumped by reset, and the
+        # resequencing state: next frame number and finished images
+        self._generation = 0
+        self._next_seq = 0
+        self._delivered_seq = -1
+        self._done = {}
+        self._last_image = None
+
+    def reset(self, input_queue, output_queue, algorithm, n_el):
+        old_executor = self._executor
+        with self._lock:
+            self._generation += 1
+            self._input_queue = input_queue
+            self._output_queue = output_queue
+            self._algorithm = algorithm
+            self._running = True
+            self._baseline = 1
+            self._reference = None
+            self._next_seq = 0
+            self._delivered_seq = -1
+            self._done = {}
+            self._last_image = None
+        self._reconstruction = _make_reconstruction(algorithm, n_el)
+        if self.backend == 'process':
+            # spawn, forking the threads of the dashboard is not safe
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.n_workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_process, initargs=(algorithm, n_el))
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.n_workers, thread_name_prefix='reconstruction')
+        if old_executor is not None:
+            old_executor.shutdown(wait=False)
+        self.timings.reset()
+
+    def baseline(self):
+        self._baseline = 1
+
+    def reset_baseline(self):
+        self._baseline = 1
+
+    def get_plot_params(self):
+        mesh_obj = self._reconstruction.mesh_obj
+        pts = mesh_obj['node']
+        return pts[:, 0], pts[:, 1], mesh_obj['element'], self._reconstruction.el_pos
+
+    def get_greit_params(self):
+        eit = self._reconstruction.eit
+        return eit.xg, eit.yg, self._last_image
+
+    def get_radon_params(self):
+        return 0
+
+    def stop_reconstructing(self):
+        self._running = False
+
+    def start_reconstructing(self):
+        self._running = True
+
+    def _dequeue(self):
+        """ the next frame, or the newest one with latest_only """
+        start = time.perf_counter()
+        try:
+            data = self._input_queue.get(timeout=0.1)
+        except queue.Empty:
+            return None
+        if self.latest_only:
+            skipped = 0
+            while True:
+                try:
+                    data = self._input_queue.get_nowait()
+                except queue.Empty:
+                    break
+                skipped += 1
+            if skipped:
+                # also counted by the executor threads, see _finished
+                with self._lock:
+                    self.skipped += skipped
+        self.timings.add('dequeue', time.perf_counter() - start)
+        return data
+
+    def run(self):
+        while True:
+            if not self._running or self._input_queue is None:
+                time.sleep(0.01)
+                continue
+            data = self._dequeue()
+            if data is None:
+                continue
+
+            start = time.perf_counter()
+            data = np.asarray(data, dtype=float)
+            if len(data) <= 1:
+                print ('forcing stop reconstruct')
+                self._running = False
+                continue
+            data = np.where(data == 0, 1.0, data)
+            if self._baseline == 1 or self._reference is None or \
+                    self._reference.shape != data.shape:
+                self._reference = data
+                self._baseline = 0
+            self.timings.add('preprocess', time.perf_counter() - start)
+
+            self._pending.acquire()
+            with self._lock:
+                gen, seq = self._generation, self._next_seq
+                self._next_seq += 1
+                executor = self._executor
+            try:
+                if self.backend == 'process':
+                    future = executor.submit(_process_task, data,
+                                             self._reference)
+                else:
+                    future = executor.submit(_reconstruct, self._reconstruction,
+                                             self._algorithm, data,
+                                             self._reference)
+            except RuntimeError:
+                # the executor was shut down by a reset
+                self._pending.release()
+                continue
+            future.add_done_callback(
+                lambda f, gen=gen, seq=seq: self._finished(gen, seq, f))
+
+    def _finished(self, gen, seq, future):
+        """ resequence the images and deliver them in frame order """
+        self._pending.release()
+        try:
+            img, t_solve, t_interp = future.result()
+        except Exception as err:
+            logger.info('reconstruction error: %s', err)
+            img = None
+        else:
+            self.timings.add('solve', t_solve)
+            self.timings.add('interpolate', t_interp)
+            metrics.RECONSTRUCTION_SECONDS.labels(self._algorithm).observe(
+                t_solve + t_interp)
+
+        start = time.perf_counter()
+        with self._lock:
+            if gen != self._generation:
+                return
+            if self.latest_only:
+                if seq <= self._delivered_seq:
+                    # a newer image was delivered first
+                    self.skipped += 1
+                elif img is not None:
+                    self._delivered_seq = seq
+                    self._deliver_latest(img)
+            else:
+                self._done[seq] = img
+                while self._delivered_seq + 1 in self._done:
+                    self._delivered_seq += 1
+                    img = self._done.pop(self._delivered_seq)
+                    if img is not None:
+                        self._output_queue.put(img)
+                        self._last_image = img
+        self.timings.add('enqueue', time.perf_counter() - start)
+
+    def _deliver_latest(self, img):
+        """ replace the images the consumer did not take yet """
+        while True:
+            try:
+                self._output_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.skipped += 1
+        self._output_queue.put(img)
+        self._last_image = img
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,349 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Reconstruction in a separate process.
+
+ProcessReconstructionWorker has the interface of ReconstructionWorker but
+runs the reconstructions in a child process, so the GEMVs and the GREIT
+masking do not compete for the GIL with the Dash callbacks and the serial
+reader threads.
+
+Frames and images are not pickled. The parent copies every frame into a
+slot of a shared-memory block, the child writes the image into the slot
+of the same index in a second block and only sends small messages (slot
+index, image shape) through a pipe. A slot is reused once the parent has
+copied the image out of it.
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from .. import metrics
+
+logger = logging.getLogger(__name__)
+
+N_SLOTS = 4
+MAX_FRAME_SIZE = 1024
+# seconds between the liveness checks of the child while no slot is free
+SLOT_TIMEOUT = 1.0
+
+
+def _make_reconstruction(algorithm, n_el):
+    from .bp import BpReconstruction
+    from .jac import JacReconstruction
+    from .greit import GreitReconstruction
+
+    if algorithm == 'bp':
+        return BpReconstruction(n_el)
+    if algorithm == 'greit':
+        return GreitReconstruction(n_el)
+    if 'jac' in algorithm:
+        return JacReconstruction(n_el)
+    raise ValueError('unknown algorithm %r' % (algorithm,))
+
+
+def _plot_params(recon, algorithm):
+    """ what get_plot_params/get_greit_params return for `recon` """
+    if algorithm == 'greit':
+        return {'greit': (recon.gx, recon.gy, recon.ds)}
+    pts = recon.mesh_obj['node']
+    return {'plot': (pts[:, 0], pts[:, 1], recon.mesh_obj['element'],
+                     recon.el_pos)}
+
+
+def _child_main(conn, in_name, in_shape):
+    """ main loop of the reconstruction process """
+    in_shm = shared_memory.SharedMemory(name=in_name)
+    frames = np.ndarray(in_shape, dtype=np.float64, buffer=in_shm.buf)
+    out_shm = None
+    images = None
+    recon = None
+    generation = 0
+    try:
+        while True:
+            msg = conn.recv()
+            cmd = msg[0]
+            if cmd == 'frame':
+                _, gen, slot, size, baseline = msg
+                if gen != generation or recon is None:
+                    conn.send(('free', gen, slot))
+                    continue
+                data = np.where(frames[slot, :size] == 0, 1.0,
+                                frames[slot, :size])
+                try:
+                    if baseline:
+                        recon.update_reference(data)
+                    start = time.perf_counter()
+                    img = np.asarray(recon.eit_reconstruction(data),
+                                     dtype=np.float64)
+                    elapsed = time.perf_counter() - start
+                except Exception as err:  # the slot must come back anyway
+                    logger.info('reconstruction error: %s', err)
+                    conn.send(('free', gen, slot))
+                    continue
+                if images is None or images.shape[1:] != img.shape:
+                    # (re)allocate the image slots for this shape
+                    if out_shm is not None:
+                        del images
+                        out_shm.close()
+                        out_shm.unlink()
+                    out_shm = shared_memory.SharedMemory(
+                        create=True, size=max(in_shape[0] * img.nbytes, 1))
+                    images = np.ndarray((in_shape[0],) + img.shape,
+                                        dtype=np.float64, buffer=out_shm.buf)
+                    conn.send(('images', out_shm.name, images.shape))
+                images[slot] = img
+                conn.send(('image', gen, slot, elapsed))
+            elif cmd == 'reset':
+                _, generation, algorithm, n_el = msg
+                try:
+                    recon = _make_reconstruction(algorithm, n_el)
+                    conn.send(('ready', generation,
+                               _plot_params(recon, algorithm)))
+                except Exception as err:  # report instead of dying silently
+                    recon = None
+                    conn.send(('error', generation, repr(err)))
+            elif cmd == 'reset_reference':
+                if recon is not None:
+                    recon.reset_reference()
+            elif cmd == 'stop':
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        images = None
+        frames = None
+        if out_shm is not None:
+            out_shm.close()
+            out_shm.unlink()
+        in_shm.close()
+
+
+class ProcessReconstructionWorker(threading.Thread):
+    """
+    Drop-in replacement of ReconstructionWorker that reconstructs in a
+    child process.
+
+    The thread itself only moves frames from `input_queue` into the
+    shared-memory slots, a second thread collects the images.
+    """
+
+    def __init__(self, n_slots=N_SLOTS, max_frame_size=MAX_FRAME_SIZE,
+                 reset_timeout=300.):
+        super().__init__(daemon=True)
+        self._input_queue = None
+        self._output_queue = None
+        self._running = True
+        self._algorithm = None
+        self._n_el = None
+        self._baseline = 1
+        self._reset_timeout = reset_timeout
+        self._generation = 0
+        self._params = {}
+        self._ready = threading.Event()
+        self._reset_error = None
+        self._send_lock = threading.Lock()
+        self._n_slots = n_slots
+        self._free_slots = threading.Semaphore(n_slots)
+        self._slots = list(range(n_slots))
+        self._slots_lock = threading.Lock()
+        self._closed = False
+        self.dropped = 0
+        self.last_reconstruction_time = None
+
+        self._in_shm = shared_memory.SharedMemory(
+            create=True, size=n_slots * max_frame_size * 8)
+        self._frames = np.ndarray((n_slots, max_frame_size), dtype=np.float64,
+                                  buffer=self._in_shm.buf)
+        self._out_shm = None
+        self._images = None
+        self._start_process()
+
+    def _start_process(self):
+        # spawn, forking the threads of the dashboard is not safe
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(
+            target=_child_main,
+            args=(child_conn, self._in_shm.name, self._frames.shape),
+            daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _restart(self):
+        """
+        Start a new child after the previous one died. The frames it held
+        are lost, all the slots are free again.
+        """
+        logger.error('reconstruction process exited (code %s), restarting',
+                     self._process.exitcode)
+        self._conn.close()
+        self._collector.join(1)
+        self._images = None
+        if self._out_shm is not None:
+            # the child can no longer unlink its image block
+            self._out_shm.close()
+            try:
+                self._out_shm.unlink()
+            except FileNotFoundError:
+                pass
+            self._out_shm = None
+        with self._slots_lock:
+            self._slots = list(range(self._n_slots))
+        self._free_slots = threading.Semaphore(self._n_slots)
+        self._start_process()
+        self._baseline = 1
+        if self._algorithm is not None:
+            # the frames are only sent after the setup, in the pipe order
+            self._send(('reset', self._generation, self._algorithm,
+                        self._n_el))
+
+    def _send(self, msg):
+        with self._send_lock:
+            self._conn.send(msg)
+
+    def _release(self, slot):
+        with self._slots_lock:
+            self._slots.append(slot)
+        self._free_slots.release()
+
+    def _collect(self):
+        """ receive the messages of the child process """
+        while True:
+            try:
+                msg = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            cmd = msg[0]
+            if cmd == 'image':
+                _, gen, slot, elapsed = msg
+                if gen == self._generation and self._output_queue is not None:
+                    img = self._images[slot].copy()
+                    self.last_reconstruction_time = elapsed
+                    metrics.RECONSTRUCTION_SECONDS.labels(
+                        self._algorithm).observe(elapsed)
+                    self._output_queue.put(img)
+                self._release(slot)
+            elif cmd == 'free':
+                self._release(msg[2])
+            elif cmd == 'images':
+                _, name, shape = msg
+                self._images = None
+                if self._out_shm is not None:
+                    self._out_shm.close()
+                self._out_shm = shared_memory.SharedMemory(name=name)
+                self._images = np.ndarray(shape, dtype=np.float64,
+                                          buffer=self._out_shm.buf)
+            elif cmd in ('ready', 'error'):
+                if msg[1] == self._generation:
+                    if cmd == 'error':
+                        self._reset_error = msg[2]
+                    else:
+                        self._params = msg[2]
+                    self._ready.set()
+
+    def reset(self, input_queue, output_queue, algorithm, n_el):
+        self._input_queue = input_queue
+        self._output_queue = output_queue
+        self._running = True
+        self._algorithm = algorithm
+        self._n_el = n_el
+        self._baseline = 1
+        self._ready.clear()
+        self._reset_error = None
+        # images of the previous configuration are dropped on arrival
+        self._generation += 1
+        self._send(('reset', self._generation, algorithm, n_el))
+        if not self._ready.wait(self._reset_timeout):
+            raise RuntimeError('reconstruction process did not answer')
+        if self._reset_error is not None:
+            raise RuntimeError('reconstruction setup failed: %s' %
+                               self._reset_error)
+
+    def baseline(self):
+        self._baseline = 1
+
+    def reset_baseline(self):
+        self._send(('reset_reference',))
+
+    def get_plot_params(self):
+        return self._params['plot']
+
+    def get_greit_params(self):
+        return self._params['greit']
+
+    def get_radon_params(self):
+        return 0
+
+    def stop_reconstructing(self):
+        self._running = False
+
+    def start_reconstructing(self):
+        self._running = True
+
+    def run(self):
+        while not self._closed:
+            if not self._running or self._input_queue is None:
+                time.sleep(0.01)
+                continue
+            try:
+                frame = self._input_queue.get(timeout=0.1)
+            except Exception:  # queue.Empty
+                continue
+            frame = np.asarray(frame, dtype=float).ravel()
+            if frame.size <= 1:
+                print ('forcing stop reconstruct')
+                self._running = False
+                continue
+            if frame.size > self._frames.shape[1]:
+                logger.warning('frame of %d values does not fit the '
+                               'shared buffer, dropped', frame.size)
+                self.dropped += 1
+                continue
+            # the slots only come back from a live child
+            while not self._free_slots.acquire(timeout=SLOT_TIMEOUT):
+                if self._closed:
+                    return
+                if not self._process.is_alive():
+                    self._restart()
+            with self._slots_lock:
+                slot = self._slots.pop()
+            self._frames[slot, :frame.size] = frame
+            baseline, self._baseline = self._baseline, 0
+            try:
+                self._send(('frame', self._generation, slot, frame.size,
+                            baseline))
+            except OSError:  # broken pipe, the child died since
+                if not self._closed:
+                    self._restart()
+
+    def close(self):
+        """ stop the child process and free the shared memory """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._send(('stop',))
+        except (OSError, ValueError):
+            pass
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._conn.close()
+        self._collector.join(1)
+        self._images = None
+        if self._out_shm is not None:
+            self._out_shm.close()
+        self._frames = None
+        self._in_shm.close()
+        self._in_shm.unlink()
@@ -21,7 +21,7 @@ class EitBase(object):
     """
 
     def __init__(self, mesh, el_pos, ex_mat=None, step=1, perm=None,
-                 jac_normalized=False, parser='std'):
+                 jac_normalized=False, parser='std', state=None):
         """
         Parameters
         ----------
@@ -39,6 +39,10 @@ class EitBase(object):
             normalize the jacobian using f0 computed from input perm
         parser : str, optional, default is 'std'
             parsing file format
+        state : dict, optional
+            arrays of a solver that was set up before, see `state()`.
+            The forward computation and setup() are skipped and the
+            solver is restored from these arrays (i.e., from a cache)
 
         Notes
         -----
@@ -75,6 +79,16 @@ class EitBase(object):
         self.ex_mat = ex_mat
         self.step = step
 
+        # initialize other parameters
+        self.params = {}
+        self.xg = []
+        self.yg = []
+        self.mask = []
+
+        if state is not None:
+            self.load_state(state)
+            return
+
         # solving Jacobian using uniform sigma distribution
         res = fwd.solve_eit(ex_mat, step=step, perm=self.perm, parser=self.parser)
         self.J, self.v0, self.B = res.jac, res.v, res.b_matrix
@@ -85,13 +99,35 @@ class EitBase(object):
 
         # mapping matrix
         self.H = self.B
+        self.setup()
 
-        # initialize other parameters
+    def state(self):
+        """
+        arrays that fully describe the solver after setup,
+        params are stored as 'param_<name>' entries.
+        pass them to EitBase(..., state=state) to restore the solver.
+        """
+        arrays = {'J': self.J, 'v0': self.v0, 'B': self.B, 'H': self.H}
+        for name in ['xg', 'yg', 'mask']:
+            value = getattr(self, name)
+            if np.size(value) > 0:
+                arrays[name] = value
+        for name, value in self.params.items():
+            arrays['param_' + name] = value
+        return arrays
+
+    def load_state(self, state):
+        """ restore the solver from the arrays returned by state() """
+        self.J, self.v0, self.B = state['J'], state['v0'], state['B']
+        self.H = state['H']
+        for name in ['xg', 'yg', 'mask']:
+            if name in state:
+                setattr(self, name, state[name])
         self.params = {}
-        self.xg = []
-        self.yg = []
-        self.mask = []
-        self.setup()
+        for name, value in state.items():
+            if name.startswith('param_'):
+                value = np.asarray(value)
+                self.params[name[6:]] = value.item() if value.ndim == 0 else value
 
     def setup(self):
         """ setup EIT solver """
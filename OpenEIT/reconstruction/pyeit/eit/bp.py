@@ -31,6 +31,7 @@ class BP(EitBase):
         Parameters
         ----------
         v1 : NDArray
+            a frame, or a (n_frames, n_meas) batch of frames
         v0 : NDArray, optional
             d = H(v1 - v0)
         normalize : Boolean
@@ -55,8 +56,8 @@ class BP(EitBase):
         # print (v1.shape)
         # print(v0.shape) # 28... 
         # print (self.H.shape) # this one is 40 x 361? 
-        # smearing
-        ds = np.dot(self.H.transpose(), vn)
+        # smearing, (H^T vn^T)^T also covers a batch of frames
+        ds = np.dot(vn, self.H)
         return np.real(ds)
 
     def map(self, v):
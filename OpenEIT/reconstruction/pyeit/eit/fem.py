@@ -10,6 +10,7 @@ from collections import namedtuple
 import numpy as np
 import numpy.linalg as la
 from scipy import sparse
+from scipy.sparse.linalg import splu
 
 from .utils import eit_scan_lines
 
@@ -17,7 +18,7 @@ from .utils import eit_scan_lines
 class Forward(object):
     """ FEM forward computing code """
 
-    def __init__(self, mesh, el_pos):
+    def __init__(self, mesh, el_pos, chunk_size=None):
         """
         A good FEM forward solver should only depend on
         mesh structure and the position of electrodes
@@ -29,11 +30,16 @@ class Forward(object):
             mesh structure
         el_pos : NDArray
             numbering of electrodes positions
+        chunk_size : int, optional
+            number of elements per batch when building the Jacobian,
+            bounds the memory on large 3D meshes. None (default)
+            computes all elements at once.
         """
         self.pts = mesh['node']
         self.tri = mesh['element']
         self.tri_perm = mesh['perm']
         self.el_pos = el_pos
+        self.chunk_size = chunk_size
 
         # reference electrodes [ref node should not be on electrodes]
         ref_el = 0
@@ -86,40 +92,39 @@ class Forward(object):
             assert perm.shape == (self.n_tri,)
             perm0 = perm
 
-        # calculate f and Jacobian iteratively over all stimulation lines
-        jac, v, b_matrix = [], [], []
+        # solve f and Jacobian of all stimulation lines using a single
+        # factorization of the global stiffness matrix
+        f, jac = self.solve_lines(ex_mat, perm0)
+
+        # calculate v, jac and b_matrix iteratively over all stimulation lines
+        jac_diff, v, b_matrix = [], [], []
         n_lines = ex_mat.shape[0]
 
         for i in range(n_lines):
-            # FEM solver of one stimulation pattern, a row in ex_mat
+            # FEM solution of one stimulation pattern, a row in ex_mat
             ex_line = ex_mat[i]
-            f, jac_i = self.solve(ex_line, perm0)
-            f_el = f[self.el_pos]
+            f_el = f[i, self.el_pos]
 
             # boundary measurements, subtract_row-voltages on electrodes
-            diff_op = voltage_meter(ex_line, n_el=self.ne,step=step, parser=parser)
-            
-            # print ('ex_mat')
-            # print (ex_line)
-            # print (diff_op)
-
+            diff_op = voltage_meter(ex_line, n_el=self.ne, step=step,
+                                    parser=parser)
             v_diff = subtract_row(f_el, diff_op)
-            jac_diff = subtract_row(jac_i, diff_op)
+            jac_i = subtract_row(jac[i], diff_op)
 
             # build bp projection matrix
             # 1. we can either smear at the center of elements, using
             #    >> fe = np.mean(f[self.tri], axis=1)
             # 2. or, simply smear at the nodes using f
-            b = smear(f, f_el, diff_op)
+            b = smear(f[i], f_el, diff_op)
 
             # append
             v.append(v_diff)
-            jac.append(jac_diff)
+            jac_diff.append(jac_i)
             b_matrix.append(b)
 
         # update output, now you can call p.jac, p.v, p.b_matrix
         pde_result = namedtuple("pde_result", ['jac', 'v', 'b_matrix'])
-        p = pde_result(jac=np.vstack(jac),
+        p = pde_result(jac=np.vstack(jac_diff),
                        v=np.hstack(v),
                        b_matrix=np.vstack(b_matrix))
         return p
@@ -142,25 +147,55 @@ class Forward(object):
         J : NDArray
             Jacobian
         """
+        f, jac = self.solve_lines(np.atleast_2d(ex_line), perm)
+        return f[0], jac[0]
+
+    def solve_lines(self, ex_mat, perm):
+        """
+        compute the potential distributions and the Jacobians of all
+        stimulation lines. K is assembled and factorized only once,
+        all right-hand sides are then solved in one batch.
+
+        Parameters
+        ----------
+        ex_mat : NDArray
+            numLines x 2 array, stimulation matrix
+        perm : NDArray
+            permittivity on elements
+
+        Returns
+        -------
+        f : NDArray
+            numLines x n_pts array, potential on nodes
+        jac : NDArray
+            numLines x n_el x n_tri array, Jacobian on electrodes
+        """
+        n_lines = ex_mat.shape[0]
+
         # 1. calculate local stiffness matrix (on each element)
         ke = calculate_ke(self.pts, self.tri)
 
-        # 2. assemble to global K
+        # 2. assemble to global K and factorize it (K is pinned on ref)
         kg = assemble_sparse(ke, self.tri, perm, self.n_pts, ref=self.ref)
+        lu = splu(kg.tocsc())
 
-        # 3. calculate electrode impedance matrix R = K^{-1}
-        r_matrix = la.inv(kg)
-        r_el = r_matrix[self.el_pos]
+        # 3. right-hand sides: the boundary conditions of all stimulation
+        #    lines, followed by the unit currents on each electrode.
+        #    K is symmetric, so R = K^{-1} restricted to the electrodes
+        #    is r_el = (K^{-1} E)^T, no dense inverse is required.
+        b = np.zeros((self.n_pts, n_lines + self.ne), dtype=kg.dtype)
+        for i in range(n_lines):
+            b[:, i] = self._natural_boundary(ex_mat[i]).ravel()
+        b[self.el_pos, n_lines + np.arange(self.ne)] = 1.
 
-        # 4. solving nodes potential using boundary conditions
-        b = self._natural_boundary(ex_line)
-        f = np.dot(r_matrix, b).ravel()
+        # 4. solving nodes potential and electrode responses in one batch
+        x = lu.solve(b)
+        f = x[:, :n_lines].T
+        r_el = x[:, n_lines:].T
 
-        # 5. build Jacobian matrix column wise (element wise)
+        # 5. build Jacobian matrix of all elements and all lines
         #    Je = Re*Ke*Ve = (nex3) * (3x3) * (3x1)
-        jac = np.zeros((self.ne, self.n_tri), dtype=perm.dtype)
-        for (i, e) in enumerate(self.tri):
-            jac[:, i] = np.dot(np.dot(r_el[:, e], ke[i]), f[e])
+        jac = calculate_jac(r_el, f, ke, self.tri, chunk_size=self.chunk_size)
 
         return f, jac
 
@@ -183,6 +218,52 @@ class Forward(object):
         return b
 
 
+def calculate_jac(r_el, f, ke, tri, chunk_size=None):
+    """
+    Calculate the (adjoint) Jacobian on all elements in batched
+    contractions, J[k, :, i] = r_el[:, e] * ke[i] * f[k, e]
+
+    Parameters
+    ----------
+    r_el : NDArray
+        n_el x n_pts array, rows of K^{-1} on electrodes
+    f : NDArray
+        n_pts array (one line) or numLines x n_pts array, potential on nodes
+    ke : NDArray
+        n_tri x (n_vertices x n_vertices) local stiffness matrices
+    tri : NDArray
+        the structure of mesh
+    chunk_size : int, optional
+        number of elements per batch, limits the size of the intermediate
+        (n_el x chunk_size x n_vertices) arrays. None computes all at once.
+
+    Returns
+    -------
+    NDArray
+        n_el x n_tri (one line) or numLines x n_el x n_tri Jacobian
+    """
+    f_lines = np.atleast_2d(f)
+    n_lines = f_lines.shape[0]
+    n_tri = tri.shape[0]
+    if chunk_size is None:
+        chunk_size = n_tri
+
+    dtype = np.result_type(r_el, f_lines, ke)
+    jac = np.empty((n_lines, r_el.shape[0], n_tri), dtype=dtype)
+    for start in range(0, n_tri, chunk_size):
+        sl = slice(start, start + chunk_size)
+        e = tri[sl]
+        # (chunk x n_vertices x n_vertices) * (chunk x n_vertices x numLines)
+        kf = np.matmul(ke[sl], f_lines[:, e].transpose(1, 2, 0))
+        # (chunk x n_el x n_vertices) * (chunk x n_vertices x numLines)
+        je = np.matmul(r_el[:, e].transpose(1, 0, 2), kf)
+        jac[:, :, sl] = je.transpose(2, 1, 0)
+
+    if np.ndim(f) == 1:
+        return jac[0]
+    return jac
+
+
 def smear(f, fb, pairs):
     """
     build smear matrix B for bp
@@ -347,15 +428,16 @@ def assemble_sparse(ke, tri, perm, n_pts, ref=0):
 
     Returns
     -------
-    NDArray
-        k_matrix, NxN array of complex stiffness matrix
+    csr_matrix
+        k_matrix, NxN sparse matrix of complex stiffness matrix
 
     Notes
     -----
-    you may use sparse matrix (IJV) format to automatically add the local
-    stiffness matrix to the global matrix.
+    the global matrix is never densified, the reference node is placed
+    by masking the IJV triplets, so that memory is O(n_tri) and the
+    result can be fed directly to a sparse direct solver.
     """
-    n_tri, n_vertices = tri.shape
+    n_vertices = tri.shape[1]
 
     # New: use IJV indexed sparse matrix to assemble K (fast, prefer)
     # index = np.array([np.meshgrid(no, no, indexing='ij') for no in tri])
@@ -365,27 +447,22 @@ def assemble_sparse(ke, tri, perm, n_pts, ref=0):
     # col = [1, 2, 3, 1, 2, 3, ...]
     row = np.repeat(tri, n_vertices).ravel()
     col = np.repeat(tri, n_vertices, axis=0).ravel()
-    data = np.array([ke[i] * perm[i] for i in range(n_tri)]).ravel()
+    data = (ke * perm[:, None, None]).ravel()
 
     # set reference nodes before constructing sparse matrix, where
     # K[ref, :] = 0, K[:, ref] = 0, K[ref, ref] = 1.
-    # write your own mask code to set the corresponding locations of data
-    # before building the sparse matrix, for example,
-    # data = mask_ref_node(data, row, col, ref)
+    # entries on the ref row/column are dropped from the triplets
+    # and a single unit entry is placed on the diagonal.
+    if 0 <= ref < n_pts:
+        keep = (row != ref) & (col != ref)
+        row = np.append(row[keep], ref)
+        col = np.append(col[keep], ref)
+        data = np.append(data[keep], 1.)
 
-    # for efficient sparse inverse (csc)
+    # duplicated (row, col) entries are summed up by scipy
     A = sparse.csr_matrix((data, (row, col)),
                           shape=(n_pts, n_pts), dtype=perm.dtype)
 
-    # the stiffness matrix may not be sparse
-    A = A.toarray()
-
-    # place reference electrode
-    if 0 <= ref < n_pts:
-        A[ref, :] = 0.
-        A[:, ref] = 0.
-        A[ref, ref] = 1.
-
     return A
 
 
@@ -405,27 +482,22 @@ def calculate_ke(pts, tri):
     ke_array : NGArray
         n_tri x (n_dim x n_dim) 3d matrix
     """
-    n_tri, n_vertices = tri.shape
+    n_vertices = tri.shape[1]
 
     # check dimension
     # '3' : triangles
     # '4' : tetrahedrons
     if n_vertices == 3:
-        _k_local = _k_triangle
+        _k_local = _k_triangles
     elif n_vertices == 4:
-        _k_local = _k_tetrahedron
+        _k_local = _k_tetrahedrons
     else:
         raise TypeError('The num of vertices of elements must be 3 or 4')
 
-    # default data types for ke
-    ke_array = np.zeros((n_tri, n_vertices, n_vertices))
-    for ei in range(n_tri):
-        no = tri[ei, :]
-        xy = pts[no]
-
-        # compute the KIJ (permittivity=1.)
-        ke = _k_local(xy)
-        ke_array[ei] = ke
+    # (n_tri, n_vertices, n_dim) coordinates of all elements,
+    # compute the KIJ (permittivity=1.) of all elements at once
+    xy = pts[tri]
+    ke_array = _k_local(xy)
 
     return ke_array
 
@@ -462,6 +534,33 @@ def _k_triangle(xy):
     return ke_matrix
 
 
+def _k_triangles(xy):
+    """
+    batched version of _k_triangle, solving Kij of all triangles
+    analytically using barycentric coordinates
+
+    Parameters
+    ----------
+    xy : NDArray
+        n_tri x 3 x 2 array, (x,y) of nodes 1,2,3 of each triangle
+
+    Returns
+    -------
+    ke_array : NDArray
+        n_tri x 3 x 3 array, local stiffness matrices
+    """
+    # edges (vector) of triangles
+    s = xy[:, [2, 0, 1]] - xy[:, [1, 2, 0]]
+
+    # signed area of triangles
+    at = np.abs(0.5 * det2x2(s[:, 0].T, s[:, 1].T))
+
+    # (e for element) local stiffness matrices
+    ke_array = np.matmul(s, s.transpose(0, 2, 1)) / (4. * at[:, None, None])
+
+    return ke_array
+
+
 def det2x2(s1, s2):
     """Calculate the determinant of a 2x2 matrix"""
     return s1[0]*s2[1] - s1[1]*s2[0]
@@ -506,3 +605,34 @@ def _k_tetrahedron(xy):
     ke_matrix = np.dot(a, a.transpose()) / (36. * vt)
 
     return ke_matrix
+
+
+def _k_tetrahedrons(xy):
+    """
+    batched version of _k_tetrahedron, solving Kij of all tetrahedrons
+    analytically using barycentric coordinates
+
+    Parameters
+    ----------
+    xy : NDArray
+        n_tri x 4 x 3 array, (x,y,z) of nodes 1, 2, 3, 4 of each element
+
+    Returns
+    -------
+    ke_array : NDArray
+        n_tri x 4 x 4 array, local stiffness matrices
+    """
+    s = xy[:, [2, 3, 0, 1]] - xy[:, [1, 2, 3, 0]]
+
+    # volume of the tetrahedrons
+    vt = np.abs(1./6 * la.det(s[:, :3]))
+
+    # calculate area (vector) of triangle faces
+    # re-normalize using alternative (+,-) signs
+    signs = np.array([1, -1, 1, -1])
+    a = np.cross(s, s[:, [1, 2, 3, 0]]) * signs[None, :, None]
+
+    # local (e for element) stiffness matrices
+    ke_array = np.matmul(a, a.transpose(0, 2, 1)) / (36. * vt[:, None, None])
+
+    return ke_array
@@ -72,13 +72,16 @@ class GREIT(EitBase):
             raise ValueError('method ' + method + ' not supported yet')
 
     def solve(self, v1, v0, normalize=False):
-        """ solving and interpolating (psf convolve) on grids. """
+        """ solving and interpolating (psf convolve) on grids.
+        v1 may be a (n_frames, n_meas) batch of frames """
         if normalize:
             dv = self.normalize(v1, v0)
         else:
             dv = (v1 - v0)
 
-        return -np.dot(self.H, dv)
+        if np.ndim(dv) == 1:
+            return -np.dot(self.H, dv)
+        return -np.dot(dv, self.H.T)
 
     def map(self, v):
         """ return H*v """
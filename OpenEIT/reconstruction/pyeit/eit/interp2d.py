@@ -7,7 +7,7 @@ from __future__ import division, absolute_import, print_function
 
 import numpy as np
 import scipy.linalg as la
-from scipy.sparse import coo_matrix
+from scipy.sparse import coo_matrix, diags
 from scipy.spatial import ConvexHull
 from matplotlib.path import Path
 import matplotlib.pyplot as plt
@@ -139,16 +139,21 @@ def weight_sigmod(xy, xyi, ratio=0.05, s=20.0):
     w_mat : NDArray
         weighting matrix mapping from xy to xyi (xy meshgrid)
     """
-    d_mat = _distance_matrix2d(xy, xyi)
+    # the (size(xy), size(xyi)) matrix is large, all the steps below
+    # are computed in place on the buffer of the distance matrix
+    w_mat = _distance_matrix2d(xy, xyi)
     # normalize distance
-    d_max = np.max(d_mat)
-    d_mat = 5.0 * d_mat / d_max
+    d_max = np.max(w_mat)
     # desired radius (a ratio of max pairwise distance)
     r0 = 5.0 * ratio
-    # weights is the sigmod function
-    weight = 1./(1 + np.exp(s*(d_mat - r0)))
+    # weights is the sigmod function, 1/(1 + exp(s*(5*d/d_max - r0)))
+    w_mat *= 5.0 * s / d_max
+    w_mat -= s * r0
+    np.exp(w_mat, out=w_mat)
+    w_mat += 1.
+    np.reciprocal(w_mat, out=w_mat)
     # normalized
-    w_mat = weight / weight.sum(axis=0)
+    w_mat /= w_mat.sum(axis=0)
 
     return w_mat
 
@@ -259,6 +264,24 @@ def sim2pts(pts, sim, sim_values):
     -----
     This function is similar to pdeprtni of MATLAB pde.
     """
+    return sim2pts_operator(pts, sim).dot(sim_values)
+
+
+def sim2pts_operator(pts, sim):
+    """
+    Description
+    -----------
+    (2D/3D) compatible.
+
+    The sparse NxM matrix of sim2pts. It only depends on the mesh,
+    build it once and apply it to every frame,
+    sim2pts(pts, sim, sim_values) == sim2pts_operator(pts, sim).dot(sim_values)
+
+    Returns
+    -------
+    e2n_map : csr_matrix
+        NxM, row n holds the weights of the elements who share the node n
+    """
     N = pts.shape[0]
     M, dim = sim.shape
     # calculate the weights
@@ -268,17 +291,32 @@ def sim2pts(pts, sim, sim_values):
     elif dim == 4:
         weight_func = tet_volume
     weights = weight_func(pts, sim)
-    # build tri->pts matrix, could be accelerated using sparse matrix
+    # build tri->pts matrix
     row = np.ravel(sim)
     col = np.repeat(np.arange(M), dim)  # [0, 0, 0, 1, 1, 1, ...]
     data = np.repeat(weights, dim)
     e2n_map = coo_matrix((data, (row, col)), shape=(N, M)).tocsr()
-    # map values from elements to nodes
-    # and re-weight by the sum of the areas/volumes of adjacent elements
-    f = e2n_map.dot(sim_values)
-    w = np.sum(e2n_map.toarray(), axis=1)
+    # re-weight by the sum of the areas/volumes of adjacent elements
+    w = np.asarray(e2n_map.sum(axis=1)).ravel()
+    return diags(1. / w).dot(e2n_map).tocsr()
 
-    return f/w
+
+def pts2sim_operator(sim, n_pts=None):
+    """
+    Description
+    -----------
+    (2D/3D) compatible.
+
+    The sparse MxN matrix of pts2sim (average over the nodes of
+    every simplex), pts2sim(sim, v) == pts2sim_operator(sim).dot(v)
+    """
+    M, dim = sim.shape
+    if n_pts is None:
+        n_pts = np.max(sim) + 1
+    row = np.repeat(np.arange(M), dim)
+    col = np.ravel(sim)
+    data = np.ones(M * dim) / dim
+    return coo_matrix((data, (row, col)), shape=(M, n_pts)).tocsr()
 
 
 def pts2sim(sim, pts_values):
@@ -330,18 +368,16 @@ def tri_area(pts, sim):
     a : NDArray
         Areas of triangles
     """
-    a = np.zeros(np.shape(sim)[0])
-    for i, e in enumerate(sim):
-        xy = pts[e]
-        # s1 = xy[2, :] - xy[1, :]
-        # s2 = xy[0, :] - xy[2, :]
-        # s3 = xy[1, :] - xy[0, :]
-        # which can be simplified to
-        # s = xy[[2, 0, 1]] - xy[[1, 2, 0]]
-        s = xy[[2, 0]] - xy[[1, 2]]
-
-        # a should be positive if triangles are CCW arranged
-        a[i] = la.det(s)
+    xy = pts[sim]
+    # s1 = xy[2, :] - xy[1, :]
+    # s2 = xy[0, :] - xy[2, :]
+    # s3 = xy[1, :] - xy[0, :]
+    # which can be simplified to
+    # s = xy[[2, 0, 1]] - xy[[1, 2, 0]]
+    s = xy[:, [2, 0]] - xy[:, [1, 2]]
+
+    # a should be positive if triangles are CCW arranged
+    a = s[:, 0, 0] * s[:, 1, 1] - s[:, 0, 1] * s[:, 1, 0]
 
     return a * 0.5
 
@@ -362,13 +398,11 @@ def tet_volume(pts, sim):
     v : NDArray
         Volumes of tetrahedrons
     """
-    v = np.zeros(np.shape(sim)[0])
-    for i, e in enumerate(sim):
-        xyz = pts[e]
-        s = xyz[[2, 3, 0]] - xyz[[1, 2, 3]]
+    xyz = pts[sim]
+    s = xyz[:, [2, 3, 0]] - xyz[:, [1, 2, 3]]
 
-        # a should be positive if triangles are CCW arranged
-        v[i] = la.det(s)
+    # a should be positive if triangles are CCW arranged
+    v = np.linalg.det(s)
 
     return v / 6.0
 
@@ -11,12 +11,13 @@ import numpy as np
 import scipy.linalg as la
 
 from .base import EitBase
+from .interp2d import sim2pts_operator
 
 
 class JAC(EitBase):
     """ implementing a JAC class """
 
-    def setup(self, p=0.20, lamb=0.001, method='kotre'):
+    def setup(self, p=0.20, lamb=0.001, method='kotre', fused=False):
         """
         JAC, default file parser is 'std'
 
@@ -26,16 +27,36 @@ class JAC(EitBase):
             JAC parameters
         method : str
             regularization methods
+        fused : bool
+            also pre-compute H_pts, the product of the element to node
+            interpolation (sim2pts) and H, see solve_pts
         """
         # passing imaging parameters
         self.params = {
             'p': p,
             'lamb': lamb,
-            'method': method
+            'method': method,
+            'fused': fused
         }
         # pre-compute H0 for dynamical imaging
         # H = (J.T*J + R)^(-1) * J.T
         self.H = h_matrix(self.J, p, lamb, method)
+        self.H_pts = None
+        if fused:
+            # sim2pts is linear, H_pts * dv = sim2pts(H * dv)
+            self.H_pts = sim2pts_operator(self.pts, self.tri).dot(self.H)
+
+    def state(self):
+        """ EitBase.state() and the fused operator """
+        arrays = super(JAC, self).state()
+        if self.H_pts is not None:
+            arrays['H_pts'] = self.H_pts
+        return arrays
+
+    def load_state(self, state):
+        """ restore the solver and the fused operator """
+        super(JAC, self).load_state(state)
+        self.H_pts = state['H_pts'] if 'H_pts' in state else None
 
     def solve(self, v1, v0, normalize=False):
         """ dynamic solve_eit
@@ -58,9 +79,43 @@ class JAC(EitBase):
             dv = self.normalize(v1, v0)
         else:
             dv = (v1 - v0)
-        # s = -Hv
-        ds = -np.dot(self.H, dv)
-        return ds
+        # s = -Hv, dv may be a (n_frames, n_meas) batch of frames
+        if np.ndim(dv) == 1:
+            return -np.dot(self.H, dv)
+        return -np.dot(dv, self.H.T)
+
+    def solve_pts(self, v1, v0, normalize=False):
+        """ dynamic solve_eit, interpolated on nodes (fused operator)
+
+        equals sim2pts(pts, tri, solve(v1, v0)), with a single product.
+        setup(..., fused=True) is required.
+
+        Parameters
+        ----------
+        v1 : NDArray
+            current frame, or a (n_frames, n_meas) batch of frames
+        v0 : NDArray
+            reference frame
+        normalize : Boolean
+            true for conducting normalization
+
+        Returns
+        -------
+        NDArray
+            changes of conductivities on nodes, (n_pts,) for a single
+            frame or (n_frames, n_pts) for a batch
+        """
+        if self.H_pts is None:
+            raise ValueError('fused operator is missing, '
+                             'call setup(..., fused=True)')
+        if normalize:
+            dv = self.normalize(v1, v0)
+        else:
+            dv = (v1 - v0)
+        # one GEMV per frame, one GEMM per batch
+        if np.ndim(dv) == 1:
+            return -np.dot(self.H_pts, dv)
+        return -np.dot(dv, self.H_pts.T)
 
     def map(self, v):
         """ return Hv """
@@ -8,10 +8,11 @@
 from __future__ import division, absolute_import, print_function
 
 from itertools import combinations
+from collections import OrderedDict
+import time
 import numpy as np
 from numpy import sqrt
 from scipy.spatial import Delaunay
-from scipy.sparse import csr_matrix
 
 from .utils import dist, edge_project
 
@@ -23,7 +24,7 @@ class DISTMESH(object):
                  p_fix=None, bbox=None,
                  density_ctrl_freq=30,
                  dptol=0.01, ttol=0.1, Fscale=1.2, deltat=0.2,
-                 verbose=False):
+                 verbose=False, seed=None):
         """ initial distmesh class
 
         Parameters
@@ -54,6 +55,9 @@ class DISTMESH(object):
             rescaled string forces, default=1.2
             if set too small, points near boundary will be pushed back
             if set too large, points will be pushed towards boundary
+        seed : int, optional
+            seed of the rejection sampling on fh, two builds with the same
+            seed produce identical meshes. default=None (numpy.random)
 
         Notes
         -----
@@ -88,13 +92,19 @@ class DISTMESH(object):
         self.num_triangulate = 0
         self.num_density = 0
         self.num_move = 0
+        # accumulated wall time of every phase, see report()
+        self.timings = OrderedDict((k, 0.) for k in
+                                   ['delaunay', 'bars', 'forces',
+                                    'density', 'project'])
+        # without a seed, the global numpy random state is used
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
 
         # keep points inside region (specified by fd) with a small gap (geps)
         p = p[fd(p) < self.geps]
 
         # rejection points by sampling on fh
         r0 = 1. / fh(p)**2
-        selection = np.random.rand(p.shape[0]) < (r0 / np.max(r0))
+        selection = self.rng.rand(p.shape[0]) < (r0 / np.max(r0))
         p = p[selection]
 
         # specify fixed points
@@ -112,6 +122,13 @@ class DISTMESH(object):
         # store p and N
         self.N = p.shape[0]
         self.p = p
+        # sorted keys of the simplices and of the bars (with the number
+        # of simplices sharing every bar) of the last triangulation, the
+        # next one only re-keys the simplices that changed. None after
+        # the nodes were renumbered (density control).
+        self._simplex_keys = None
+        self._bar_keys = None
+        self._bar_count = None
         # initialize pold with inf: it will be re-triangulate at start
         self.pold = np.inf * np.ones((self.N, self.Ndim))
 
@@ -161,19 +178,91 @@ class DISTMESH(object):
         # pnew[:] = pold[:] makes a new copy, not reference
         self.pold[:] = self.p[:]
         # generate new simplices
+        tic = time.time()
         t = self._delaunay(self.p, self.fd, self.geps)
+        self.timings['delaunay'] += time.time() - tic
+
         # extract edges (bars)
+        tic = time.time()
+        # (the keys of a simplex hold Ndim+1 node numbers < N)
+        fits = self.N ** (self.Ndim + 1) < np.iinfo(np.int64).max
+        if self._simplex_keys is not None and fits:
+            self._update_bars(t)
+        else:
+            self._simplex_keys = np.sort(self._keys_of_simplices(t)) \
+                if fits else None
+            # note : for all edges, non-duplicated edge is boundary edge
+            self._bar_keys, self._bar_count = np.unique(
+                self._keys_of_bars(t), return_counts=True)
+        keys = self._bar_keys
+        self.bars = np.column_stack([keys // self.N, keys % self.N])
+        self.t = t
+        self.timings['bars'] += time.time() - tic
+
+    def _keys_of_simplices(self, t):
+        """ one int64 per simplex, whatever the order of its nodes """
+        t = np.sort(t, axis=1).astype(np.int64)
+        keys = t[:, 0]
+        for k in range(1, t.shape[1]):
+            keys = keys * self.N + t[:, k]
+        return keys
+
+    def _simplices_of_keys(self, keys):
+        """ (n, Ndim+1) sorted nodes of simplex keys """
+        cols = []
+        for _ in range(self.Ndim + 1):
+            cols.append(keys % self.N)
+            keys = keys // self.N
+        return np.column_stack(cols[::-1]).reshape((-1, self.Ndim + 1))
+
+    def _keys_of_bars(self, t):
+        """ the keys of the bars of simplices t, a bar shared by k simplices
+        is repeated k times """
         bars = t[:, self.edge_combinations].reshape((-1, 2))
         # sort and remove duplicated edges, eg (1,2) and (2,1)
-        # note : for all edges, non-duplicated edge is boundary edge
-        bars = np.sort(bars, axis=1)
-        # save
-        bars_tuple = bars.view([('', bars.dtype)]*bars.shape[1])
-        self.bars = np.unique(bars_tuple).view(bars.dtype).reshape((-1, 2))
-        self.t = t
+        bars = np.sort(bars, axis=1).astype(np.int64)
+        # a bar (a, b) with a < b is encoded as a*N + b, the sorted keys
+        # are ordered as the rows of the bars (lexicographic order)
+        return bars[:, 0] * self.N + bars[:, 1]
+
+    def _update_bars(self, t):
+        """
+        Update the bars from the previous triangulation: the points only
+        moved a little, so most simplices are the same. Only the bars of
+        the removed and of the added simplices are counted again.
+        """
+        new = self._keys_of_simplices(t)
+        old = self._simplex_keys
+        # simplices found in the previous triangulation
+        pos = np.minimum(np.searchsorted(old, new), max(old.size - 1, 0))
+        found = old[pos] == new if old.size else np.zeros(new.size, bool)
+        kept = np.zeros(old.size, dtype=bool)
+        kept[pos[found]] = True
+        added = np.sort(new[~found])
+        removed = old[~kept]
+        kept_keys = old[kept]
+        self._simplex_keys = np.insert(
+            kept_keys, np.searchsorted(kept_keys, added), added)
+
+        keys, count = self._bar_keys, self._bar_count
+        gone = self._keys_of_bars(self._simplices_of_keys(removed))
+        np.subtract.at(count, np.searchsorted(keys, gone), 1)
+        born, n_born = np.unique(
+            self._keys_of_bars(self._simplices_of_keys(added)),
+            return_counts=True)
+        at = np.searchsorted(keys, born)
+        known = at < keys.size
+        known[known] = keys[at[known]] == born[known]
+        count[at[known]] += n_born[known]
+        keys = np.insert(keys, at[~known], born[~known])
+        count = np.insert(count, at[~known], n_born[~known])
+        # bars of no simplex left
+        alive = count > 0
+        self._bar_keys, self._bar_count = keys[alive], count[alive]
 
     def bar_length(self):
         """ the forces of bars (python is by-default row-wise operation) """
+        tic = time.time()
         # two node of a bar
         bars_a, bars_b = self.p[self.bars[:, 0]], self.p[self.bars[:, 1]]
         # bar vector
@@ -184,35 +273,29 @@ class DISTMESH(object):
         hbars = self.fh((bars_a + bars_b)/2.0).reshape((-1, 1))
         # L0 : desired lengths (Fscale matters!)
         L0 = hbars * self.Fscale * sqrt(np.sum(L**2) / np.sum(hbars**2))
+        self.timings['forces'] += time.time() - tic
 
         return L, L0, barvec
 
     def bar_force(self, L, L0, barvec):
         """ forces on bars """
+        tic = time.time()
         # abs(forces)
         F = np.maximum(L0 - L, 0)
         # normalized and vectorized forces
         Fvec = F * (barvec / L)
-        # now, we get forces and sum them up on nodes
-        # using sparse matrix to perform automatic summation
-        # rows : left, left, right, right (2D)
-        #      : left, left, left, right, right, right (3D)
-        # cols : x, y, x, y (2D)
-        #      : x, y, z, x, y, z (3D)
-        data = np.hstack([Fvec, -Fvec])
-        if self.Ndim == 2:
-            rows = self.bars[:, [0, 0, 1, 1]]
-            cols = np.dot(np.ones(np.shape(F)), np.array([[0, 1, 0, 1]]))
-        else:
-            rows = self.bars[:, [0, 0, 0, 1, 1, 1]]
-            cols = np.dot(np.ones(np.shape(F)), np.array([[0, 1, 2, 0, 1, 2]]))
-        # sum nodes at duplicated locations using sparse matrices
-        Ftot = csr_matrix((data.reshape(-1),
-                           [rows.reshape(-1), cols.reshape(-1)]),
-                          shape=(self.N, self.Ndim))
-        Ftot = Ftot.toarray()
+        # now, we get forces and sum them up on nodes,
+        # +Fvec on the left node and -Fvec on the right node of a bar.
+        # bincount sums the duplicated nodes, per dimension
+        Ftot = np.empty((self.N, self.Ndim))
+        for k in range(self.Ndim):
+            Ftot[:, k] = np.bincount(self.bars[:, 0], weights=Fvec[:, k],
+                                     minlength=self.N) \
+                - np.bincount(self.bars[:, 1], weights=Fvec[:, k],
+                              minlength=self.N)
         # zero out forces at fixed points, as they do not move
         Ftot[0:len(self.pfix)] = 0
+        self.timings['forces'] += time.time() - tic
         return Ftot
 
     def density_control(self, L, L0):
@@ -223,6 +306,7 @@ class DISTMESH(object):
         """
         self.debug('enter density control = ', self.num_density)
         self.num_density += 1
+        tic = time.time()
         # quality control
         ixout = (L0 > 2*L).ravel()
         ixdel = np.setdiff1d(self.bars[ixout, :].reshape(-1),
@@ -231,7 +315,10 @@ class DISTMESH(object):
         # Nold = N
         self.N = self.p.shape[0]
         self.pold = np.inf * np.ones((self.N, self.Ndim))
+        # the nodes are renumbered, the next bars are built from scratch
+        self._simplex_keys = None
         # print('density control ratio : %f' % (float(N)/Nold))
+        self.timings['density'] += time.time() - tic
 
     def move_p(self, Ftot):
         """ update p """
@@ -243,10 +330,12 @@ class DISTMESH(object):
         # if there is any point ends up outside
         # move it back to the closest point on the boundary
         # using the numerical gradient of distance function
+        tic = time.time()
         d = self.fd(self.p)
         ix = d > 0
-        if sum(ix) > 0:
+        if ix.any():
             self.p[ix] = edge_project(self.p[ix], self.fd)
+        self.timings['project'] += time.time() - tic
 
         # check whether convergence : no big movements
         ix_interior = d < -self.geps
@@ -256,6 +345,17 @@ class DISTMESH(object):
         self.debug('  score = ', score)
         return score < self.dptol
 
+    def report(self):
+        """ time spent in every phase of the build """
+        total = sum(self.timings.values())
+        lines = ['distmesh: N=%d, %d triangulations, %d density controls, '
+                 '%d moves' % (self.N, self.num_triangulate,
+                               self.num_density, self.num_move)]
+        for name, t in self.timings.items():
+            lines.append('  %-10s %8.4f s  %5.1f%%' %
+                         (name, t, 100. * t / max(total, 1e-12)))
+        return '\n'.join(lines)
+
     def debug(self, *args):
         """ print debug messages """
         if self.verbose:
@@ -347,7 +447,7 @@ def remove_duplicate_nodes(p, pfix, geps):
 
 def build(fd, fh, pfix=None, bbox=None, h0=0.1,
           densityctrlfreq=32, deltat=0.2,
-          maxiter=500, verbose=False):
+          maxiter=500, verbose=False, seed=None, profile=False):
     """ main function for distmesh
 
     See Also
@@ -358,6 +458,11 @@ def build(fd, fh, pfix=None, bbox=None, h0=0.1,
     ----------
     maxiter : int, optional
         maximum iteration numbers, default=1000
+    seed : int, optional
+        seed of the initial point distribution, see DISTMESH
+    profile : bool, optional
+        print the time spent in every phase (delaunay, bars, forces,
+        density control and edge projection) at the end of the build
 
     Returns
     -------
@@ -403,7 +508,7 @@ def build(fd, fh, pfix=None, bbox=None, h0=0.1,
                   h0=h0, p_fix=pfix, bbox=bbox,
                   density_ctrl_freq=densityctrlfreq, deltat=deltat,
                   dptol=g_dptol, ttol=g_ttol, Fscale=g_Fscale,
-                  verbose=verbose)
+                  verbose=verbose, seed=seed)
 
     # now iterate to push to equilibrium
     for i in range(maxiter):
@@ -431,6 +536,8 @@ def build(fd, fh, pfix=None, bbox=None, h0=0.1,
 
     # at the end of iteration, (p - pold) is small, so we recreate delaunay
     dm.triangulate()
+    if profile:
+        print(dm.report())
 
     # you should remove duplicate nodes and triangles
     return dm.p, dm.t
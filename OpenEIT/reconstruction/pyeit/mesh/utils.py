@@ -63,38 +63,23 @@ def edge_grad(pts, fd, h0=1.0):
     you should specify h0 according to your actual mesh size
     """
     d_eps = np.sqrt(np.finfo(float).eps)*h0
+    pts = np.asarray(pts, dtype=float)
     # get dimensions
-    n_dim = np.shape(pts)[1]
-
-    def grad(p):
-        """ calculate numerical gradient on a single point
-
-        Parameters
-        ----------
-        p : array_like
-            a point in ND
-
-        Return
-        ------
-        array_like
-            gradient on each dimensions
-
-        Note
-        ----
-        numerical gradient, f'_x = (f(p+delta_x) - f(x)) / delta
-        """
-        d = fd(p)
-        g = (fd(p + d_eps*np.eye(n_dim)) - d) / d_eps
-        # normalize, avoid divide by zero
-        g2 = np.sqrt(np.sum(g**2)) + d_eps
-        return d * g/g2
-
-    # calculate gradients
-    if len(np.shape(pts)) == 1:
-        g_num = grad(pts)
-    else:
-        # apply on slices taken along the axis (=1)
-        g_num = np.apply_along_axis(grad, 1, pts)
+    n_dim = np.shape(pts)[-1]
+    # all points at once, f'_x = (f(p+delta_x) - f(x)) / delta
+    p = np.atleast_2d(pts)
+    d = fd(p)
+    g = np.empty(p.shape)
+    for k in range(n_dim):
+        p_k = p.copy()
+        p_k[:, k] += d_eps
+        g[:, k] = (fd(p_k) - d) / d_eps
+    # normalize, avoid divide by zero
+    g2 = np.sqrt(np.sum(g**2, axis=1)) + d_eps
+    g_num = (d / g2)[:, np.newaxis] * g
+
+    if pts.ndim == 1:
+        g_num = g_num[0]
     return g_num
 
 
@@ -151,20 +136,17 @@ def check_order(no2xy, el2no):
     -----
     tetrahedron should be parsed that the sign of volume is [1, -1, 1, -1]
     """
-    el_num, n_vertices = np.shape(el2no)
-    # select ae function
+    n_vertices = np.shape(el2no)[1]
+    # signed area/volume of all elements, as tri_area and tet_volume
+    xy = no2xy[el2no]
     if n_vertices == 3:
-        _fn = tri_area
+        s = xy[:, [2, 0]] - xy[:, [1, 2]]
     elif n_vertices == 4:
-        _fn = tet_volume
-    # calculate ae and re-order tri if necessary
-    for ei in range(el_num):
-        no = el2no[ei, :]
-        xy = no2xy[no, :]
-        v = _fn(xy)
-        # if CCW, area should be positive, otherwise,
-        if v < 0:
-            el2no[ei, [1, 2]] = el2no[ei, [2, 1]]
+        s = xy[:, [2, 3, 0]] - xy[:, [1, 2, 3]]
+    v = np.linalg.det(s)
+    # if CCW, area should be positive, otherwise, re-order tri
+    ix = v < 0
+    el2no[np.ix_(ix, [1, 2])] = el2no[np.ix_(ix, [2, 1])]
 
     return el2no
 
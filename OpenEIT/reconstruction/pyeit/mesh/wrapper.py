@@ -14,7 +14,8 @@ from .shape import unit_circle, unit_ball, area_uniform
 from .shape import fix_points_fd, fix_points_ball
 
 
-def create(n_el=16, fd=None, fh=None, p_fix=None, bbox=None, h0=0.1):
+def create(n_el=16, fd=None, fh=None, p_fix=None, bbox=None, h0=0.1,
+           seed=None):
     """
     wrapper for pyEIT interface
 
@@ -32,6 +33,8 @@ def create(n_el=16, fd=None, fh=None, p_fix=None, bbox=None, h0=0.1):
         bounding box
     h0 : float, optional
         initial mesh size
+    seed : int, optional
+        seed of distmesh, the same seed always builds the same mesh
 
     Returns
     -------
@@ -63,7 +66,7 @@ def create(n_el=16, fd=None, fh=None, p_fix=None, bbox=None, h0=0.1):
         fh = area_uniform
 
     # 1. build mesh
-    p, t = build(fd, fh, pfix=p_fix, bbox=bbox, h0=h0)
+    p, t = build(fd, fh, pfix=p_fix, bbox=bbox, h0=h0, seed=seed)
     # 2. check whether t is counter-clock-wise, otherwise reshape it
     t = check_order(p, t)
     # 3. generate electrodes, the same as p_fix (top n_el)
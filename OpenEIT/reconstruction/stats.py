@@ -0,0 +1,116 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+
+Streaming statistics of the reconstructed images.
+
+FrameStats is updated once per image, next to the reconstruction, and
+keeps a small summary the dashboard reads instead of scanning the image
+on every tick:
+
+- the NaN count (the outside of the GREIT grid) and the frame min/max,
+- a min/max envelope that follows a new extreme at once and relaxes
+  towards the frame values by `decay` per frame, so autoscale does not
+  jump with every frame,
+- exponentially weighted percentiles,
+- a histogram of `n_bins` fixed bins over the envelope.
+"""
+
+import threading
+
+import numpy as np
+
+
+class FrameStats:
+    """
+    Running statistics of a stream of images.
+
+    Parameters
+    ----------
+    n_bins : int
+        bins of the histogram
+    decay : float
+        weight of the past per frame, 0 keeps the last frame only
+    percentiles : tuple of float
+        percentiles tracked, in [0, 100]
+    """
+
+    def __init__(self, n_bins=64, decay=0.9, percentiles=(1., 50., 99.)):
+        if not 0 <= decay < 1:
+            raise ValueError('decay must be in [0, 1), got %r' % (decay,))
+        self.n_bins = int(n_bins)
+        self.decay = float(decay)
+        self.percentiles = tuple(float(p) for p in percentiles)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ forget the past frames (reconstruction reconfigured) """
+        with self._lock:
+            self._frames = 0
+            self._low = None
+            self._high = None
+            self._pct = None
+            self._summary = None
+
+    def update(self, img):
+        """ add one image, returns its summary """
+        flat = np.asarray(img, dtype=float).ravel()
+        finite = np.isfinite(flat)
+        values = flat[finite] if not finite.all() else flat
+        n_nan = flat.size - values.size
+
+        with self._lock:
+            if values.size:
+                lo, hi = float(values.min()), float(values.max())
+                pct = np.percentile(values, self.percentiles)
+                if self._low is None:
+                    self._low, self._high, self._pct = lo, hi, pct
+                else:
+                    d = self.decay
+                    self._low = min(lo, d * self._low + (1 - d) * lo)
+                    self._high = max(hi, d * self._high + (1 - d) * hi)
+                    self._pct = d * self._pct + (1 - d) * pct
+            else:
+                lo = hi = None
+            self._frames += 1
+
+            summary = {
+                'frames': self._frames,
+                'size': int(flat.size),
+                'n_nan': int(n_nan),
+                'min': lo,
+                'max': hi,
+                'range': ((self._low, self._high)
+                          if self._low is not None else None),
+                'percentiles': (dict(zip(self.percentiles,
+                                         self._pct.tolist()))
+                                if self._pct is not None else {}),
+            }
+            if values.size:
+                # the envelope contains the frame, every value is binned
+                counts, edges = np.histogram(
+                    values, bins=self.n_bins,
+                    range=(self._low, self._high)
+                    if self._high > self._low else None)
+                summary['counts'] = counts.tolist()
+                summary['edges'] = edges.tolist()
+            else:
+                summary['counts'] = []
+                summary['edges'] = []
+            self._summary = summary
+        return summary
+
+    def summary(self):
+        """ the summary of the last image, None before the first one """
+        with self._lock:
+            return self._summary
+
+    def autoscale_range(self):
+        """ (vmin, vmax) of the envelope, None before the first image """
+        with self._lock:
+            if self._low is None or not self._high > self._low:
+                return None
+            return self._low, self._high
@@ -18,6 +18,7 @@ from .bp import BpReconstruction
 from .jac import JacReconstruction
 from .greit import GreitReconstruction
 from .radon import RadonReconstruction
+from .. import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -91,9 +92,9 @@ class ReconstructionWorker(threading.Thread):
         # TODO: add time tracking here!
         while self._running:
             if self._input_queue is not None:             
-                data = np.array(self._input_queue.get())
+                data = np.asarray(self._input_queue.get(), dtype=float)
                 # preprocess the data to exclude zero values? 
-                data = [1.0 if x == 0 else x for x in data]
+                data = np.where(data == 0, 1.0, data)
 
                 if len(data) > 1:
 
@@ -102,9 +103,11 @@ class ReconstructionWorker(threading.Thread):
                         self._baseline = 0
 
                     try:
-                        before = time.time()
+                        before = time.perf_counter()
                         img = self._reconstruction.eit_reconstruction(data)
-                        logger.info("reconstruction time: %.2f", time.time() - before)
+                        elapsed = time.perf_counter() - before
+                        metrics.RECONSTRUCTION_SECONDS.labels(self._algorithm).observe(elapsed)
+                        logger.debug("reconstruction time: %.4f", elapsed)
                     except RuntimeError as err:
                         logger.info('reconstruction error: %s', err)
                     else:
@@ -58,6 +58,26 @@ def main():
                     action="store_true",
                     default=False,
                     help="Show debug messages in GUI.")
+    ap.add_argument("--process-worker",
+                    action="store_true",
+                    default=False,
+                    help="Reconstruct in a separate process.")
+    ap.add_argument("--workers",
+                    type=int,
+                    default=0,
+                    help="Reconstruct with a pool of N workers.")
+    ap.add_argument("--asyncio",
+                    action="store_true",
+                    default=False,
+                    help="Read the devices on one asyncio event loop.")
+    ap.add_argument("--push",
+                    action="store_true",
+                    default=False,
+                    help="Push the images to the browser instead of polling.")
+    ap.add_argument("--tiles",
+                    choices=("png", "webp"),
+                    default=None,
+                    help="Show the images as server-rendered tiles.")
     ap.add_argument("port", nargs="?")
 
     args = ap.parse_args()
@@ -68,12 +88,17 @@ def main():
         initial_port=args.port,
         read_file=args.read_file,
         virtual_tty=args.virtual_tty,
+        worker=('pool' if args.workers > 0 else
+                'process' if args.process_worker else 'thread'),
+        n_workers=args.workers,
+        acquisition='asyncio' if args.asyncio else 'thread',
         #n_el= n_el,
         #algorithm=algorithm,
         #mode=mode
     )
 
-    gui = runGui(controller, args.debug_dash)
+    gui = runGui(controller, args.debug_dash, push=args.push,
+                 tiles=args.tiles)
     gui.run()
 
 
@@ -0,0 +1,111 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Several devices streaming at once: reader threads vs one event loop.
+
+    Every device is a SerialHandler connected to the slave end of its own
+    pseudo terminal, all of them feed one FrameRing. The frames are
+    written to the master ends as fast as possible, once with a reader
+    thread per device (backend='thread') and once on the shared asyncio
+    loop (backend='asyncio'). The script checks that every frame arrives
+    and reports the frame rate, the CPU time and the number of threads.
+
+    .. note:: PTYs only exist on POSIX systems.
+
+    usage: python benchmarks/bench_acquisition.py [--devices 4]
+               [--n-frames 500] [--framing ascii|binary]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenEIT.backend import framing
+from OpenEIT.backend.ringbuffer import FrameRing
+from OpenEIT.backend.serialhandler import SerialHandler
+
+
+def run(backend, chunks, n_devices, framing_name, mode, timeout=60.):
+    ring = FrameRing(capacity=len(chunks) * n_devices + 1)
+    reader = ring.reader()
+    ptys = [os.openpty() for _ in range(n_devices)]
+    handlers = []
+    for _, slave_fd in ptys:
+        handler = SerialHandler(ring)
+        handler.setmode(mode)
+        handler.connect(os.ttyname(slave_fd), framing=framing_name,
+                        backend=backend)
+        handlers.append(handler)
+    n_threads = threading.active_count()
+
+    def writer(master_fd):
+        for chunk in chunks:
+            os.write(master_fd, chunk)
+
+    writers = [threading.Thread(target=writer, args=(master_fd,))
+               for master_fd, _ in ptys]
+    expected = len(chunks) * n_devices
+    cpu = time.process_time()
+    start = time.time()
+    for thread in writers:
+        thread.start()
+    deadline = start + timeout
+    while ring.written < expected and time.time() < deadline:
+        time.sleep(0.005)
+    elapsed = time.time() - start
+    cpu = time.process_time() - cpu
+    for thread in writers:
+        thread.join()
+
+    first = np.array(reader.get(timeout=1))
+    for handler in handlers:
+        handler.disconnect()
+    for master_fd, slave_fd in ptys:
+        os.close(master_fd)
+        os.close(slave_fd)
+    return ring.written, elapsed, cpu, n_threads, first
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--devices', type=int, default=4)
+    ap.add_argument('--n-frames', type=int, default=500)
+    ap.add_argument('--n-values', type=int, default=896)
+    ap.add_argument('--framing', default='ascii', choices=('ascii', 'binary'))
+    ap.add_argument('--mode', default='d')
+    args = ap.parse_args()
+
+    rng = np.random.RandomState(0)
+    frames = [rng.randn(args.n_values) for _ in range(args.n_frames)]
+    if args.framing == 'ascii':
+        chunks = [framing.encode_line(v, args.mode).encode() for v in frames]
+    else:
+        chunks = [framing.encode_frame(v, args.mode) for v in frames]
+
+    print('%d devices x %d frames of %d values (%s)' % (
+        args.devices, args.n_frames, args.n_values, args.framing))
+    print('%8s %10s %12s %10s %9s' % ('backend', 'frames', 'frames/s',
+                                      'cpu s', 'threads'))
+    for backend in ('thread', 'asyncio'):
+        n, elapsed, cpu, n_threads, first = run(
+            backend, chunks, args.devices, args.framing, args.mode)
+        assert n == args.devices * args.n_frames, (
+            '%s: %d of %d frames' % (backend, n,
+                                     args.devices * args.n_frames))
+        assert np.allclose(first, frames[0], rtol=1e-6), backend
+        print('%8s %10d %12.0f %10.2f %9d' % (backend, n, n / elapsed, cpu,
+                                              n_threads))
+
+
+if __name__ == "__main__":
+    main()
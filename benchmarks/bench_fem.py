@@ -0,0 +1,108 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Mesh-size scaling benchmark of the FEM forward solver.
+
+    Compares the dense path (dense assembly + dense LU) against the sparse
+    path (IJV assembly + sparse LU) for the stimulation sweep of one mesh.
+    Every (path, h0) pair runs in its own process, so the reported peak
+    RSS is not polluted by the previous run.
+
+    usage: python benchmarks/bench_fem.py [--n-el 16] [--h0 0.1 0.07 0.05]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import scipy.linalg as la
+from scipy.sparse.linalg import splu
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux (bytes on macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss = rss / 1024.
+    return rss / 1024.
+
+
+def run_single(path, h0, n_el):
+    """ build one mesh and time a full stimulation sweep on it """
+    from OpenEIT.reconstruction.pyeit import mesh
+    from OpenEIT.reconstruction.pyeit.eit import fem
+    from OpenEIT.reconstruction.pyeit.eit.utils import eit_scan_lines
+
+    mesh_obj, el_pos = mesh.create(n_el, h0=h0)
+    fwd = fem.Forward(mesh_obj, el_pos)
+    ex_mat = eit_scan_lines(n_el, n_el // 2)
+    perm = np.ones(fwd.n_tri)
+    # right-hand sides: all lines and the unit electrode currents
+    b = np.zeros((fwd.n_pts, ex_mat.shape[0] + fwd.ne))
+    for i, ex_line in enumerate(ex_mat):
+        b[:, i] = fwd._natural_boundary(ex_line).ravel()
+    b[el_pos, ex_mat.shape[0] + np.arange(fwd.ne)] = 1.
+    rss_before = _peak_rss_mb()
+
+    start = time.time()
+    ke = fem.calculate_ke(fwd.pts, fwd.tri)
+    if path == 'dense':
+        kg = fem.assemble(ke, fwd.tri, perm, fwd.n_pts, ref=fwd.ref)
+        x = la.lu_solve(la.lu_factor(kg), b)
+    else:
+        kg = fem.assemble_sparse(ke, fwd.tri, perm, fwd.n_pts, ref=fwd.ref)
+        x = splu(kg.tocsc()).solve(b)
+    elapsed = time.time() - start
+
+    return {'path': path,
+            'h0': h0,
+            'n_pts': fwd.n_pts,
+            'n_tri': fwd.n_tri,
+            'time': elapsed,
+            'rss_mb': _peak_rss_mb(),
+            'rss_delta_mb': _peak_rss_mb() - rss_before,
+            'checksum': float(np.abs(x).sum())}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n-el', type=int, default=16)
+    ap.add_argument('--h0', type=float, nargs='+',
+                    default=[0.1, 0.07, 0.05, 0.035])
+    ap.add_argument('--paths', nargs='+', default=['dense', 'sparse'])
+    ap.add_argument('--single', nargs=2, metavar=('PATH', 'H0'),
+                    help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.single is not None:
+        res = run_single(args.single[0], float(args.single[1]), args.n_el)
+        print(json.dumps(res))
+        return
+
+    print('%6s %7s %7s %8s %10s %12s %12s' % ('path', 'h0', 'n_pts', 'n_tri',
+                                              'time [s]', 'peak RSS MB',
+                                              'delta RSS MB'))
+    for h0 in args.h0:
+        for path in args.paths:
+            out = subprocess.check_output([sys.executable, __file__,
+                                           '--n-el', str(args.n_el),
+                                           '--single', path, str(h0)])
+            res = json.loads(out.decode().strip().splitlines()[-1])
+            print('%6s %7.3f %7d %8d %10.3f %12.1f %12.1f' % (
+                res['path'], res['h0'], res['n_pts'], res['n_tri'],
+                res['time'], res['rss_mb'], res['rss_delta_mb']))
+
+
+if __name__ == "__main__":
+    main()
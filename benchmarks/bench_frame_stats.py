@@ -0,0 +1,84 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Server time and payload of the imaging histogram tick, raw values vs
+    the summary of FrameStats.
+
+    The former tick fetched the plot parameters, filtered the NaNs of the
+    image and sent every value in a go.Histogram, on every tick. Now
+    FrameStats.update bins each image once, next to the reconstruction,
+    and the tick only sends the bin counts. The GREIT grid (32 x 32, NaN
+    outside the domain) is used as the image.
+
+    usage: python benchmarks/bench_frame_stats.py [--size 32] [--repeat 200]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plotly.graph_objs as go
+from plotly.io.json import to_json_plotly
+
+from OpenEIT.reconstruction import FrameStats
+
+
+def former_tick(img):
+    nanless = img[~np.isnan(img)]
+    flatimg = nanless.flatten()
+    return {'data': [go.Histogram(x=flatimg)]}
+
+
+def summary_tick(stats):
+    summary = stats.summary()
+    edges = summary['edges']
+    return {'data': [{'type': 'bar', 'x': edges[:-1], 'y': summary['counts'],
+                      'offset': 0, 'width': edges[1] - edges[0]}]}
+
+
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        res = func()
+    return (time.perf_counter() - start) / repeat, res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size', type=int, default=32)
+    ap.add_argument('--repeat', type=int, default=200)
+    args = ap.parse_args()
+
+    n = args.size
+    yy, xx = np.mgrid[-1:1:n * 1j, -1:1:n * 1j]
+    img = np.random.RandomState(0).randn(n, n)
+    img[xx ** 2 + yy ** 2 > 1] = np.nan
+
+    stats = FrameStats()
+    t_update, _ = timeit(lambda: stats.update(img), args.repeat)
+
+    t_old, fig_old = timeit(
+        lambda: to_json_plotly(former_tick(img)), args.repeat)
+    t_new, fig_new = timeit(
+        lambda: to_json_plotly(summary_tick(stats)), args.repeat)
+
+    print('%d x %d image, %d finite values' % (n, n, np.isfinite(img).sum()))
+    print('%-24s %10s %12s' % ('', 'ms/tick', 'bytes/tick'))
+    print('%-24s %10.3f %12d' % ('raw values, histogram', 1e3 * t_old,
+                                 len(fig_old)))
+    print('%-24s %10.3f %12d' % ('summary, bars', 1e3 * t_new, len(fig_new)))
+    print('FrameStats.update: %.3f ms per image, off the web server' % (
+        1e3 * t_update))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Local stiffness matrices: batched kernels vs. the per-element reference.
+
+    _k_triangle and _k_tetrahedron are kept as the reference implementation,
+    calculate_ke uses the batched kernels. This script checks that both agree
+    on a 2D unit_circle and a 3D unit_ball mesh and reports the speed up.
+
+    usage: python benchmarks/bench_ke.py [--h0 0.1] [--h0-3d 0.15]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenEIT.reconstruction.pyeit import mesh
+from OpenEIT.reconstruction.pyeit.eit import fem
+
+
+def reference_ke(pts, tri):
+    """ per-element loop (the former calculate_ke) """
+    _k_local = fem._k_triangle if tri.shape[1] == 3 else fem._k_tetrahedron
+    ke_array = np.zeros((tri.shape[0], tri.shape[1], tri.shape[1]))
+    for ei, no in enumerate(tri):
+        ke_array[ei] = _k_local(pts[no])
+    return ke_array
+
+
+def compare(name, mesh_obj, repeat=3):
+    pts, tri = mesh_obj['node'], mesh_obj['element']
+
+    start = time.time()
+    for _ in range(repeat):
+        ke_ref = reference_ke(pts, tri)
+    t_ref = (time.time() - start) / repeat
+
+    start = time.time()
+    for _ in range(repeat):
+        ke = fem.calculate_ke(pts, tri)
+    t_vec = (time.time() - start) / repeat
+
+    err = np.max(np.abs(ke - ke_ref)) / np.max(np.abs(ke_ref))
+    assert np.allclose(ke, ke_ref, rtol=1e-10, atol=0), name
+    print('%-12s n_tri=%6d  loop %8.4f s  batched %8.4f s  x%6.1f  '
+          'max rel err %.1e' % (name, tri.shape[0], t_ref, t_vec,
+                                t_ref / t_vec, err))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n-el', type=int, default=16)
+    ap.add_argument('--h0', type=float, default=0.1)
+    ap.add_argument('--h0-3d', type=float, default=0.15)
+    args = ap.parse_args()
+
+    mesh_2d, _ = mesh.create(args.n_el, h0=args.h0)
+    compare('unit_circle', mesh_2d)
+
+    mesh_3d, _ = mesh.create(args.n_el, h0=args.h0_3d,
+                             bbox=[[-1, -1, -1], [1, 1, 1]])
+    compare('unit_ball', mesh_3d)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Server time and payload of one imaging tick, per-triangle colour
+    strings vs colour levels patched into a static mesh.
+
+    The former path mapped every triangle through a lambda, a Python mean
+    and a colour string, and sent the whole Mesh3d on every tick. The
+    current path computes the colour levels with NumPy and, once the
+    browser has the mesh, only sends them in a dash.Patch. The colours of
+    both paths are compared.
+
+    usage: python benchmarks/bench_mesh_render.py [--n-el 32] [--repeat 50]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dash
+import matplotlib.cm as cm
+import plotly.graph_objs as go
+from plotly.io.json import to_json_plotly
+
+from OpenEIT.dashboard.modes.imaging import (face_levels, MESH_COLORSCALE,
+                                             LUT_SIZE)
+from OpenEIT.reconstruction import JacReconstruction
+
+
+def map_z2color(zval, colormap, vmin, vmax):
+    t = (zval - vmin) / float((vmax - vmin))
+    R, G, B, alpha = colormap(t)
+    return 'rgb(' + '{:d}'.format(int(R*255+0.5)) + ',' + \
+        '{:d}'.format(int(G*255+0.5)) + ',' + '{:d}'.format(int(B*255+0.5)) + ')'
+
+
+def former_tick(x, y, tri, img, vmin, vmax):
+    points3D = np.vstack((x, y, img)).T
+    tri_vertices = map(lambda index: points3D[index], tri)
+    zmean = [np.mean(t[:, 2]) for t in tri_vertices]
+    facecolor = [map_z2color(zz, cm.plasma, vmin, vmax) for zz in zmean]
+    I, J, K = ([triplet[c] for triplet in tri] for c in range(3))
+    data = [go.Mesh3d(x=x, y=y, z=np.zeros(len(img)), facecolor=facecolor,
+                      i=I, j=J, k=K, name='')]
+    return {'data': data}, facecolor
+
+
+def patched_tick(tri, img, vmin, vmax):
+    intensity = face_levels(img, tri, vmin, vmax)
+    patched = dash.Patch()
+    patched['data'][0]['intensity'] = intensity
+    return patched, intensity
+
+
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        res = func()
+    return (time.perf_counter() - start) / repeat, res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n-el', type=int, default=32)
+    ap.add_argument('--repeat', type=int, default=50)
+    args = ap.parse_args()
+
+    recon = JacReconstruction(args.n_el)
+    pts = recon.mesh_obj['node']
+    x, y, tri = pts[:, 0], pts[:, 1], recon.mesh_obj['element']
+    img = np.random.RandomState(0).randn(x.shape[0])
+    vmin, vmax = -1., 1.
+    print('%d electrodes: %d nodes, %d triangles' % (args.n_el, x.shape[0],
+                                                     tri.shape[0]))
+
+    t_old, (fig_old, facecolor) = timeit(
+        lambda: former_tick(x, y, tri, img, vmin, vmax), args.repeat)
+    size_old = len(to_json_plotly(fig_old))
+    # the serialization is part of the work of every tick
+    t_old += timeit(lambda: to_json_plotly(fig_old), 5)[0]
+
+    t_new, (patch, levels) = timeit(
+        lambda: patched_tick(tri, img, vmin, vmax), args.repeat)
+    size_new = len(to_json_plotly(patch.to_plotly_json()))
+    t_new += timeit(lambda: to_json_plotly(patch.to_plotly_json()), 5)[0]
+
+    assert [MESH_COLORSCALE[i][1] for i in levels] == facecolor
+    assert levels.max() < LUT_SIZE
+
+    print('%-22s %10s %12s' % ('', 'ms/tick', 'bytes/tick'))
+    print('%-22s %10.2f %12d' % ('colour strings, full', 1e3 * t_old, size_old))
+    print('%-22s %10.2f %12d' % ('levels, patch', 1e3 * t_new, size_new))
+    print('speedup %.0fx, payload %.0fx smaller, same colours' % (
+        t_old / t_new, size_old / size_new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Line protocol decoding: parse_any_line vs. parse_frame vs. parse_frames.
+
+    Generates synthetic lines for the modes 'a', 'b' and 'd', checks that
+    the three decoders agree (including a few malformed lines that must be
+    rejected) and reports the throughput in frames per second.
+
+    usage: python benchmarks/bench_parser.py [--n-values 896] [--n-lines 2048]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenEIT.backend.serialhandler import (parse_any_line, parse_frame,
+                                           parse_frames)
+
+FORMATS = {
+    'a': ('%s', ','),
+    'b': ('magnitudes : %s', ';'),
+    'd': ('magnitudes : %s', ','),
+}
+
+
+def make_lines(mode, n_lines, n_values, seed=0):
+    rng = np.random.RandomState(seed)
+    fmt, sep = FORMATS[mode]
+    lines = []
+    for _ in range(n_lines):
+        values = rng.randn(n_values)
+        lines.append(fmt % sep.join(repr(float(v)) for v in values) + sep)
+    return lines
+
+
+def check(mode, lines):
+    """ the three decoders accept and reject the same lines """
+    fmt, sep = FORMATS[mode]
+    bad = [fmt % ('1.0' + sep + 'x'), fmt % (sep + sep.join(['2.5'] * 3))]
+    for line in lines[:16] + bad:
+        ref = parse_any_line(line, mode)
+        res = parse_frame(line, mode)
+        assert (ref is None) == (res is None), line[:40]
+        if ref is not None:
+            assert np.array_equal(np.array(ref), res), line[:40]
+    ref = np.array([parse_any_line(line, mode) for line in lines])
+    assert np.array_equal(parse_frames(lines, mode), ref), mode
+
+
+def timeit(func, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        best = min(best, time.time() - start)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n-values', type=int, default=896)
+    ap.add_argument('--n-lines', type=int, default=2048)
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    print('%4s %16s %16s %16s' % ('mode', 'parse_any_line', 'parse_frame',
+                                  'parse_frames'))
+    for mode in sorted(FORMATS):
+        lines = make_lines(mode, args.n_lines, args.n_values)
+        check(mode, lines)
+        out = np.empty((args.n_lines, args.n_values))
+        timings = [
+            timeit(lambda: [parse_any_line(l, mode) for l in lines],
+                   args.repeat),
+            timeit(lambda: [parse_frame(l, mode) for l in lines],
+                   args.repeat),
+            timeit(lambda: parse_frames(lines, mode, out=out), args.repeat),
+        ]
+        print('%4s %s' % (mode, ' '.join('%10.0f fr/s' % (args.n_lines / t)
+                                         for t in timings)))
+
+
+if __name__ == "__main__":
+    main()
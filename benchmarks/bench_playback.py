@@ -0,0 +1,85 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Reconstruction throughput on a recorded capture, without hardware.
+
+    A PlaybackEngine plays the recording into a FrameRing read by a
+    ReconstructionWorker, as in the dashboard. At --speed max the engine
+    waits for the reconstruction, the achieved frame rate is the
+    throughput of the pipeline. At a finite speed it shows whether the
+    pipeline keeps up with N times the recorded rate (the lag grows when
+    it does not).
+
+    usage: python benchmarks/bench_playback.py [capture.oeitf|simdata.txt]
+               [--speed max|N] [--seconds 10] [--algorithm jac]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import queue
+import sys
+import time
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenEIT.backend.playback import PlaybackEngine
+from OpenEIT.backend.recording import Recording
+from OpenEIT.backend.ringbuffer import FrameRing
+from OpenEIT.reconstruction import ReconstructionWorker
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('path', nargs='?', default=os.path.join(HERE, 'simdata.txt'))
+    ap.add_argument('--speed', default='max')
+    ap.add_argument('--seconds', type=float, default=10.)
+    ap.add_argument('--algorithm', default='jac')
+    ap.add_argument('--n-el', type=int, default=None)
+    args = ap.parse_args()
+
+    rec = Recording.load(args.path)
+    n_el = args.n_el or rec.n_el
+    print('%s: %d frames of %d values, %d electrodes' % (
+        args.path, len(rec), rec.n_values, n_el))
+
+    ring = FrameRing(capacity=64)
+    reader = ring.reader('reconstruction')
+    images = queue.Queue()
+    worker = ReconstructionWorker()
+    worker.reset(reader, images, args.algorithm, n_el)
+    worker.start()
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    engine = PlaybackEngine(rec, ring, speed=speed, loop=True,
+                            pace_reader=reader)
+    engine.start()
+    engine.play()
+    start = time.time()
+    n_images = 0
+    while time.time() - start < args.seconds:
+        try:
+            images.get(timeout=0.5)
+            n_images += 1
+        except queue.Empty:
+            pass
+    elapsed = time.time() - start
+    stats = engine.stats()
+    engine.close()
+
+    print('speed %s: %d frames played, %.1f frames/s (target %s), '
+          '%.1f images/s' % (
+              args.speed, stats['frames_played'], stats['frame_rate'],
+              'none' if stats['target_rate'] is None else
+              '%.1f' % stats['target_rate'], n_images / elapsed))
+    print('lag: %.3f s behind schedule, %d frames unread, %d overruns' % (
+        stats['lag_seconds'], reader.qsize(), reader.overruns))
+
+
+if __name__ == "__main__":
+    main()
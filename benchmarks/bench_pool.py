@@ -0,0 +1,93 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Replay frames at maximum speed through the ReconstructionPool.
+
+    The frames are put in a blocking FrameRing (no frame is lost) and the
+    images are collected from the output queue. The script checks that
+    they arrive in frame order and equal reconstruct_batch, and reports
+    the throughput and the per-stage timings for every pool size.
+
+    usage: python benchmarks/bench_pool.py [--algorithm jac] [--n-el 16]
+               [--workers 1 2 4] [--backend thread]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenEIT.backend.ringbuffer import FrameRing
+from OpenEIT.reconstruction.pool import ReconstructionPool, STAGES
+
+
+def run(frames, reference_imgs, algorithm, n_el, n_workers, backend):
+    ring = FrameRing(capacity=64, policy='block', block_timeout=60.)
+    images = queue.Queue()
+    pool = ReconstructionPool(n_workers=n_workers, backend=backend)
+    pool.reset(ring.reader('pool'), images, algorithm, n_el)
+    pool.start()
+    # warm up (process workers build their reconstruction)
+    ring.put(frames[0])
+    images.get(timeout=600)
+    pool.timings.reset()
+
+    start = time.time()
+    got = []
+    for frame in frames:
+        ring.put(frame)
+        while True:
+            try:
+                got.append(images.get_nowait())
+            except queue.Empty:
+                break
+    while len(got) < len(frames):
+        got.append(images.get(timeout=60))
+    elapsed = time.time() - start
+    pool.close()
+
+    got = np.array([np.ravel(g) for g in got])
+    assert np.allclose(got, reference_imgs, equal_nan=True), 'order/values'
+    timings = pool.timings.summary()
+    print('%8s %3d %10.1f   %s' % (backend, n_workers, len(frames) / elapsed,
+                                   ' '.join('%6.3f' % timings[s]['mean_ms']
+                                            for s in STAGES)))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--algorithm', default='jac')
+    ap.add_argument('--n-el', type=int, default=16)
+    ap.add_argument('--n-frames', type=int, default=2000)
+    ap.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    ap.add_argument('--backend', nargs='+', default=['thread'])
+    args = ap.parse_args()
+
+    from OpenEIT.reconstruction.pool import _make_reconstruction
+    recon = _make_reconstruction(args.algorithm, args.n_el)
+    rng = np.random.RandomState(0)
+    n_meas = args.n_el * (args.n_el - 4)
+    frames = 1 + 0.01 * rng.rand(args.n_frames, n_meas)
+    # the first frame is the reference of the pool
+    reference_imgs = recon.reconstruct_batch(frames, frames[0])
+
+    print('cores: %d' % os.cpu_count())
+    print('%8s %3s %10s   %s (mean ms)' % ('backend', 'N', 'frames/s',
+                                           ' '.join(s[:6] for s in STAGES)))
+    for backend in args.backend:
+        for n_workers in args.workers:
+            run(frames, reference_imgs, args.algorithm, args.n_el, n_workers,
+                backend)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Payload and latency of the images pushed over Server-Sent Events vs
+    polled by the imaging interval.
+
+    The polled path sends the colour levels of the mesh in a dash.Patch on
+    every tick of the interval, whether a new image exists or not, and an
+    image waits on average half an interval before it is sent. The pushed
+    path sends every new image once, when it is published, as float32 or
+    uint8 levels. The latency is measured from ImageHub.publish to the
+    event read from the stream.
+
+    usage: python benchmarks/bench_push.py [--n-el 32] [--repeat 200]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dash
+from plotly.io.json import to_json_plotly
+
+from OpenEIT.dashboard.modes.imaging import face_levels, PLOT_REFRESH_INTERVAL
+from OpenEIT.dashboard.push import ImageHub, sse_events
+from OpenEIT.reconstruction import JacReconstruction
+
+
+def patch_size(tri, img):
+    patched = dash.Patch()
+    patched['data'][0]['intensity'] = face_levels(img, tri, -1., 1.)
+    return len(to_json_plotly(patched.to_plotly_json()))
+
+
+def push_latency(img, dtype, repeat):
+    """ seconds from publish to the event, and bytes of the event """
+    hub = ImageHub()
+    events = sse_events(hub, dtype)
+    next(events)  # retry
+    published = []
+    received = threading.Event()
+
+    def publisher():
+        # one image in flight, the stream would skip to the latest
+        for _ in range(repeat):
+            time.sleep(0.002)
+            received.clear()
+            published.append(time.perf_counter())
+            hub.publish(img)
+            received.wait()
+
+    thread = threading.Thread(target=publisher)
+    thread.start()
+    latencies, size = [], 0
+    for n in range(repeat):
+        event = next(events)
+        latencies.append(time.perf_counter() - published[n])
+        size = len(event)
+        received.set()
+    thread.join()
+    events.close()
+    return np.array(latencies), size
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n-el', type=int, default=32)
+    ap.add_argument('--repeat', type=int, default=200)
+    args = ap.parse_args()
+
+    recon = JacReconstruction(args.n_el)
+    n_nodes = recon.mesh_obj['node'].shape[0]
+    tri = recon.mesh_obj['element']
+    img = np.random.RandomState(0).randn(n_nodes)
+    print('%d electrodes: %d nodes, %d triangles' % (args.n_el, n_nodes,
+                                                     tri.shape[0]))
+
+    polled = patch_size(tri, img)
+    print('%-18s %12s %14s %14s' % ('', 'bytes/image', 'median ms', 'p99 ms'))
+    print('%-18s %12d %14.1f %14.1f' % (
+        'polled patch', polled, PLOT_REFRESH_INTERVAL / 2.,
+        PLOT_REFRESH_INTERVAL))
+    for dtype in ('float32', 'uint8'):
+        latencies, size = push_latency(img, dtype, args.repeat)
+        print('%-18s %12d %14.2f %14.2f' % (
+            'pushed ' + dtype, size, 1e3 * np.median(latencies),
+            1e3 * np.percentile(latencies, 99)))
+    print('the polled patch is sent on every tick (%.0f ms) even without '
+          'a new image' % PLOT_REFRESH_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Streaming recorder: write rate, file size and memory over a long session.
+
+    Writes `--n-frames` frames of 896 values (32 electrodes) through the
+    Recorder at full speed, then checks the index, the frames read back,
+    the text export and the recovery of a file that was not closed. The
+    resident memory is sampled while writing, it must stay flat.
+
+    usage: python benchmarks/bench_recorder.py [--n-frames 20000]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenEIT.backend import recorder
+from OpenEIT.backend.serialhandler import parse_frame
+
+
+def _rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2.**20
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n-frames', type=int, default=20000)
+    ap.add_argument('--n-values', type=int, default=896)
+    ap.add_argument('--rate', type=float, default=0,
+                    help='frames per second, 0 for full speed')
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'session.oeit')
+    rng = np.random.RandomState(0)
+    frames = rng.randn(64, args.n_values)
+
+    rss = [_rss_mb()]
+    start = time.time()
+    rec = recorder.Recorder(path, mode='d')
+    for i in range(args.n_frames):
+        while not rec.write(frames[i % 64], timestamp=i * 0.1):
+            # full speed outruns the disk, wait instead of dropping
+            time.sleep(0.001)
+        if args.rate:
+            time.sleep(1. / args.rate)
+        if i % 1000 == 0:
+            rss.append(_rss_mb())
+    rec.close()
+    elapsed = time.time() - start
+    rss.append(_rss_mb())
+
+    size = os.path.getsize(path)
+    print('%d frames in %.2f s (%.0f frames/s), %.1f MB on disk' % (
+        args.n_frames, elapsed, args.n_frames / elapsed, size / 2.**20))
+    print('RSS MB: start %.1f  max %.1f  end %.1f' % (rss[0], max(rss),
+                                                      rss[-1]))
+
+    with open(path, 'rb') as f:
+        mode, _ = recorder.read_header(f)
+        index = recorder.read_index(f)
+        assert mode == 'd' and index['n_frames'].sum() == args.n_frames
+        entry = index[len(index) // 2]
+        times, values = recorder.read_chunk(f, entry)
+        first = int(entry['first_frame'])
+        assert np.array_equal(values[0], frames[first % 64])
+        assert times[0] == first * 0.1
+
+    # text export: parses back to the same frames
+    line = next(recorder.iter_lines(path)).splitlines()[3]
+    assert np.array_equal(parse_frame(line, 'd'), frames[3])
+
+    # a recording that was not closed is indexed by scanning its chunks
+    with open(path, 'rb') as f:
+        data = f.read()
+    cut = int(index[-1]['offset']) + 100
+    with open(path + '.partial', 'wb') as f:
+        f.write(data[:cut])
+    with open(path + '.partial', 'rb') as f:
+        partial = recorder.read_index(f)
+    assert np.array_equal(partial, index[:-1])
+    print('index: %d chunks, partial file: %d chunks recovered' % (
+        len(index), len(partial)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Playback loading: text capture parsed into lists vs memory-mapped frames.
+
+    Builds a text capture of `--n-frames` frames from simdata.txt, converts
+    it once to a frame file and compares the time to open it and to reach
+    random frames with the former list-of-lists loading of FilePlayback.
+
+    usage: python benchmarks/bench_recording.py [--n-frames 20000]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenEIT.backend import recording
+from OpenEIT.backend.serialhandler import parse_any_line
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n-frames', type=int, default=20000)
+    ap.add_argument('--n-seeks', type=int, default=10000)
+    args = ap.parse_args()
+
+    with open(os.path.join(HERE, 'simdata.txt')) as f:
+        lines = [line for line in f if line.strip()]
+    tmp = tempfile.mkdtemp()
+    text_path = os.path.join(tmp, 'capture.txt')
+    with open(text_path, 'w') as f:
+        for i in range(args.n_frames):
+            f.write(lines[i % len(lines)])
+    print('text capture: %d frames, %.1f MB' % (
+        args.n_frames, os.path.getsize(text_path) / 2.**20))
+
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with open(text_path) as f:
+        old = [parse_any_line(line, 'd') for line in f]
+    old = [frame for frame in old if frame is not None]
+    t_old = time.perf_counter() - start
+    rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('list of lists:   load %8.3f s, peak RSS +%.0f MB' % (
+        t_old, (rss1 - rss0) / 1024.))
+
+    frame_path = os.path.join(tmp, 'capture.oeitf')
+    start = time.perf_counter()
+    n = recording.convert(text_path, frame_path, sample_rate=10.)
+    t_convert = time.perf_counter() - start
+    print('convert (once):  %8.3f s, %.1f MB' % (
+        t_convert, os.path.getsize(frame_path) / 2.**20))
+
+    start = time.perf_counter()
+    rec = recording.Recording.open(frame_path)
+    t_open = time.perf_counter() - start
+    assert len(rec) == n == len(old)
+    print('memory-mapped:   open %8.6f s' % t_open)
+
+    order = np.random.RandomState(0).randint(0, n, args.n_seeks)
+    start = time.perf_counter()
+    for i in order:
+        frame = rec.frame(i)
+        frame.sum()
+    t_seek = time.perf_counter() - start
+    print('random access:   %.2f us per frame' % (1e6 * t_seek / args.n_seeks))
+
+    i = int(order[0])
+    assert np.array_equal(rec.frame(i), old[i])
+    assert rec.frames(10, 20).base is not None
+    assert rec.times[i] == i / 10.
+    rec.close()
+
+
+if __name__ == "__main__":
+    main()
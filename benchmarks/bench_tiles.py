@@ -0,0 +1,93 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Cost of the imaging tick for several viewers, plotly figures vs
+    server-rendered tiles.
+
+    With figures every viewer's tick builds and serializes its own
+    Mesh3d (the full figure once, then a dash.Patch of the colour levels).
+    With tiles every image is rasterized and encoded once, through the
+    pixel to triangle lookup table of MeshRaster, and every viewer gets
+    the cached bytes.
+
+    usage: python benchmarks/bench_tiles.py [--n-el 32] [--viewers 10]
+           [--compress-level 6]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dash
+from plotly.io.json import to_json_plotly
+
+from OpenEIT.dashboard.modes.imaging import face_levels
+from OpenEIT.dashboard.tiles import MeshRaster, TileRenderer
+from OpenEIT.reconstruction import JacReconstruction
+
+
+def patch_tick(tri, img):
+    patched = dash.Patch()
+    patched['data'][0]['intensity'] = face_levels(img, tri, -1., 1.)
+    return to_json_plotly(patched.to_plotly_json())
+
+
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        res = func()
+    return (time.perf_counter() - start) / repeat, res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n-el', type=int, default=32)
+    ap.add_argument('--viewers', type=int, default=10)
+    ap.add_argument('--size', type=int, default=256)
+    ap.add_argument('--repeat', type=int, default=50)
+    ap.add_argument('--compress-level', type=int, default=6)
+    args = ap.parse_args()
+
+    recon = JacReconstruction(args.n_el)
+    pts = recon.mesh_obj['node']
+    x, y, tri = pts[:, 0], pts[:, 1], recon.mesh_obj['element']
+    images = np.random.RandomState(0).randn(args.repeat, x.shape[0])
+    print('%d electrodes: %d triangles, %d viewers, %d px tiles' % (
+        args.n_el, tri.shape[0], args.viewers, args.size))
+
+    t_lut, _ = timeit(lambda: MeshRaster(x, y, tri, args.size), 3)
+
+    t_patch, patch = timeit(lambda: patch_tick(tri, images[0]), args.repeat)
+
+    renderer = TileRenderer('png', args.size, capacity=args.repeat,
+                            compress_level=args.compress_level)
+    renderer.set_range(-1., 1.)
+    renderer.set_mesh(x, y, tri)
+    start = time.perf_counter()
+    for seq, img in enumerate(images, 1):
+        renderer.on_image(seq, img)
+    t_render = (time.perf_counter() - start) / args.repeat
+    t_hit, tile = timeit(lambda: renderer.get(args.repeat), args.repeat)
+
+    v = args.viewers
+    print('lookup table, once per mesh: %.1f ms' % (1e3 * t_lut))
+    print('%-16s %14s %14s' % ('', 'ms/image', 'bytes/viewer'))
+    print('%-16s %14.2f %14d' % ('figure patches', 1e3 * t_patch * v,
+                                 len(patch)))
+    print('%-16s %14.2f %14d' % ('cached tiles', 1e3 * (t_render + t_hit * v),
+                                 len(tile)))
+    print('render and encode: %.2f ms per image, %.4f ms per cached hit' % (
+        1e3 * t_render, 1e3 * t_hit))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    CPU time per sample of the time series mode, former per-sample loop
+    vs batches on ring buffers.
+
+    The former loop appended each sample to lists (popping the front),
+    rebuilt a 20 sample window with np.append, ran lfilter over it and
+    ran signal.welch over the whole buffer, for every sample. Now every
+    tick handles the samples read since the last one as one batch:
+    SampleRing, lfilter with the carried state (zi) and a Welch
+    accumulator of the new segments. Both filtered series are compared.
+
+    usage: python benchmarks/bench_time_series.py [--rates 25,1000,10000]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+from scipy import signal
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenEIT.dashboard.modes import time_series as ts
+from OpenEIT.dashboard.streaming import (SampleRing, StreamingFilter,
+                                         WelchAccumulator)
+
+# one dashboard tick
+TICK = ts.PLOT_REFRESH_INTERVAL / ts.S_TO_MS
+
+
+class Former:
+    """ the per-sample loop of Timeseriesgui.process_data before """
+
+    def __init__(self):
+        self.b, self.a = signal.butter(ts.FILTER_ORDER, ts.CUTOFF,
+                                       btype=ts.FILTER_TYPE)
+        self.window = np.zeros(20)
+        self.x, self.y, self.y_filtered = [], [], []
+
+    def tick(self, batch):
+        t = datetime.now()
+        for value in batch:
+            self.y.append(value)
+            self.x.append(t)
+            if len(self.y) > ts.BUFFER_SIZE:
+                self.y.pop(0)
+                self.x.pop(0)
+            self.window = np.append(self.window[1:], value)
+            self.y_filtered.append(
+                signal.lfilter(self.b, self.a, self.window)[-1])
+            if len(self.y_filtered) > ts.BUFFER_SIZE:
+                self.y_filtered.pop(0)
+            nperseg = min(ts.NSPERG, len(self.y))
+            self.freqs, self.psd = signal.welch(self.y, nperseg=nperseg,
+                                                fs=ts.SAMPLING_FREQUENCY)
+
+
+class Batched:
+    """ Timeseriesgui.process_data now """
+
+    def __init__(self):
+        b, a = signal.butter(ts.FILTER_ORDER, ts.CUTOFF, btype=ts.FILTER_TYPE)
+        self.lowpass = StreamingFilter(b, a)
+        self.x = SampleRing(ts.BUFFER_SIZE, dtype='datetime64[us]')
+        self.y = SampleRing(ts.BUFFER_SIZE)
+        self.y_filtered = SampleRing(ts.BUFFER_SIZE)
+        self.welch = WelchAccumulator(ts.NSPERG, fs=ts.SAMPLING_FREQUENCY,
+                                      n_segments=ts.WELCH_SEGMENTS)
+        self.tdelta = np.timedelta64(40000, 'us')
+
+    def tick(self, batch):
+        n = batch.size
+        t = np.datetime64(datetime.now(), 'us')
+        self.x.extend(t + np.arange(1, n + 1) * self.tdelta)
+        self.y.extend(batch)
+        self.y_filtered.extend(self.lowpass.process(batch))
+        self.welch.update(batch)
+        psd = self.welch.psd()
+        if psd is None:
+            y = self.y.view()
+            psd = signal.welch(y, nperseg=len(y), fs=ts.SAMPLING_FREQUENCY)
+        self.freqs, self.psd = psd
+
+
+def run(impl, samples, per_tick, budget):
+    """ seconds per sample, ticks run within `budget` seconds """
+    start = time.perf_counter()
+    done = 0
+    while done < samples.size and time.perf_counter() - start < budget:
+        impl.tick(samples[done:done + per_tick])
+        done += per_tick
+    return (time.perf_counter() - start) / done, done
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rates', default='25,1000,10000',
+                    help='samples per second, comma separated')
+    ap.add_argument('--seconds', type=float, default=10.,
+                    help='seconds of signal per rate')
+    args = ap.parse_args()
+
+    rs = np.random.RandomState(0)
+    print('%8s %16s %16s %8s' % ('Hz', 'former us/sample', 'batch us/sample',
+                                 'speedup'))
+    for rate in [int(r) for r in args.rates.split(',')]:
+        samples = 100 + rs.randn(int(rate * args.seconds))
+        per_tick = max(int(rate * TICK), 1)
+        t_old, n_old = run(Former(), samples, per_tick, budget=3.)
+        new = Batched()
+        t_new, n_new = run(new, samples, per_tick, budget=3.)
+        print('%8d %16.1f %16.2f %7.0fx' % (rate, 1e6 * t_old, 1e6 * t_new,
+                                           t_old / t_new))
+        # real time needs less than 1 / rate seconds per sample
+        if t_new * rate > 1:
+            print('%8s batch path slower than real time' % '')
+
+    # the same filtered series (the former window truncates the IIR)
+    samples = 100 + rs.randn(2000)
+    old, new = Former(), Batched()
+    for start in range(0, samples.size, 100):
+        old.tick(samples[start:start + 100])
+        new.tick(samples[start:start + 100])
+    print('max filtered difference %.2e' % np.max(np.abs(
+        np.asarray(old.y_filtered) - new.y_filtered.view())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    UI latency under reconstruction load: thread worker vs. process worker.
+
+    A producer thread feeds frames to the worker at full rate through a
+    FrameRing, while the main thread plays the part of a Dash callback: it
+    wakes up every `--period` seconds and runs a short pure-Python job. The
+    report lists the reconstruction rate and the callback latency (wake-up
+    delay + run time) percentiles for both worker backends.
+
+    usage: python benchmarks/bench_worker.py [--algorithm jac] [--n-el 16]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenEIT.backend.ringbuffer import FrameRing
+from OpenEIT.reconstruction import (ReconstructionWorker,
+                                    ProcessReconstructionWorker)
+
+
+def callback():
+    """ stand-in for a Dash callback: some pure-Python work """
+    return sum(i * i for i in range(20000))
+
+
+def run(backend, algorithm, n_el, duration, period):
+    ring = FrameRing(capacity=64)
+    images = queue.Queue()
+    if backend == 'process':
+        worker = ProcessReconstructionWorker()
+    else:
+        worker = ReconstructionWorker()
+    worker.reset(ring.reader('reconstruction'), images, algorithm, n_el)
+    worker.baseline()
+    worker.start()
+
+    rng = np.random.RandomState(0)
+    n_meas = n_el * (n_el - 4)
+    frames = 1 + 0.01 * rng.rand(32, n_meas)
+    stop = threading.Event()
+
+    def producer():
+        i = 0
+        while not stop.is_set():
+            ring.put(frames[i % len(frames)])
+            i += 1
+            time.sleep(0.0005)
+
+    feeder = threading.Thread(target=producer, daemon=True)
+    feeder.start()
+
+    # idle reference: the callback alone
+    t0 = time.time()
+    callback()
+    t_alone = time.time() - t0
+
+    latencies = []
+    n_images = 0
+    start = time.time()
+    while time.time() - start < duration:
+        due = time.time() + period
+        time.sleep(period)
+        callback()
+        latencies.append(time.time() - due)
+        while True:
+            try:
+                images.get_nowait()
+                n_images += 1
+            except queue.Empty:
+                break
+    elapsed = time.time() - start
+    stop.set()
+    feeder.join()
+    worker.stop_reconstructing()
+    if hasattr(worker, 'close'):
+        worker.close()
+
+    lat = np.array(latencies) * 1e3
+    print('%8s %10.1f %10.2f %10.2f %10.2f %10.2f' % (
+        backend, n_images / elapsed, t_alone * 1e3, np.median(lat),
+        np.percentile(lat, 95), lat.max()))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--algorithm', default='jac')
+    ap.add_argument('--n-el', type=int, default=16)
+    ap.add_argument('--duration', type=float, default=5.)
+    ap.add_argument('--period', type=float, default=0.05)
+    ap.add_argument('--backends', nargs='+', default=['thread', 'process'])
+    args = ap.parse_args()
+
+    print('%8s %10s %10s %10s %10s %10s' % ('backend', 'images/s',
+                                            'idle ms', 'p50 ms', 'p95 ms',
+                                            'max ms'))
+    for backend in args.backends:
+        run(backend, args.algorithm, args.n_el, args.duration, args.period)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+
+# Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+# Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+
+    Replay the same frames over a PTY in the ASCII and the binary encoding.
+
+    A SerialHandler is connected to the slave end of a pseudo terminal and
+    the frames are written to the master end, once as ASCII lines and once
+    as binary frames (float32 and int16). The decoded frames are checked
+    against the sent ones, and the wire size is converted to the frame rate
+    a 115200 baud UART can carry. Some garbage bytes and a corrupted frame
+    are injected in the binary stream to exercise the resynchronization.
+
+    .. note:: PTYs only exist on POSIX systems.
+
+    usage: python benchmarks/replay_framing.py [--n-values 896] [--n-frames 200]
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+# allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenEIT.backend.serialhandler import SerialHandler
+from OpenEIT.backend import framing
+
+BAUD = 115200
+BITS_PER_BYTE = 10  # 8N1: start + 8 data + stop bits
+
+
+def encode(frames, encoding, mode):
+    """ wire bytes of every frame and the values the host should decode """
+    if encoding == 'ascii':
+        chunks = [framing.encode_line(v, mode).encode() for v in frames]
+        return chunks, frames
+    dtype = framing.DTYPE_FLOAT32 if encoding == 'float32' else framing.DTYPE_INT16
+    chunks = [framing.encode_frame(v, mode, dtype=dtype) for v in frames]
+    expected = [framing.FrameDecoder().feed(c)[0][1] for c in chunks]
+    return chunks, expected
+
+
+def replay(chunks, framing_name, mode, n_expected, inject=False, timeout=30.):
+    """ write `chunks` to a PTY and collect what the handler decodes """
+    q = queue.Queue()
+    handler = SerialHandler(q)
+    handler.setmode(mode)
+    master_fd, slave_fd = os.openpty()
+    handler.connect(os.ttyname(slave_fd), framing=framing_name)
+
+    def writer():
+        for i, chunk in enumerate(chunks):
+            if inject and i == 1:
+                os.write(master_fd, b'\x00\xa5garbage\xa5')
+            if inject and i == 2:
+                bad = bytearray(chunk)
+                bad[10] ^= 0xff
+                os.write(master_fd, bytes(bad))
+            os.write(master_fd, chunk)
+
+    start = time.time()
+    thread = threading.Thread(target=writer)
+    thread.start()
+    received = []
+    try:
+        while len(received) < n_expected:
+            received.append(q.get(timeout=timeout))
+    except queue.Empty:
+        pass
+    elapsed = time.time() - start
+    thread.join()
+    reader = handler._reader_thread
+    decoder = getattr(reader.protocol, 'decoder', None) if reader else None
+    handler.disconnect()
+    os.close(master_fd)
+    os.close(slave_fd)
+    return received, elapsed, decoder
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n-values', type=int, default=896,
+                    help='values per frame (896 for 32 electrodes)')
+    ap.add_argument('--n-frames', type=int, default=200)
+    ap.add_argument('--mode', default='d')
+    args = ap.parse_args()
+
+    rng = np.random.RandomState(0)
+    frames = [rng.randn(args.n_values) * 0.1 for _ in range(args.n_frames)]
+
+    print('%8s %12s %14s %14s %10s' % ('encoding', 'bytes/frame',
+                                       'frames/s@115k', 'host frames/s',
+                                       'max error'))
+    for encoding in ('ascii', 'float32', 'int16'):
+        chunks, expected = encode(frames, encoding, args.mode)
+        framing_name = 'ascii' if encoding == 'ascii' else 'binary'
+        inject = framing_name == 'binary'
+        received, elapsed, decoder = replay(chunks, framing_name, args.mode,
+                                            len(expected), inject=inject)
+        assert len(received) == len(expected), (
+            '%s: %d of %d frames received' % (encoding, len(received),
+                                              len(expected)))
+        for got, want in zip(received, expected):
+            assert np.array_equal(np.asarray(got), want), encoding
+        if decoder is not None:
+            assert decoder.n_crc_errors >= 1 and decoder.n_skipped_bytes > 0
+        err = max(np.max(np.abs(np.asarray(e) - f))
+                  for e, f in zip(expected, frames))
+        size = np.mean([len(c) for c in chunks])
+        print('%8s %12.0f %14.1f %14.1f %10.1e' % (
+            encoding, size, BAUD / BITS_PER_BYTE / size,
+            len(received) / elapsed, err))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+/*
+ * Copyright (c) Mindseye Biomedical LLC. All rights reserved.
+ * Distributed under the (new) CC BY-NC-SA 4.0 License. See LICENSE.txt for more info.
+ *
+ * Renders the images pushed by the server (OpenEIT/dashboard/push.py)
+ * into the imaging graph. The stream is opened while the page holds the
+ * #image-stream element; the Dash callbacks still send the figure
+ * geometry and the colour range (layout.meta), this only restyles the
+ * colours of every new image.
+ */
+(function () {
+    'use strict';
+
+    var LUT_SIZE = 256;
+    var NAN_LEVEL = 255;
+    var source = null;
+
+    function decode(msg) {
+        var raw = atob(msg.data);
+        var bytes = new Uint8Array(raw.length);
+        for (var n = 0; n < raw.length; n++) {
+            bytes[n] = raw.charCodeAt(n);
+        }
+        if (msg.dtype === 'uint8') {
+            var values = new Float64Array(bytes.length);
+            for (var m = 0; m < bytes.length; m++) {
+                values[m] = bytes[m] === NAN_LEVEL ? NaN :
+                    msg.offset + bytes[m] * msg.step;
+            }
+            return values;
+        }
+        // little-endian float32, as every browser host is
+        return new Float32Array(bytes.buffer);
+    }
+
+    // the colour level of every triangle, as face_levels in imaging.py
+    function faceLevels(img, trace, vmin, vmax) {
+        var i = trace.i, j = trace.j, k = trace.k;
+        var levels = new Array(i.length);
+        for (var f = 0; f < i.length; f++) {
+            var t = ((img[i[f]] + img[j[f]] + img[k[f]]) / 3 - vmin) / (vmax - vmin);
+            var level = Math.floor((isNaN(t) ? 0 : t) * LUT_SIZE);
+            levels[f] = Math.min(Math.max(level, 0), LUT_SIZE - 1);
+        }
+        return levels;
+    }
+
+    function rows(img, shape) {
+        var z = [];
+        for (var r = 0; r < shape[0]; r++) {
+            z.push(Array.prototype.slice.call(img, r * shape[1], (r + 1) * shape[1]));
+        }
+        return z;
+    }
+
+    function render(msg) {
+        var gd = document.querySelector('#live-update-image .js-plotly-plot');
+        if (!gd || !gd._fullData || !gd._fullData.length || !window.Plotly) {
+            return;
+        }
+        var trace = gd._fullData[0];
+        var img = decode(msg);
+        if (trace.type === 'mesh3d') {
+            var meta = gd.layout.meta;
+            if (!meta || msg.shape.length !== 1 || img.length !== trace.x.length) {
+                // the geometry of another image, wait for the callback
+                return;
+            }
+            Plotly.restyle(gd, {intensity: [faceLevels(img, trace, meta.vmin, meta.vmax)]}, [0]);
+        } else if (trace.type === 'heatmap' && msg.shape.length === 2) {
+            Plotly.restyle(gd, {z: [rows(img, msg.shape)]}, [0]);
+        }
+    }
+
+    function check() {
+        var marker = document.getElementById('image-stream');
+        if (marker && !source) {
+            source = new EventSource(marker.getAttribute('data-url'));
+            source.addEventListener('image', function (event) {
+                render(JSON.parse(event.data));
+            });
+        } else if (!marker && source) {
+            source.close();
+            source = null;
+        }
+    }
+
+    // the Dash pages are swapped without reloading
+    setInterval(check, 1000);
+})();